@@ -1,18 +1,92 @@
 import numpy as np
 import cv2
 from typing import Dict, List, Tuple, Optional
-from collections import deque
-import math
+import logging
+from scipy.optimize import linear_sum_assignment
+from .numba_compat import njit, prange, NUMBA_AVAILABLE
+from .trajectory_soa import Trajectory
+
+logger = logging.getLogger(__name__)
+
+# До этого размера задачи (детекций и трекеров) скалярный цикл быстрее
+# вызовов NumPy и венгерского алгоритма
+SCALAR_MAX_SIZE = 8
+# Стоимость для пар за порогом расстояния
+GATE_COST = 1e9
+# С этого числа трекеров матрица стоимостей заполняется параллельно (если есть Numba)
+PARALLEL_MIN_TRACKERS = 32
+# Коэффициент экспоненциального сглаживания скорости
+VELOCITY_SMOOTHING = 0.5
+# Максимальное число кадров, на которое экстраполируем положение
+MAX_PREDICTION_FRAMES = 10
+
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _fill_cost_matrix(det_centers, trk_centers, max_dist2, gate_cost, out):
+    """Параллельно по трекерам заполняет матрицу стоимостей с порогом расстояния"""
+    n = det_centers.shape[0]
+    m = trk_centers.shape[0]
+    for j in prange(m):
+        tx = float(trk_centers[j, 0])
+        ty = float(trk_centers[j, 1])
+        for i in range(n):
+            dx = det_centers[i, 0] - tx
+            dy = det_centers[i, 1] - ty
+            d = dx * dx + dy * dy
+            out[i, j] = d if d < max_dist2 else gate_cost
+
+
+@njit(cache=True, fastmath=True)
+def _associate_greedy(det_centers, trk_centers, max_dist2):
+    """
+    Жадное сопоставление с порогом расстояния: каждая детекция по порядку берет
+    ближайший свободный трекер. Возвращает индекс трекера для каждой детекции (-1 - нет пары)
+    """
+    n = det_centers.shape[0]
+    m = trk_centers.shape[0]
+    assignment = np.full(n, -1, dtype=np.int32)
+    used = np.zeros(m, dtype=np.bool_)
+    for i in range(n):
+        px = np.int64(det_centers[i, 0])
+        py = np.int64(det_centers[i, 1])
+        best_j = -1
+        best_d = max_dist2  # порог сразу служит начальным значением минимума
+        for j in range(m):
+            if used[j]:
+                continue
+            dx = px - np.int64(trk_centers[j, 0])
+            dy = py - np.int64(trk_centers[j, 1])
+            d = dx * dx + dy * dy
+            if d < best_d:
+                best_d = d
+                best_j = j
+        if best_j != -1:
+            used[best_j] = True
+            assignment[i] = best_j
+    return assignment
+
 
 class AdvancedPersonTracker:
     """Продвинутый трекер людей с улучшенным сопоставлением"""
     
-    def __init__(self, max_disappeared: int = 30, min_trajectory_length: int = 10):
+    def __init__(self, max_disappeared: int = 30, min_trajectory_length: int = 10, frame_step: int = 1):
         self.next_person_id = 1
         self.trackers = {}  # person_id -> PersonTracker
-        self.disappeared = {}  # person_id -> frames_disappeared
         self.max_disappeared = max_disappeared
         self.min_trajectory_length = min_trajectory_length
+        # Шаг между обрабатываемыми кадрами: пропущенные кадры траекторий достраиваются
+        self.frame_step = frame_step
+        # Параллельные структуры: порядок трекеров и их центры в одном массиве
+        self._tracker_ids = []  # person_id в порядке строк self._centers
+        self._tracker_index = {}  # person_id -> строка в self._centers
+        self._centers = np.empty((0, 2), dtype=np.int32)
+        self._velocities = np.empty((0, 2), dtype=np.float32)  # пикселей за кадр
+        self._last_frames = np.empty(0, dtype=np.int32)  # кадр последнего обновления
+        self._disappeared = np.empty(0, dtype=np.int32)  # кадров без сопоставления
+        self._positions_cache = None  # сбрасывается при любом изменении трекеров
+        # Переиспользуемый буфер матрицы стоимостей: [0] - квадраты расстояний, [1] - временный
+        self._dist_buf = np.empty((2, 16, 16), dtype=np.float32)
         
     def update(self, detections: List[Tuple[int, int, int, int]], frame_number: int) -> Dict:
         """Обновляет трекер с новыми детекциями"""
@@ -23,154 +97,237 @@ class AdvancedPersonTracker:
                 self._create_tracker(detection, frame_number)
             return self._get_current_positions()
         
-        # Получаем текущие позиции всех трекеров
-        current_positions = self._get_current_positions()
-        
         # Если нет детекций, помечаем всех как исчезнувших
         if len(detections) == 0:
-            for person_id in list(self.disappeared.keys()):
-                self.disappeared[person_id] += 1
-                if self.disappeared[person_id] > self.max_disappeared:
-                    self._delete_tracker(person_id)
+            current_positions = self._get_current_positions()
+            self._disappeared += 1
+            self._delete_disappeared()
             return current_positions
         
+        # Центры детекций считаем один раз и используем повторно
+        det_centers = self._get_detection_centers(detections)
+        
         # Сопоставляем детекции с существующими трекерами
-        matched_detections, matched_trackers = self._match_detections_to_trackers(
-            detections, current_positions
-        )
+        matched_detections, _ = self._match_detections_to_trackers(det_centers, frame_number)
         
         # Обновляем существующие трекеры
+        matched_rows = []
         for detection_idx, person_id in matched_detections.items():
-            self.trackers[person_id].update(detections[detection_idx], frame_number)
-            self.disappeared[person_id] = 0
+            cx, cy = det_centers[detection_idx].tolist()
+            tracker = self.trackers[person_id]
+            tracker.update_precomputed(detections[detection_idx], cx, cy, frame_number)
+            row = self._tracker_index[person_id]
+            self._centers[row] = (cx, cy)
+            self._velocities[row] = tracker.get_velocity()
+            self._last_frames[row] = frame_number
+            matched_rows.append(row)
+        self._positions_cache = None
         
         # Создаем новые трекеры для неиспользованных детекций
         for i, detection in enumerate(detections):
             if i not in matched_detections:
                 self._create_tracker(detection, frame_number)
         
-        # Обрабатываем исчезнувших людей
-        for person_id in list(self.disappeared.keys()):
-            if person_id not in matched_trackers:
-                self.disappeared[person_id] += 1
-                if self.disappeared[person_id] > self.max_disappeared:
-                    self._delete_tracker(person_id)
+        # Обрабатываем исчезнувших людей (новые трекеры тоже получают +1, как и раньше)
+        self._disappeared += 1
+        self._disappeared[matched_rows] = 0
+        self._delete_disappeared()
         
         # Логируем состояние трекинга
         if frame_number % 30 == 0:  # Каждые 30 кадров
-            active_trackers = len(self.trackers)
-            total_detections = len(detections)
-            matched_count = len(matched_detections)
-            print(f"🎯 Трекинг: кадр={frame_number}, детекций={total_detections}, сопоставлено={matched_count}, трекеров={active_trackers}")
+            logger.debug("🎯 Трекинг: кадр=%d, детекций=%d, сопоставлено=%d, трекеров=%d",
+                         frame_number, len(detections), len(matched_detections), len(self.trackers))
         
         return self._get_current_positions()
     
     def _create_tracker(self, detection: Tuple[int, int, int, int], frame_number: int):
         """Создает новый трекер для человека"""
-        person_id = f"person_{self.next_person_id}"
+        person_id = self.next_person_id  # int-ключ; метка person_N нужна только на выходе
         self.next_person_id += 1
         
-        self.trackers[person_id] = PersonTracker(detection, frame_number)
-        self.disappeared[person_id] = 0
+        tracker = PersonTracker(detection, frame_number, fill_gap=self.frame_step)
+        self.trackers[person_id] = tracker
+        
+        self._tracker_index[person_id] = len(self._tracker_ids)
+        self._tracker_ids.append(person_id)
+        self._centers = np.append(self._centers, [tracker.get_current_position()], axis=0)
+        self._velocities = np.append(self._velocities, [(0.0, 0.0)], axis=0).astype(np.float32)
+        self._last_frames = np.append(self._last_frames, frame_number).astype(np.int32)
+        self._disappeared = np.append(self._disappeared, 0).astype(np.int32)
+        self._positions_cache = None
         
-        print(f"🆕 Создан трекер {person_id} для детекции {detection}")
+        logger.debug("🆕 Создан трекер person_%d для детекции %s", person_id, detection)
     
-    def _delete_tracker(self, person_id: str):
-        """Удаляет трекер человека"""
-        if person_id in self.trackers:
-            del self.trackers[person_id]
-        if person_id in self.disappeared:
-            del self.disappeared[person_id]
-        print(f"🗑️ Удален трекер {person_id}")
+    def _delete_disappeared(self):
+        """Удаляет разом все трекеры, пропавшие дольше max_disappeared кадров"""
+        dead = self._disappeared > self.max_disappeared
+        if not dead.any():
+            return
+        
+        keep = ~dead
+        keep_flags = keep.tolist()
+        for person_id, alive in zip(self._tracker_ids, keep_flags):
+            if not alive:
+                del self.trackers[person_id]
+                logger.debug("🗑️ Удален трекер person_%d", person_id)
+        
+        self._tracker_ids = [pid for pid, alive in zip(self._tracker_ids, keep_flags) if alive]
+        self._tracker_index = {pid: row for row, pid in enumerate(self._tracker_ids)}
+        self._centers = self._centers[keep]
+        self._velocities = self._velocities[keep]
+        self._last_frames = self._last_frames[keep]
+        self._disappeared = self._disappeared[keep]
+        self._positions_cache = None
     
-    def _match_detections_to_trackers(self, detections: List[Tuple[int, int, int, int]], 
-                                    current_positions: Dict) -> Tuple[Dict, set]:
+    def _match_detections_to_trackers(self, det_centers: np.ndarray,
+                                    frame_number: int) -> Tuple[Dict, set]:
         """Сопоставляет детекции с существующими трекерами"""
         
-        if len(current_positions) == 0:
+        if len(self._tracker_ids) == 0:
             return {}, set()
         
-        # Вычисляем матрицу расстояний
-        distance_matrix = np.zeros((len(detections), len(current_positions)))
-        person_ids = list(current_positions.keys())
-        
-        for i, detection in enumerate(detections):
-            detection_center = self._get_detection_center(detection)
-            for j, person_id in enumerate(person_ids):
-                tracker_center = current_positions[person_id]
-                distance = self._calculate_distance(detection_center, tracker_center)
-                distance_matrix[i, j] = distance
+        # Сравниваем детекции с предсказанными (а не последними) центрами трекеров
+        person_ids = self._tracker_ids
+        trk_centers = self._predict_centers(frame_number)
         
-        # Венгерский алгоритм для оптимального сопоставления
         matched_detections = {}
         matched_trackers = set()
         
-        # Простое жадное сопоставление с порогом расстояния (оптимизировано для YOLO)
+        # Порог расстояния (оптимизировано для YOLO)
         max_distance = 200  # пиксели (увеличили для YOLO - люди могут двигаться быстрее)
+        max_distance_sq = max_distance ** 2  # сравниваем квадраты, sqrt не нужен
         
-        for i in range(len(detections)):
-            best_match = None
-            min_distance = float('inf')
+        # На маленьких задачах накладные расходы NumPy и решателя больше самой работы
+        if len(det_centers) <= SCALAR_MAX_SIZE and len(person_ids) <= SCALAR_MAX_SIZE:
+            if NUMBA_AVAILABLE:
+                # Простое жадное сопоставление с порогом расстояния в скомпилированном цикле
+                assignment = _associate_greedy(det_centers, trk_centers, max_distance_sq)
+                for i, j in enumerate(assignment.tolist()):
+                    if j != -1:
+                        matched_detections[i] = person_ids[j]
+                        matched_trackers.add(person_ids[j])
+                return matched_detections, matched_trackers
             
-            for j, person_id in enumerate(person_ids):
-                if person_id not in matched_trackers and distance_matrix[i, j] < max_distance:
-                    if distance_matrix[i, j] < min_distance:
-                        min_distance = distance_matrix[i, j]
-                        best_match = person_id
+            # Простое жадное сопоставление с порогом расстояния
+            trk_points = trk_centers.tolist()
+            used = [False] * len(trk_points)
+            for i, (px, py) in enumerate(det_centers.tolist()):
+                best_j = -1
+                best_d = max_distance_sq  # порог сразу служит начальным значением минимума
+                for j, (tx, ty) in enumerate(trk_points):
+                    if used[j]:
+                        continue
+                    d = (px - tx) * (px - tx) + (py - ty) * (py - ty)
+                    if d < best_d:
+                        best_d = d
+                        best_j = j
+                if best_j != -1:
+                    used[best_j] = True
+                    matched_detections[i] = person_ids[best_j]
+                    matched_trackers.add(person_ids[best_j])
             
-            if best_match is not None:
-                matched_detections[i] = best_match
-                matched_trackers.add(best_match)
+            return matched_detections, matched_trackers
+        
+        # Матрица квадратов расстояний с порогом в готовом буфере
+        cost, tmp = self._get_dist_buffers(len(det_centers), len(trk_centers))
+        if NUMBA_AVAILABLE and len(trk_centers) >= PARALLEL_MIN_TRACKERS:
+            _fill_cost_matrix(det_centers, trk_centers, max_distance_sq, GATE_COST, cost)
+        else:
+            # Векторно, без циклов Python
+            np.subtract(det_centers[:, None, 0], trk_centers[None, :, 0], out=cost)
+            np.square(cost, out=cost)
+            np.subtract(det_centers[:, None, 1], trk_centers[None, :, 1], out=tmp)
+            np.square(tmp, out=tmp)
+            cost += tmp
+            cost[cost >= max_distance_sq] = GATE_COST
+        
+        # Венгерский алгоритм для оптимального сопоставления
+        row_ind, col_ind = linear_sum_assignment(cost)
+        
+        for i, j in zip(row_ind.tolist(), col_ind.tolist()):
+            if cost[i, j] >= GATE_COST:
+                continue  # пара за порогом расстояния
+            matched_detections[i] = person_ids[j]
+            matched_trackers.add(person_ids[j])
         
         return matched_detections, matched_trackers
     
-    def _get_detection_center(self, detection: Tuple[int, int, int, int]) -> Tuple[int, int]:
-        """Получает центр детекции"""
-        x, y, w, h = detection
-        return (x + w // 2, y + h // 2)
+    def _get_dist_buffers(self, n: int, m: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Возвращает срезы (n, m) буфера расстояний, увеличивая его вдвое при нехватке"""
+        _, rows, cols = self._dist_buf.shape
+        if n > rows or m > cols:
+            self._dist_buf = np.empty((2, max(n, rows * 2), max(m, cols * 2)), dtype=np.float32)
+        return self._dist_buf[0, :n, :m], self._dist_buf[1, :n, :m]
+    
+    def _predict_centers(self, frame_number: int) -> np.ndarray:
+        """Экстраполирует центры всех трекеров на кадр с постоянной скоростью"""
+        dt = np.clip(frame_number - self._last_frames, 0, MAX_PREDICTION_FRAMES)
+        predicted = self._centers + self._velocities * dt[:, None]
+        return np.rint(predicted).astype(np.int32)
     
-    def _calculate_distance(self, point1: Tuple[int, int], point2: Tuple[int, int]) -> float:
-        """Вычисляет евклидово расстояние между точками"""
-        return math.sqrt((point1[0] - point2[0])**2 + (point1[1] - point2[1])**2)
+    def _get_detection_centers(self, detections: List[Tuple[int, int, int, int]]) -> np.ndarray:
+        """Получает центры всех детекций массивом (N, 2)"""
+        det = np.asarray(detections, dtype=np.int32).reshape(-1, 4)
+        return det[:, :2] + (det[:, 2:] >> 1)
     
     def _get_current_positions(self) -> Dict:
         """Получает текущие позиции всех трекеров"""
-        positions = {}
-        for person_id, tracker in self.trackers.items():
-            positions[person_id] = tracker.get_current_position()
-        return positions
+        if self._positions_cache is None:
+            self._positions_cache = dict(zip(self._tracker_ids, map(tuple, self._centers.tolist())))
+        return self._positions_cache
     
     def get_trajectories(self) -> Dict:
         """Получает траектории всех людей"""
         trajectories = {}
         for person_id, tracker in self.trackers.items():
-            if len(tracker.trajectory) >= self.min_trajectory_length:
-                trajectories[person_id] = tracker.get_trajectory()
+            if len(tracker) >= self.min_trajectory_length:
+                trajectories[f"person_{person_id}"] = tracker.get_trajectory()
+        return trajectories
+    
+    def get_trajectory_arrays(self) -> Dict[str, Trajectory]:
+        """Получает траектории всех людей массивами, без словарей на каждую точку"""
+        trajectories = {}
+        for person_id, tracker in self.trackers.items():
+            if len(tracker) >= self.min_trajectory_length:
+                trajectories[f"person_{person_id}"] = tracker.get_trajectory_arrays()
         return trajectories
     
     def get_people_per_frame(self) -> List[int]:
         """Получает количество людей в каждом кадре"""
-        max_frame = max([tracker.get_max_frame() for tracker in self.trackers.values()], default=0)
-        people_per_frame = []
-        
-        for frame in range(max_frame + 1):
-            count = 0
-            for tracker in self.trackers.values():
-                if tracker.has_frame(frame):
-                    count += 1
-            people_per_frame.append(count)
+        if not self.trackers:
+            return [0]
         
-        return people_per_frame
+        # Один проход bincount по кадрам всех трекеров вместо перебора кадров
+        frames = np.concatenate([tracker.get_frames() for tracker in self.trackers.values()])
+        max_frame = int(frames.max())
+        return np.bincount(frames, minlength=max_frame + 1).tolist()
 
 
 class PersonTracker:
     """Трекер для одного человека"""
     
-    def __init__(self, initial_detection: Tuple[int, int, int, int], frame_number: int):
-        self.trajectory = deque(maxlen=1000)  # Ограничиваем память
+    # Ограничиваем память: храним последние точки в кольцевом буфере
+    MAX_TRAJECTORY_LENGTH = 1000
+    
+    def __init__(self, initial_detection: Tuple[int, int, int, int], frame_number: int, fill_gap: int = 1):
+        # Координаты в пикселях помещаются в int16, номер кадра - в int32;
+        # timestamp не храним, он вычисляется из кадра при чтении
+        self._xywh = np.empty((self.MAX_TRAJECTORY_LENGTH, 4), dtype=np.int16)  # x, y (центр), w, h
+        self._frames = np.empty(self.MAX_TRAJECTORY_LENGTH, dtype=np.int32)
+        self._n = 0
+        self._head = 0
+        self._frame_set = set()  # кадры, присутствующие в буфере
+        self._max_frame = 0
+        self._vx, self._vy = 0.0, 0.0  # сглаженная скорость, пикселей за кадр
+        self._last_frame = None
+        # Разрывы до fill_gap кадров (пропущенные при обработке кадры) заполняются интерполяцией
+        self._fill_gap = fill_gap
         self.current_detection = initial_detection
         self.add_detection(initial_detection, frame_number)
     
+    def __len__(self) -> int:
+        return self._n
+    
     def update(self, detection: Tuple[int, int, int, int], frame_number: int):
         """Обновляет трекер новым детекцией"""
         self.current_detection = detection
@@ -179,33 +336,102 @@ class PersonTracker:
     def add_detection(self, detection: Tuple[int, int, int, int], frame_number: int):
         """Добавляет детекцию в траекторию"""
         x, y, w, h = detection
-        center_x = x + w // 2
-        center_y = y + h // 2
-        
-        self.trajectory.append({
-            'x': center_x,
-            'y': center_y,
-            'frame': frame_number,
-            'timestamp': frame_number / 30.0,  # Предполагаем 30 FPS
-            'width': w,
-            'height': h
-        })
+        self._append(x + w // 2, y + h // 2, frame_number, w, h)
+    
+    def update_precomputed(self, detection: Tuple[int, int, int, int], center_x: int, center_y: int,
+                           frame_number: int):
+        """Обновляет трекер детекцией с уже посчитанным центром"""
+        self.current_detection = detection
+        self._append(center_x, center_y, frame_number, detection[2], detection[3])
+    
+    def _append(self, center_x: int, center_y: int, frame_number: int, w: int, h: int):
+        """Записывает точку в кольцевой буфер"""
+        # Обновляем сглаженную скорость по смещению от предыдущей точки
+        if self._last_frame is not None and frame_number > self._last_frame:
+            dt = frame_number - self._last_frame
+            a = VELOCITY_SMOOTHING
+            self._vx = a * (center_x - self._cx) / dt + (1 - a) * self._vx
+            self._vy = a * (center_y - self._cy) / dt + (1 - a) * self._vy
+            
+            # Пропущенные кадры между соседними обработанными - движение с постоянной скоростью
+            if 1 < dt <= self._fill_gap:
+                prev_x, prev_y, prev_w, prev_h = self._xywh[self._head - 1].tolist()
+                for k in range(1, dt):
+                    t = k / dt
+                    self._store(round(prev_x + (center_x - prev_x) * t), round(prev_y + (center_y - prev_y) * t),
+                                self._last_frame + k,
+                                round(prev_w + (w - prev_w) * t), round(prev_h + (h - prev_h) * t))
+        self._last_frame = frame_number
+        
+        # Кэшируем центр, чтобы не пересчитывать его в get_current_position
+        self._cx, self._cy = center_x, center_y
+        
+        self._store(center_x, center_y, frame_number, w, h)
+    
+    def _store(self, center_x: int, center_y: int, frame_number: int, w: int, h: int):
+        """Кладет точку в кольцевой буфер, вытесняя самую старую при заполнении"""
+        # При заполненном буфере вытесняем самую старую точку
+        evicted_frame = None
+        if self._n == self.MAX_TRAJECTORY_LENGTH:
+            evicted_frame = int(self._frames[self._head])
+            self._frame_set.discard(evicted_frame)
+        
+        self._xywh[self._head] = (center_x, center_y, w, h)
+        self._frames[self._head] = frame_number
+        self._head = (self._head + 1) % self.MAX_TRAJECTORY_LENGTH
+        if self._n < self.MAX_TRAJECTORY_LENGTH:
+            self._n += 1
+        
+        self._frame_set.add(frame_number)
+        if evicted_frame is not None and evicted_frame == self._max_frame:
+            self._max_frame = int(self._frames[:self._n].max())
+        elif frame_number > self._max_frame or self._n == 1:
+            self._max_frame = frame_number
     
     def get_current_position(self) -> Tuple[int, int]:
         """Получает текущую позицию"""
-        x, y, w, h = self.current_detection
-        return (x + w // 2, y + h // 2)
+        return (self._cx, self._cy)
+    
+    def get_velocity(self) -> Tuple[float, float]:
+        """Получает сглаженную скорость (пикселей за кадр)"""
+        return (self._vx, self._vy)
+    
+    def _ordered(self, column: np.ndarray) -> np.ndarray:
+        """Возвращает данные кольцевого буфера в хронологическом порядке"""
+        if self._n < self.MAX_TRAJECTORY_LENGTH:
+            return column[:self._n]
+        return np.concatenate((column[self._head:], column[:self._head]))
     
     def get_trajectory(self) -> List[Dict]:
         """Получает траекторию"""
-        return list(self.trajectory)
+        return [
+            {
+                'x': x,
+                'y': y,
+                'frame': frame,
+                'timestamp': frame / 30.0,  # Предполагаем 30 FPS
+                'width': w,
+                'height': h
+            }
+            for (x, y, w, h), frame in zip(self._ordered(self._xywh).tolist(),
+                                           self._ordered(self._frames).tolist())
+        ]
+    
+    def get_trajectory_arrays(self) -> Trajectory:
+        """Получает траекторию массивами (кадры, x, y) прямо из кольцевого буфера"""
+        xywh = self._ordered(self._xywh)
+        # int64, как у Trajectory.from_points: дальнейшая арифметика не переполнит int16
+        return Trajectory(self._ordered(self._frames).copy(),
+                          xywh[:, 0].astype(np.int64), xywh[:, 1].astype(np.int64))
+    
+    def get_frames(self) -> np.ndarray:
+        """Получает номера кадров всех точек траектории"""
+        return self._frames[:self._n]
     
     def get_max_frame(self) -> int:
         """Получает максимальный номер кадра"""
-        if not self.trajectory:
-            return 0
-        return max(point['frame'] for point in self.trajectory)
+        return self._max_frame
     
     def has_frame(self, frame_number: int) -> bool:
         """Проверяет, есть ли точка в указанном кадре"""
-        return any(point['frame'] == frame_number for point in self.trajectory)
+        return frame_number in self._frame_set
@@ -4,53 +4,170 @@
 """
 
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Рисуем только в файлы, без GUI
 import matplotlib.pyplot as plt
 import matplotlib.colors as colors
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
 import seaborn as sns
-from typing import Dict, List, Tuple
+from PIL import Image
+from typing import Dict, List, NamedTuple, Tuple
 import json
 from datetime import datetime, timedelta
 import os
+import functools
+from types import SimpleNamespace
+
+from .numba_compat import njit, prange, NUMBA_AVAILABLE
+
+
+@njit(parallel=True, fastmath=True, cache=True, nogil=True)
+def _traj_stats(xs, ys, ts, offsets, out_move, out_dur):
+    """Средний шаг и длительность каждой траектории за один проход без временных массивов"""
+    for i in prange(offsets.shape[0] - 1):
+        a, b = offsets[i], offsets[i + 1]
+        s = 0.0
+        for k in range(a + 1, b):
+            dx = xs[k] - xs[k - 1]
+            dy = ys[k] - ys[k - 1]
+            s += (dx * dx + dy * dy) ** 0.5
+        out_move[i] = s / max(b - a, 1)
+        out_dur[i] = ts[b - 1] - ts[a] if b > a else 0.0
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _bin2d(xs, ys, xmin, xmax, ymin, ymax, nx, ny):
+    """Строит двумерную гистограмму по равномерной сетке и сразу находит её максимум"""
+    h = np.zeros((ny, nx))
+    m = 0.0
+    sx = (nx - 1) / (xmax - xmin) if xmax > xmin else 0.0
+    sy = (ny - 1) / (ymax - ymin) if ymax > ymin else 0.0
+    for k in range(xs.shape[0]):
+        ix = min(max(int((xs[k] - xmin) * sx), 0), nx - 1)
+        iy = min(max(int((ys[k] - ymin) * sy), 0), ny - 1)
+        h[iy, ix] += 1
+        if h[iy, ix] > m:
+            m = h[iy, ix]
+    return h, m
+
+
+@functools.lru_cache(maxsize=32)
+def _viridis(n: int) -> np.ndarray:
+    """Палитра viridis на n цветов (RGBA, float32), кэшируется по длине"""
+    rgba = plt.cm.viridis(np.linspace(0, 1, n)).astype(np.float32)
+    rgba.flags.writeable = False
+    return rgba
+
+
+class TrajectoryArrays(NamedTuple):
+    """Траектории в виде плоских массивов (SoA) со смещениями в стиле CSR.
+    Точки траектории i лежат в срезе [offsets[i]:offsets[i+1]]"""
+    person_ids: List[str]
+    xs: np.ndarray
+    ys: np.ndarray
+    ts: np.ndarray
+    offsets: np.ndarray
+
 
 class AnalyticsGenerator:
-    def __init__(self):
-        """Инициализация генератора аналитики"""
+    def __init__(self, annotated: bool = True):
+        """Инициализация генератора аналитики
+        
+        annotated: рисовать тепловую карту через matplotlib (заголовок, оси, шкала);
+        при False сохраняется только растр через Pillow - для наложения поверх кадра
+        """
         self.heatmap_resolution = (100, 100)  # Разрешение тепловой карты
+        self.annotated = annotated
+        self._soa = None  # кэш TrajectoryArrays для текущих траекторий
+        self._soa_source = None
+        self._stats = None  # кэш (средний шаг, длительность) для self._soa
+        # Одна фигура на все графики: очищается перед каждым новым
+        self._fig = Figure(figsize=(12, 8))
         
     def generate_analytics(self, tracking_data: Dict) -> Dict:
         """
         Главная функция генерации аналитики
         """
+        # Переводим траектории и количество людей по кадрам в массивы один раз для всех анализов
+        self._get_soa(tracking_data.get('trajectories', {}))
+        # Статистики загруженности тоже считаем один раз и передаем во все анализы
+        stats = self._people_stats(tracking_data.get('frame_data', []))
+        
         analytics = {
             'timestamp': datetime.now().isoformat(),
-            'summary': self._generate_summary(tracking_data),
+            'summary': self._generate_summary(tracking_data, stats),
             'heatmap': self._generate_heatmap(tracking_data),
             'desire_paths': self._generate_desire_paths(tracking_data),
-            'queue_analysis': self._analyze_queues(tracking_data),
-            'anomalies': self._detect_anomalies(tracking_data),
-            'time_analysis': self._analyze_time_patterns(tracking_data)
+            'queue_analysis': self._analyze_queues(tracking_data, stats),
+            'anomalies': self._detect_anomalies(tracking_data, stats),
+            'time_analysis': self._analyze_time_patterns(tracking_data, stats)
         }
         
         return analytics
     
-    def _generate_summary(self, tracking_data: Dict) -> Dict:
+    def _people_stats(self, frame_data: List[Dict]) -> SimpleNamespace:
+        """Количество людей по кадрам (arr) и его mean/std/max/argmax за один раз"""
+        arr = np.fromiter((fd.get('people_count', 0) for fd in frame_data), dtype=np.int32, count=len(frame_data))
+        if len(arr) == 0:
+            return SimpleNamespace(arr=arr, mean=0.0, std=0.0, max=0, argmax=0)
+        return SimpleNamespace(
+            arr=arr,
+            mean=float(arr.mean()),
+            std=float(arr.std()),
+            max=int(arr.max()),
+            argmax=int(arr.argmax())
+        )
+    
+    def _to_soa(self, trajectories: Dict) -> TrajectoryArrays:
+        """Переводит словари точек траекторий в плоские массивы x, y, t"""
+        lengths = [len(trajectory) for trajectory in trajectories.values()]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int32)
+        np.cumsum(lengths, out=offsets[1:])
+        total = int(offsets[-1])
+        
+        # Пиксельным координатам и секундам видео хватает точности float32,
+        # а вдвое меньший объем ускоряет все проходы по массивам
+        points = [point for trajectory in trajectories.values() for point in trajectory]
+        xs = np.fromiter((point['x'] for point in points), dtype=np.float32, count=total)
+        ys = np.fromiter((point['y'] for point in points), dtype=np.float32, count=total)
+        ts = np.fromiter((point['timestamp'] for point in points), dtype=np.float32, count=total)
+        
+        return TrajectoryArrays(list(trajectories.keys()), xs, ys, ts, offsets)
+    
+    def _get_soa(self, trajectories: Dict) -> TrajectoryArrays:
+        """Возвращает закэшированные массивы траекторий, пересчитывая их при смене данных"""
+        if self._soa is None or self._soa_source is not trajectories:
+            self._soa = self._to_soa(trajectories)
+            self._soa_source = trajectories
+            self._stats = None
+        return self._soa
+    
+    def _trajectory_durations(self, soa: TrajectoryArrays) -> Tuple[np.ndarray, np.ndarray]:
+        """Возвращает длины траекторий и их длительности (последняя метка - первая)"""
+        lengths = np.diff(soa.offsets)
+        durations = np.zeros(len(lengths))
+        nonempty = lengths > 0
+        starts = soa.offsets[:-1][nonempty]
+        ends = soa.offsets[1:][nonempty] - 1
+        durations[nonempty] = soa.ts[ends] - soa.ts[starts]
+        return lengths, durations
+    
+    def _generate_summary(self, tracking_data: Dict, stats: SimpleNamespace) -> Dict:
         """Генерация общей сводки"""
         trajectories = tracking_data.get('trajectories', {})
         frame_data = tracking_data.get('frame_data', [])
         metadata = tracking_data.get('metadata', {})
         
         total_visitors = len(trajectories)
-        max_concurrent = max([fd.get('people_count', 0) for fd in frame_data]) if frame_data else 0
-        avg_concurrent = np.mean([fd.get('people_count', 0) for fd in frame_data]) if frame_data else 0
+        max_concurrent = stats.max
+        avg_concurrent = stats.mean
         
         # Средняя длительность пребывания
-        durations = []
-        for person_id, trajectory in trajectories.items():
-            if len(trajectory) > 1:
-                duration = trajectory[-1]['timestamp'] - trajectory[0]['timestamp']
-                durations.append(duration)
+        lengths, durations = self._trajectory_durations(self._get_soa(trajectories))
+        durations = durations[lengths > 1]
         
-        avg_duration = np.mean(durations) if durations else 0
+        avg_duration = durations.mean() if len(durations) else 0
         
         return {
             'total_visitors': total_visitors,
@@ -58,21 +175,16 @@ class AnalyticsGenerator:
             'avg_concurrent_visitors': round(avg_concurrent, 1),
             'avg_visit_duration': round(avg_duration, 1),
             'video_duration': metadata.get('duration', 0),
-            'peak_time': self._find_peak_time(frame_data)
+            'peak_time': self._find_peak_time(frame_data, stats)
         }
     
-    def _find_peak_time(self, frame_data: List[Dict]) -> str:
+    def _find_peak_time(self, frame_data: List[Dict], stats: SimpleNamespace) -> str:
         """Находит время пика посещаемости"""
         if not frame_data:
             return "Неизвестно"
         
-        max_people = 0
-        peak_frame = 0
-        
-        for fd in frame_data:
-            if fd.get('people_count', 0) > max_people:
-                max_people = fd.get('people_count', 0)
-                peak_frame = fd.get('frame_number', 0)
+        # Первый кадр с максимумом; если людей не было вовсе - нулевой кадр
+        peak_frame = frame_data[stats.argmax].get('frame_number', 0) if stats.max > 0 else 0
         
         peak_timestamp = peak_frame / 30  # Примерно 30 FPS
         minutes = int(peak_timestamp // 60)
@@ -88,57 +200,52 @@ class AnalyticsGenerator:
             return {'error': 'Нет данных для генерации тепловой карты'}
         
         # Определяем границы видео
-        all_x = []
-        all_y = []
+        soa = self._get_soa(trajectories)
+        all_x, all_y = soa.xs, soa.ys
         
-        for trajectory in trajectories.values():
-            for point in trajectory:
-                all_x.append(point['x'])
-                all_y.append(point['y'])
-        
-        if not all_x or not all_y:
+        if len(all_x) == 0 or len(all_y) == 0:
             return {'error': 'Недостаточно данных для тепловой карты'}
         
-        min_x, max_x = min(all_x), max(all_x)
-        min_y, max_y = min(all_y), max(all_y)
+        min_x, max_x = all_x.min(), all_x.max()
+        min_y, max_y = all_y.min(), all_y.max()
         
         # Создаем сетку для тепловой карты
-        grid_x = np.linspace(min_x, max_x, self.heatmap_resolution[0])
-        grid_y = np.linspace(min_y, max_y, self.heatmap_resolution[1])
-        
-        heatmap_data = np.zeros(self.heatmap_resolution)
-        
-        # Заполняем тепловую карту
-        for trajectory in trajectories.values():
-            for point in trajectory:
-                # Находим ближайшую ячейку сетки
-                x_idx = np.digitize(point['x'], grid_x) - 1
-                y_idx = np.digitize(point['y'], grid_y) - 1
-                
-                # Проверяем границы
-                x_idx = max(0, min(x_idx, self.heatmap_resolution[0] - 1))
-                y_idx = max(0, min(y_idx, self.heatmap_resolution[1] - 1))
-                
-                heatmap_data[y_idx, x_idx] += 1
+        nx, ny = self.heatmap_resolution
+        grid_x = np.linspace(min_x, max_x, nx)
+        grid_y = np.linspace(min_y, max_y, ny)
+        
+        # Заполняем тепловую карту: ячейка i начинается в узле сетки grid[i],
+        # последняя ячейка - точки на правой границе
+        if NUMBA_AVAILABLE:
+            # Один проход: и гистограмма, и её максимум
+            heatmap_data, heatmap_max = _bin2d(all_x, all_y, min_x, max_x, min_y, max_y, nx, ny)
+        else:
+            # Ячейки равномерные, поэтому индекс считается арифметикой, без поиска по границам
+            ix = self._uniform_bin_index(all_x, min_x, max_x, nx)
+            iy = self._uniform_bin_index(all_y, min_y, max_y, ny)
+            heatmap_data = np.bincount(iy * nx + ix, minlength=nx * ny).reshape(ny, nx).astype(float)
+            heatmap_max = heatmap_data.max()
         
         # Нормализуем данные
-        if heatmap_data.max() > 0:
-            heatmap_data = heatmap_data / heatmap_data.max()
-        
-        # Создаем визуализацию
-        plt.figure(figsize=(12, 8))
-        plt.imshow(heatmap_data, cmap='hot', interpolation='bilinear', origin='lower')
-        plt.colorbar(label='Относительная популярность')
-        plt.title('Тепловая карта популярности зон')
-        plt.xlabel('X координата')
-        plt.ylabel('Y координата')
+        if heatmap_max > 0:
+            heatmap_data = heatmap_data / heatmap_max
         
         # Сохраняем изображение
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         heatmap_path = f"static/heatmaps/heatmap_{timestamp}.png"
         os.makedirs(os.path.dirname(heatmap_path), exist_ok=True)
-        plt.savefig(heatmap_path, dpi=150, bbox_inches='tight')
-        plt.close()
+        
+        if self.annotated:
+            # Создаем визуализацию
+            ax = self._prepare_axes((12, 8))
+            image = ax.imshow(heatmap_data, cmap='hot', interpolation='bilinear', origin='lower')
+            self._fig.colorbar(image, ax=ax, label='Относительная популярность')
+            ax.set_title('Тепловая карта популярности зон')
+            ax.set_xlabel('X координата')
+            ax.set_ylabel('Y координата')
+            self._save_figure(heatmap_path)
+        else:
+            self._save_heatmap_png(heatmap_data, heatmap_path)
         
         # Находим самые популярные зоны
         hot_spots = self._find_hot_spots(heatmap_data, grid_x, grid_y)
@@ -150,25 +257,45 @@ class AnalyticsGenerator:
             'max_intensity': float(heatmap_data.max())
         }
     
+    def _save_heatmap_png(self, heatmap_data: np.ndarray, path: str):
+        """Сохраняет тепловую карту как растр без matplotlib-фигуры (origin='lower': строки переворачиваются)"""
+        rgba = plt.get_cmap('hot')(heatmap_data[::-1], bytes=True)
+        Image.fromarray(rgba).save(path, compress_level=1)
+    
+    def _uniform_bin_index(self, values: np.ndarray, vmin: float, vmax: float, bins: int) -> np.ndarray:
+        """Индекс ячейки равномерной сетки из bins узлов от vmin до vmax"""
+        if vmax <= vmin:
+            return np.zeros(len(values), dtype=np.int32)
+        idx = ((values - vmin) * ((bins - 1) / (vmax - vmin))).astype(np.int32)
+        return np.clip(idx, 0, bins - 1)
+    
+    def _prepare_axes(self, figsize: Tuple[int, int]):
+        """Очищает общую фигуру и возвращает новые оси заданного размера"""
+        self._fig.clf()
+        self._fig.set_size_inches(figsize)
+        return self._fig.add_subplot()
+    
+    def _save_figure(self, path: str):
+        """Сохраняет общую фигуру (tight_layout вместо двойной отрисовки bbox_inches='tight')"""
+        self._fig.tight_layout()
+        self._fig.savefig(path, dpi=150)
+    
     def _find_hot_spots(self, heatmap_data: np.ndarray, grid_x: np.ndarray, grid_y: np.ndarray) -> List[Dict]:
         """Находит самые популярные зоны"""
-        # Находим топ-5 самых горячих точек
-        flat_indices = np.argsort(heatmap_data.flatten())[-5:]
-        hot_spots = []
-        
-        for idx in reversed(flat_indices):
-            y_idx, x_idx = np.unravel_index(idx, heatmap_data.shape)
-            intensity = heatmap_data[y_idx, x_idx]
-            
-            if intensity > 0.1:  # Минимальный порог
-                hot_spots.append({
-                    'x': float(grid_x[x_idx]),
-                    'y': float(grid_y[y_idx]),
-                    'intensity': float(intensity),
-                    'rank': len(hot_spots) + 1
-                })
-        
-        return hot_spots
+        # Находим топ-5 самых горячих точек (частичная сортировка вместо полной)
+        flat = heatmap_data.ravel()
+        top = np.argpartition(flat, -5)[-5:]
+        top = top[np.argsort(-flat[top], kind='stable')]
+        top = top[flat[top] > 0.1]  # Минимальный порог
+        
+        # Колонки координат и интенсивностей; словари собираем только для итоговых строк
+        y_idx, x_idx = np.unravel_index(top, heatmap_data.shape)
+        return [
+            {'x': x, 'y': y, 'intensity': intensity, 'rank': rank}
+            for rank, (x, y, intensity) in enumerate(
+                zip(grid_x[x_idx].tolist(), grid_y[y_idx].tolist(), flat[top].tolist()), start=1
+            )
+        ]
     
     def _generate_desire_paths(self, tracking_data: Dict) -> Dict:
         """Генерация карты 'троп желаний' - популярных маршрутов"""
@@ -178,97 +305,93 @@ class AnalyticsGenerator:
             return {'error': 'Нет данных для анализа маршрутов'}
         
         # Создаем визуализацию траекторий
-        plt.figure(figsize=(12, 8))
-        
-        path_data = []
-        colors_list = plt.cm.viridis(np.linspace(0, 1, len(trajectories)))
-        
-        for i, (person_id, trajectory) in enumerate(trajectories.items()):
-            if len(trajectory) < 2:
-                continue
-            
-            x_coords = [point['x'] for point in trajectory]
-            y_coords = [point['y'] for point in trajectory]
-            
-            # Рисуем траекторию
-            plt.plot(x_coords, y_coords, alpha=0.6, linewidth=2, color=colors_list[i])
-            
-            # Отмечаем начальную и конечную точки
-            plt.scatter(x_coords[0], y_coords[0], c='green', s=50, alpha=0.8)  # Вход
-            plt.scatter(x_coords[-1], y_coords[-1], c='red', s=50, alpha=0.8)  # Выход
-            
-            path_data.append({
-                'person_id': person_id,
-                'start': {'x': x_coords[0], 'y': y_coords[0]},
-                'end': {'x': x_coords[-1], 'y': y_coords[-1]},
-                'length': len(trajectory),
-                'duration': trajectory[-1]['timestamp'] - trajectory[0]['timestamp']
-            })
+        ax = self._prepare_axes((12, 8))
         
-        plt.title('Карта "троп желаний" - маршруты посетителей')
-        plt.xlabel('X координата')
-        plt.ylabel('Y координата')
-        plt.legend(['Траектории', 'Входы', 'Выходы'], loc='upper right')
+        colors_list = _viridis(len(trajectories))
+        soa = self._get_soa(trajectories)
+        lengths, durations = self._trajectory_durations(soa)
         
-        # Сохраняем изображение
+        # Траектории короче двух точек не рисуем
+        path_idx = np.flatnonzero(lengths >= 2)
+        starts = soa.offsets[:-1][path_idx]
+        ends = soa.offsets[1:][path_idx] - 1
+        
+        # Все траектории одной коллекцией линий вместо отдельного plot на каждую
+        segments = [np.column_stack((soa.xs[a:b + 1], soa.ys[a:b + 1])) for a, b in zip(starts, ends)]
+        paths = LineCollection(segments, colors=colors_list[path_idx], linewidths=2, alpha=0.6)
+        ax.add_collection(paths)
+        ax.autoscale()
+        
+        # Отмечаем начальные и конечные точки двумя вызовами scatter
+        entries = ax.scatter(soa.xs[starts], soa.ys[starts], c='green', s=50, alpha=0.8)  # Входы
+        exits = ax.scatter(soa.xs[ends], soa.ys[ends], c='red', s=50, alpha=0.8)  # Выходы
+        
+        ax.set_title('Карта "троп желаний" - маршруты посетителей')
+        ax.set_xlabel('X координата')
+        ax.set_ylabel('Y координата')
+        ax.legend([paths, entries, exits], ['Траектории', 'Входы', 'Выходы'], loc='upper right')
+        
+        # Сохраняем изображение (с упрощением путей - линий может быть очень много)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         paths_image = f"static/heatmaps/desire_paths_{timestamp}.png"
-        plt.savefig(paths_image, dpi=150, bbox_inches='tight')
-        plt.close()
+        with plt.rc_context({'path.simplify': True, 'path.simplify_threshold': 1.0}):
+            self._save_figure(paths_image)
         
         # Анализируем паттерны
-        common_patterns = self._analyze_movement_patterns(path_data)
+        common_patterns = self._analyze_movement_patterns(
+            soa.xs[starts], soa.ys[starts], soa.xs[ends], soa.ys[ends]
+        )
         
         return {
             'image_path': paths_image,
-            'total_paths': len(path_data),
+            'total_paths': len(path_idx),
             'common_patterns': common_patterns,
-            'avg_path_duration': np.mean([p['duration'] for p in path_data]) if path_data else 0
+            'avg_path_duration': float(durations[path_idx].mean()) if len(path_idx) else 0
         }
     
-    def _analyze_movement_patterns(self, path_data: List[Dict]) -> List[Dict]:
+    def _analyze_movement_patterns(self, start_x: np.ndarray, start_y: np.ndarray,
+                                   end_x: np.ndarray, end_y: np.ndarray) -> List[Dict]:
         """Анализ общих паттернов движения"""
-        if not path_data:
+        total_paths = len(start_x)
+        if total_paths == 0:
             return []
         
-        # Группируем по начальным и конечным точкам
-        entry_points = {}
-        exit_points = {}
-        
-        for path in path_data:
-            start_key = f"{int(path['start']['x']//50)*50}_{int(path['start']['y']//50)*50}"
-            end_key = f"{int(path['end']['x']//50)*50}_{int(path['end']['y']//50)*50}"
-            
-            entry_points[start_key] = entry_points.get(start_key, 0) + 1
-            exit_points[end_key] = exit_points.get(end_key, 0) + 1
-        
-        # Топ входных точек
-        top_entries = sorted(entry_points.items(), key=lambda x: x[1], reverse=True)[:3]
-        top_exits = sorted(exit_points.items(), key=lambda x: x[1], reverse=True)[:3]
-        
         patterns = []
         
-        for i, (point, count) in enumerate(top_entries):
-            patterns.append({
-                'type': 'popular_entry',
-                'rank': i + 1,
-                'location': point,
-                'count': count,
-                'percentage': round((count / len(path_data)) * 100, 1)
-            })
-        
-        for i, (point, count) in enumerate(top_exits):
-            patterns.append({
-                'type': 'popular_exit',
-                'rank': i + 1,
-                'location': point,
-                'count': count,
-                'percentage': round((count / len(path_data)) * 100, 1)
-            })
+        # Группируем по начальным и конечным точкам (ячейки 50x50 пикселей)
+        for pattern_type, xs, ys in (('popular_entry', start_x, start_y),
+                                     ('popular_exit', end_x, end_y)):
+            for i, (cell_x, cell_y, count) in enumerate(self._top_cells(xs, ys, cell_size=50, top=3)):
+                patterns.append({
+                    'type': pattern_type,
+                    'rank': i + 1,
+                    'location': f"{cell_x}_{cell_y}",
+                    'count': count,
+                    'percentage': round((count / total_paths) * 100, 1)
+                })
         
         return patterns
     
-    def _analyze_queues(self, tracking_data: Dict) -> Dict:
+    def _top_cells(self, xs: np.ndarray, ys: np.ndarray, cell_size: int, top: int) -> List[Tuple[int, int, int]]:
+        """Самые частые ячейки сетки: (x, y, количество), при равенстве - в порядке появления"""
+        ix = np.floor_divide(xs, cell_size).astype(np.int64)
+        iy = np.floor_divide(ys, cell_size).astype(np.int64)
+        
+        # Целочисленный id ячейки вместо строкового ключа
+        base_x, base_y = ix.min(), iy.min()
+        height = int(iy.max() - base_y) + 1
+        cells = (ix - base_x) * height + (iy - base_y)
+        
+        keys, first_seen, counts = np.unique(cells, return_index=True, return_counts=True)
+        order = np.lexsort((first_seen, -counts))[:top]
+        
+        # В строки/кортежи переводим только победителей
+        return [
+            (int(base_x + key // height) * cell_size, int(base_y + key % height) * cell_size, int(count))
+            for key, count in zip(keys[order].tolist(), counts[order].tolist())
+        ]
+    
+    def _analyze_queues(self, tracking_data: Dict, stats: SimpleNamespace) -> Dict:
         """Анализ очередей и времени ожидания"""
         frame_data = tracking_data.get('frame_data', [])
         
@@ -276,91 +399,91 @@ class AnalyticsGenerator:
             return {'error': 'Нет данных для анализа очередей'}
         
         # Анализ количества людей по времени
-        time_series = []
-        people_counts = []
-        
-        for fd in frame_data:
-            time_series.append(fd.get('timestamp', 0))
-            people_counts.append(fd.get('people_count', 0))
+        time_series = np.fromiter((fd.get('timestamp', 0) for fd in frame_data), dtype=float, count=len(frame_data))
         
         # Создаем график загруженности по времени
-        plt.figure(figsize=(12, 6))
-        plt.plot(time_series, people_counts, linewidth=2, color='blue')
-        plt.fill_between(time_series, people_counts, alpha=0.3, color='lightblue')
-        plt.title('Загруженность заведения по времени')
-        plt.xlabel('Время (секунды)')
-        plt.ylabel('Количество посетителей')
-        plt.grid(True, alpha=0.3)
+        ax = self._prepare_axes((12, 6))
+        ax.plot(time_series, stats.arr, linewidth=2, color='blue')
+        ax.fill_between(time_series, stats.arr, alpha=0.3, color='lightblue')
+        ax.set_title('Загруженность заведения по времени')
+        ax.set_xlabel('Время (секунды)')
+        ax.set_ylabel('Количество посетителей')
+        ax.grid(True, alpha=0.3)
         
         # Добавляем пороговые линии
-        avg_people = np.mean(people_counts)
-        max_people = max(people_counts)
+        avg_people = stats.mean
+        max_people = stats.max
         
-        plt.axhline(y=avg_people, color='green', linestyle='--', label=f'Средняя загруженность: {avg_people:.1f}')
-        plt.axhline(y=max_people*0.8, color='orange', linestyle='--', label=f'Высокая загруженность: {max_people*0.8:.1f}')
-        plt.axhline(y=max_people*0.9, color='red', linestyle='--', label=f'Критическая загруженность: {max_people*0.9:.1f}')
+        ax.axhline(y=avg_people, color='green', linestyle='--', label=f'Средняя загруженность: {avg_people:.1f}')
+        ax.axhline(y=max_people*0.8, color='orange', linestyle='--', label=f'Высокая загруженность: {max_people*0.8:.1f}')
+        ax.axhline(y=max_people*0.9, color='red', linestyle='--', label=f'Критическая загруженность: {max_people*0.9:.1f}')
         
-        plt.legend()
+        ax.legend()
         
         # Сохраняем график
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         queue_graph = f"static/heatmaps/queue_analysis_{timestamp}.png"
-        plt.savefig(queue_graph, dpi=150, bbox_inches='tight')
-        plt.close()
+        self._save_figure(queue_graph)
         
         # Анализ пиковых периодов
-        peak_periods = self._find_peak_periods(time_series, people_counts)
+        peak_periods = self._find_peak_periods(time_series, stats)
         
         return {
             'image_path': queue_graph,
             'max_concurrent': max_people,
             'avg_concurrent': round(avg_people, 1),
             'peak_periods': peak_periods,
-            'congestion_warnings': self._generate_congestion_warnings(time_series, people_counts)
+            'congestion_warnings': self._generate_congestion_warnings(time_series, stats)
         }
     
-    def _find_peak_periods(self, time_series: List[float], people_counts: List[int]) -> List[Dict]:
+    def _find_peak_periods(self, time_series: np.ndarray, stats: SimpleNamespace) -> List[Dict]:
         """Находит периоды пиковой загруженности"""
-        if not time_series or not people_counts:
+        people_counts = stats.arr
+        if len(time_series) == 0 or len(people_counts) == 0:
             return []
         
-        avg_people = np.mean(people_counts)
+        avg_people = stats.mean
         peak_threshold = avg_people * 1.5
         
+        # Границы непрерывных участков выше порога
+        starts, ends = self._find_runs(people_counts >= peak_threshold)
+        
+        # Учитываем только завершившиеся периоды (как и раньше), не больше пяти
+        closed = ends < len(people_counts)
         peak_periods = []
-        in_peak = False
-        peak_start = 0
-        
-        for i, (time, count) in enumerate(zip(time_series, people_counts)):
-            if count >= peak_threshold and not in_peak:
-                in_peak = True
-                peak_start = time
-            elif count < peak_threshold and in_peak:
-                in_peak = False
-                peak_periods.append({
-                    'start_time': self._format_time(peak_start),
-                    'end_time': self._format_time(time),
-                    'duration': round(time - peak_start, 1),
-                    'max_people': max(people_counts[max(0, i-10):i])
-                })
+        for start, end in zip(starts[closed][:5].tolist(), ends[closed][:5].tolist()):
+            peak_start = time_series[start]
+            time = time_series[end]
+            peak_periods.append({
+                'start_time': self._format_time(peak_start),
+                'end_time': self._format_time(time),
+                'duration': round(float(time - peak_start), 1),
+                'max_people': int(people_counts[max(0, end-10):end].max())
+            })
         
         return peak_periods[:5]  # Топ-5 пиковых периодов
     
+    def _find_runs(self, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Находит непрерывные участки True: индексы начала и конца (не включая)"""
+        edges = np.diff(mask.astype(np.int8), prepend=0, append=0)
+        return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    
     def _format_time(self, seconds: float) -> str:
         """Форматирует время в читаемый вид"""
         minutes = int(seconds // 60)
         secs = int(seconds % 60)
         return f"{minutes:02d}:{secs:02d}"
     
-    def _generate_congestion_warnings(self, time_series: List[float], people_counts: List[int]) -> List[str]:
+    def _generate_congestion_warnings(self, time_series: np.ndarray, stats: SimpleNamespace) -> List[str]:
         """Генерирует предупреждения о перегруженности"""
         warnings = []
+        people_counts = stats.arr
         
-        if not people_counts:
+        if len(people_counts) == 0:
             return warnings
         
-        max_people = max(people_counts)
-        avg_people = np.mean(people_counts)
+        max_people = stats.max
+        avg_people = stats.mean
         
         # Проверяем различные условия
         if max_people > avg_people * 2:
@@ -368,39 +491,31 @@ class AnalyticsGenerator:
         
         # Ищем периоды длительной высокой загруженности
         high_load_threshold = avg_people * 1.3
-        consecutive_high = 0
-        max_consecutive = 0
-        
-        for count in people_counts:
-            if count >= high_load_threshold:
-                consecutive_high += 1
-                max_consecutive = max(max_consecutive, consecutive_high)
-            else:
-                consecutive_high = 0
+        starts, ends = self._find_runs(people_counts >= high_load_threshold)
+        max_consecutive = int((ends - starts).max()) if len(starts) else 0
         
         if max_consecutive > len(people_counts) * 0.2:  # Более 20% времени
             warnings.append(f"⚠️ Длительные периоды высокой загруженности: {(max_consecutive/len(people_counts)*100):.0f}% времени")
         
         return warnings
     
-    def _detect_anomalies(self, tracking_data: Dict) -> Dict:
+    def _detect_anomalies(self, tracking_data: Dict, stats: SimpleNamespace) -> Dict:
         """Детекция аномального поведения"""
         trajectories = tracking_data.get('trajectories', {})
         frame_data = tracking_data.get('frame_data', [])
         
+        # Детекторы выполняются последовательно: на кэшированных массивах каждый занимает
+        # микросекунды, и запуск пула потоков стоил бы дороже самих детекторов
         anomalies = []
         
         # Аномалия 1: Люди, которые стоят на одном месте слишком долго
-        stationary_anomalies = self._detect_stationary_anomalies(trajectories)
-        anomalies.extend(stationary_anomalies)
+        anomalies.extend(self._detect_stationary_anomalies(trajectories))
         
         # Аномалия 2: Неожиданные скопления людей
-        crowd_anomalies = self._detect_crowd_anomalies(frame_data)
-        anomalies.extend(crowd_anomalies)
+        anomalies.extend(self._detect_crowd_anomalies(frame_data, stats))
         
         # Аномалия 3: Необычные траектории
-        trajectory_anomalies = self._detect_trajectory_anomalies(trajectories)
-        anomalies.extend(trajectory_anomalies)
+        anomalies.extend(self._detect_trajectory_anomalies(trajectories))
         
         return {
             'total_anomalies': len(anomalies),
@@ -408,105 +523,133 @@ class AnalyticsGenerator:
             'severity_breakdown': self._categorize_anomalies(anomalies)
         }
     
+    def _trajectory_movement(self, soa: TrajectoryArrays) -> np.ndarray:
+        """Суммарный путь каждой траектории за один проход по плоским массивам"""
+        total_movement = np.zeros(len(soa.person_ids))
+        if len(soa.xs) == 0:
+            return total_movement
+        
+        steps = np.zeros(len(soa.xs))
+        steps[1:] = np.hypot(np.diff(soa.xs), np.diff(soa.ys))
+        # Шаг между концом одной траектории и началом следующей не считаем
+        starts = soa.offsets[:-1]
+        nonempty = np.diff(soa.offsets) > 0
+        steps[starts[nonempty]] = 0
+        total_movement[nonempty] = np.add.reduceat(steps, starts[nonempty])
+        return total_movement
+    
+    def _movement_stats(self, soa: TrajectoryArrays) -> Tuple[np.ndarray, np.ndarray]:
+        """Средний шаг и длительность каждой траектории (общие для детекторов аномалий)"""
+        if self._stats is not None and self._soa is soa:
+            return self._stats
+        
+        lengths = np.diff(soa.offsets)
+        if NUMBA_AVAILABLE:
+            avg_movement = np.empty(len(lengths))
+            durations = np.empty(len(lengths))
+            _traj_stats(soa.xs, soa.ys, soa.ts, soa.offsets, avg_movement, durations)
+        else:
+            _, durations = self._trajectory_durations(soa)
+            avg_movement = self._trajectory_movement(soa) / np.maximum(lengths, 1)
+        
+        stats = (avg_movement, durations)
+        if self._soa is soa:
+            self._stats = stats
+        return stats
+    
     def _detect_stationary_anomalies(self, trajectories: Dict) -> List[Dict]:
         """Поиск людей, стоящих на месте слишком долго"""
         anomalies = []
-        
-        for person_id, trajectory in trajectories.items():
-            if len(trajectory) < 10:  # Слишком короткая траектория
-                continue
-            
-            # Вычисляем движение
-            positions = [(point['x'], point['y']) for point in trajectory]
-            total_movement = 0
-            
-            for i in range(1, len(positions)):
-                movement = np.sqrt((positions[i][0] - positions[i-1][0])**2 + 
-                                 (positions[i][1] - positions[i-1][1])**2)
-                total_movement += movement
-            
-            avg_movement = total_movement / len(positions)
-            duration = trajectory[-1]['timestamp'] - trajectory[0]['timestamp']
-            
-            # Аномалия: мало движения при долгом присутствии
-            if avg_movement < 20 and duration > 30:  # Стоит практически на месте больше 30 секунд
-                anomalies.append({
-                    'type': 'stationary_person',
-                    'person_id': person_id,
-                    'duration': duration,
-                    'location': f"({int(positions[0][0])}, {int(positions[0][1])})",
-                    'severity': 'medium' if duration < 60 else 'high',
-                    'description': f"Посетитель стоял на одном месте {duration:.0f} секунд, возможно блокируя проход"
-                })
+        soa = self._get_soa(trajectories)
+        lengths = np.diff(soa.offsets)
+        
+        # Вычисляем движение для всех траекторий сразу
+        avg_movement, durations = self._movement_stats(soa)
+        
+        # Аномалия: мало движения при долгом присутствии
+        # (стоит практически на месте больше 30 секунд, короткие траектории пропускаем)
+        is_stationary = (lengths >= 10) & (avg_movement < 20) & (durations > 30)
+        
+        for idx in np.flatnonzero(is_stationary).tolist():
+            duration = float(durations[idx])
+            start = soa.offsets[idx]
+            anomalies.append({
+                'type': 'stationary_person',
+                'person_id': soa.person_ids[idx],
+                'duration': duration,
+                'location': f"({int(soa.xs[start])}, {int(soa.ys[start])})",
+                'severity': 'medium' if duration < 60 else 'high',
+                'description': f"Посетитель стоял на одном месте {duration:.0f} секунд, возможно блокируя проход"
+            })
         
         return anomalies
     
-    def _detect_crowd_anomalies(self, frame_data: List[Dict]) -> List[Dict]:
+    def _detect_crowd_anomalies(self, frame_data: List[Dict], stats: SimpleNamespace) -> List[Dict]:
         """Поиск неожиданных скоплений людей"""
         anomalies = []
         
         if not frame_data:
             return anomalies
         
-        people_counts = [fd.get('people_count', 0) for fd in frame_data]
-        avg_people = np.mean(people_counts)
-        std_people = np.std(people_counts)
+        avg_people = stats.mean
+        std_people = stats.std
         
         # Ищем всплески
         threshold = avg_people + 2 * std_people
         
-        for i, fd in enumerate(frame_data):
-            count = fd.get('people_count', 0)
-            if count > threshold and count > 5:  # Минимум 5 человек для аномалии
-                timestamp = fd.get('timestamp', 0)
-                anomalies.append({
-                    'type': 'crowd_surge',
-                    'timestamp': self._format_time(timestamp),
-                    'people_count': count,
-                    'expected_count': round(avg_people),
-                    'severity': 'high' if count > threshold * 1.5 else 'medium',
-                    'description': f"Неожиданное скопление {count} человек в {self._format_time(timestamp)}"
-                })
+        people_counts = stats.arr
+        surge = (people_counts > threshold) & (people_counts > 5)  # Минимум 5 человек для аномалии
+        
+        # Максимум 3 аномалии этого типа - первые по времени
+        for i in np.flatnonzero(surge)[:3].tolist():
+            count = int(people_counts[i])
+            timestamp = frame_data[i].get('timestamp', 0)
+            anomalies.append({
+                'type': 'crowd_surge',
+                'timestamp': self._format_time(timestamp),
+                'people_count': count,
+                'expected_count': round(avg_people),
+                'severity': 'high' if count > threshold * 1.5 else 'medium',
+                'description': f"Неожиданное скопление {count} человек в {self._format_time(timestamp)}"
+            })
         
-        return anomalies[:3]  # Максимум 3 аномалии этого типа
+        return anomalies
     
     def _detect_trajectory_anomalies(self, trajectories: Dict) -> List[Dict]:
         """Поиск необычных траекторий движения"""
         anomalies = []
         
         # Анализируем длительность траекторий
-        durations = []
-        for trajectory in trajectories.values():
-            if len(trajectory) > 1:
-                duration = trajectory[-1]['timestamp'] - trajectory[0]['timestamp']
-                durations.append(duration)
+        soa = self._get_soa(trajectories)
+        lengths = np.diff(soa.offsets)
+        _, all_durations = self._movement_stats(soa)
+        valid = lengths > 1
+        durations = all_durations[valid]
         
-        if not durations:
+        if len(durations) == 0:
             return anomalies
         
-        avg_duration = np.mean(durations)
-        std_duration = np.std(durations)
+        avg_duration = durations.mean()
+        std_duration = durations.std()
         
         # Ищем аномально долгие посещения
         long_threshold = avg_duration + 2 * std_duration
         
-        for person_id, trajectory in trajectories.items():
-            if len(trajectory) < 2:
-                continue
-            
-            duration = trajectory[-1]['timestamp'] - trajectory[0]['timestamp']
-            
-            if duration > long_threshold and duration > 300:  # Более 5 минут
-                anomalies.append({
-                    'type': 'long_visit',
-                    'person_id': person_id,
-                    'duration': duration,
-                    'expected_duration': round(avg_duration),
-                    'severity': 'low',
-                    'description': f"Необычно долгое посещение: {duration/60:.1f} минут (среднее: {avg_duration/60:.1f} минут)"
-                })
+        # Более 5 минут и выше порога; максимум 2 таких аномалии
+        is_long = valid & (all_durations > long_threshold) & (all_durations > 300)
+        
+        for i in np.flatnonzero(is_long)[:2].tolist():
+            duration = float(all_durations[i])
+            anomalies.append({
+                'type': 'long_visit',
+                'person_id': soa.person_ids[i],
+                'duration': duration,
+                'expected_duration': round(avg_duration),
+                'severity': 'low',
+                'description': f"Необычно долгое посещение: {duration/60:.1f} минут (среднее: {avg_duration/60:.1f} минут)"
+            })
         
-        return anomalies[:2]  # Максимум 2 таких аномалии
+        return anomalies
     
     def _categorize_anomalies(self, anomalies: List[Dict]) -> Dict:
         """Категоризация аномалий по степени важности"""
@@ -518,7 +661,7 @@ class AnalyticsGenerator:
         
         return severity_counts
     
-    def _analyze_time_patterns(self, tracking_data: Dict) -> Dict:
+    def _analyze_time_patterns(self, tracking_data: Dict, stats: SimpleNamespace) -> Dict:
         """Анализ временных паттернов активности"""
         frame_data = tracking_data.get('frame_data', [])
         
@@ -526,30 +669,30 @@ class AnalyticsGenerator:
             return {'error': 'Нет данных для временного анализа'}
         
         # Разбиваем по интервалам (например, по минутам)
-        time_intervals = {}
-        
-        for fd in frame_data:
-            timestamp = fd.get('timestamp', 0)
-            interval = int(timestamp // 60) * 60  # Округляем до минут
-            
-            if interval not in time_intervals:
-                time_intervals[interval] = []
-            
-            time_intervals[interval].append(fd.get('people_count', 0))
-        
-        # Вычисляем статистики по интервалам
+        timestamps = np.fromiter((fd.get('timestamp', 0) for fd in frame_data), dtype=float, count=len(frame_data))
+        people_counts = stats.arr
+        minutes = (timestamps // 60).astype(np.int64)
+        first_minute = int(minutes.min())
+        minute_idx = minutes - first_minute
+        
+        # Сумма, число кадров и максимум по каждой минуте за один проход
+        sum_per_minute = np.bincount(minute_idx, weights=people_counts)
+        frames_per_minute = np.bincount(minute_idx)
+        max_per_minute = np.zeros(len(frames_per_minute), dtype=np.int64)
+        np.maximum.at(max_per_minute, minute_idx, people_counts)
+        avg_per_minute = sum_per_minute / np.maximum(frames_per_minute, 1)
+        
+        # Вычисляем статистики по интервалам (в порядке времени)
         interval_stats = []
-        for interval, counts in time_intervals.items():
+        for idx in np.flatnonzero(frames_per_minute).tolist():
+            avg_people = float(avg_per_minute[idx])
             interval_stats.append({
-                'time': self._format_time(interval),
-                'avg_people': round(np.mean(counts), 1),
-                'max_people': max(counts),
-                'activity_level': self._categorize_activity(np.mean(counts))
+                'time': self._format_time((first_minute + idx) * 60),
+                'avg_people': round(avg_people, 1),
+                'max_people': int(max_per_minute[idx]),
+                'activity_level': self._categorize_activity(avg_people)
             })
         
-        # Сортируем по времени
-        interval_stats.sort(key=lambda x: x['time'])
-        
         return {
             'intervals': interval_stats,
             'busiest_minute': max(interval_stats, key=lambda x: x['max_people']) if interval_stats else None,
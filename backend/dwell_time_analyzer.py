@@ -5,11 +5,94 @@
 import numpy as np
 import cv2
 from typing import Dict, List, Tuple
-from collections import defaultdict
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use('Agg')  # Рисуем только в файлы, без GUI
+from matplotlib.figure import Figure
+from matplotlib.cm import ScalarMappable
 import os
+import shutil
 from datetime import datetime
 
+from .trajectory_soa import Trajectory, as_trajectory
+from .numba_compat import njit, NUMBA_AVAILABLE
+
+
+@njit(cache=True, nogil=True)
+def _accumulate_dwell(frames, cell_ids, offsets, n_cells, fps):
+    """
+    Время пребывания по ячейкам за один проход по всем точкам всех траекторий.
+    Для каждой траектории в ячейке берется (последний кадр - первый кадр) / fps,
+    если в ячейку попало больше одной точки; сортировка по кадрам не нужна.
+    Возвращает ячейки в порядке первого появления и накопленное время
+    """
+    first = np.zeros(n_cells, dtype=np.int64)
+    last = np.zeros(n_cells, dtype=np.int64)
+    count = np.zeros(n_cells, dtype=np.int64)
+    touched = np.empty(cell_ids.shape[0], dtype=np.int64)
+    seen = np.zeros(n_cells, dtype=np.bool_)
+    order = np.empty(n_cells, dtype=np.int64)
+    dwell = np.zeros(n_cells)
+    n_out = 0
+    for t in range(offsets.shape[0] - 1):
+        n_touched = 0
+        for k in range(offsets[t], offsets[t + 1]):
+            c = cell_ids[k]
+            f = frames[k]
+            if count[c] == 0:
+                touched[n_touched] = c
+                n_touched += 1
+                first[c] = f
+                last[c] = f
+            else:
+                first[c] = min(first[c], f)
+                last[c] = max(last[c], f)
+            count[c] += 1
+        for j in range(n_touched):
+            c = touched[j]
+            if count[c] > 1:
+                if not seen[c]:
+                    seen[c] = True
+                    order[n_out] = c
+                    n_out += 1
+                dwell[c] += (last[c] - first[c]) / fps
+            count[c] = 0
+    return order[:n_out], dwell[order[:n_out]]
+
+
+def _accumulate_dwell_numpy(frames, cell_ids, offsets, n_cells, fps):
+    """
+    Вариант _accumulate_dwell без numba: первый и последний кадр каждой ячейки
+    для траектории через np.minimum.at / np.maximum.at по плоским индексам ячеек
+    """
+    first = np.full(n_cells, np.iinfo(np.int64).max, dtype=np.int64)
+    last = np.full(n_cells, np.iinfo(np.int64).min, dtype=np.int64)
+    count = np.zeros(n_cells, dtype=np.int64)
+    first_point = np.full(n_cells, np.iinfo(np.int64).max, dtype=np.int64)
+    appearance = np.full(n_cells, np.iinfo(np.int64).max, dtype=np.int64)
+    dwell = np.zeros(n_cells)
+    for t in range(len(offsets) - 1):
+        ids = cell_ids[offsets[t]:offsets[t + 1]]
+        trajectory_frames = frames[offsets[t]:offsets[t + 1]]
+        np.minimum.at(first, ids, trajectory_frames)
+        np.maximum.at(last, ids, trajectory_frames)
+        np.add.at(count, ids, 1)
+        np.minimum.at(first_point, ids, np.arange(offsets[t], offsets[t + 1]))
+        
+        # Из одной точки время не определить; порядок - по первой точке, давшей время
+        touched = np.unique(ids)
+        busy = touched[count[touched] > 1]
+        dwell[busy] += (last[busy] - first[busy]) / fps
+        appearance[busy] = np.minimum(appearance[busy], first_point[busy])
+        
+        first[touched] = np.iinfo(np.int64).max
+        last[touched] = np.iinfo(np.int64).min
+        count[touched] = 0
+        first_point[touched] = np.iinfo(np.int64).max
+    
+    order = np.flatnonzero(appearance != np.iinfo(np.int64).max)
+    order = order[np.argsort(appearance[order], kind='stable')]
+    return order, dwell[order]
+
 
 class DwellTimeAnalyzer:
     """Анализатор времени пребывания людей в определенных местах"""
@@ -30,6 +113,17 @@ class DwellTimeAnalyzer:
             'very_high': 10.0  # 10 секунд - очень высокая теплота
         }
         
+        # Уровни по возрастанию порогов: индекс уровня = число порогов, не превышающих время
+        self._level_names = ('none', 'light', 'medium', 'high', 'very_high')
+        self._threshold_arr = np.array([self.time_thresholds[level] for level in self._level_names[1:]],
+                                       dtype=np.float64)
+        
+        # Фигура визуализации создается при первом вызове и переиспользуется
+        self._fig = None
+        
+        # Заглушка для анализа без активности рисуется один раз и копируется
+        self._placeholder_png = None
+        
         # Цвета для разных уровней теплоты (BGR формат OpenCV)
         self.heat_colors = {
             'light': (0, 100, 255),      # Оранжевый (легкая теплота)
@@ -57,56 +151,39 @@ class DwellTimeAnalyzer:
         if not trajectories:
             return {'error': 'Нет траекторий для анализа'}
         
-        # Определяем границы видео
-        all_x, all_y = [], []
-        for trajectory in trajectories.values():
-            for point in trajectory:
-                all_x.append(point['x'])
-                all_y.append(point['y'])
+        # Переводим траектории в массивы один раз
+        arrays = [soa for soa in map(as_trajectory, trajectories.values()) if len(soa.x)]
         
-        if not all_x or not all_y:
+        if not arrays:
             return {'error': 'Недостаточно данных для анализа'}
         
-        min_x, max_x = min(all_x), max(all_x)
-        min_y, max_y = min(all_y), max(all_y)
+        # Определяем границы видео: редукции по каждой траектории, затем по K траекториям
+        min_x = min(soa.x.min() for soa in arrays).item()
+        max_x = max(soa.x.max() for soa in arrays).item()
+        min_y = min(soa.y.min() for soa in arrays).item()
+        max_y = max(soa.y.max() for soa in arrays).item()
         
         # Создаем сетку для анализа
         grid_width = int((max_x - min_x) / self.grid_size) + 1
         grid_height = int((max_y - min_y) / self.grid_size) + 1
         
-        # Словарь для хранения времени пребывания в каждой ячейке
-        dwell_times = defaultdict(float)
-        
-        # Анализируем каждую траекторию
-        for person_id, trajectory in trajectories.items():
-            if len(trajectory) < 2:
-                continue
-            
-            # Группируем точки по ячейкам сетки
-            cell_groups = self._group_points_by_cells(trajectory, min_x, min_y, self.grid_size)
-            
-            # Вычисляем время пребывания в каждой ячейке
-            for cell_key, points in cell_groups.items():
-                if len(points) > 1:
-                    # Сортируем точки по времени
-                    sorted_points = sorted(points, key=lambda p: p.get('frame', 0))
-                    
-                    # Вычисляем общее время в ячейке
-                    total_time = (sorted_points[-1].get('frame', 0) - sorted_points[0].get('frame', 0)) / video_fps
-                    
-                    # Добавляем к общему времени в ячейке
-                    dwell_times[cell_key] += total_time
+        # Время пребывания по ячейкам: ячейки (K, 2) как (cell_x, cell_y) и секунды (K,)
+        cells, cell_dwell = self._accumulate_dwell_times(arrays, min_x, min_y, grid_width, grid_height, video_fps)
+        dwell_times = dict(zip(map(tuple, cells.tolist()), cell_dwell.tolist()))
         
         # Создаем тепловую карту на основе времени пребывания
-        heatmap_data = self._create_dwell_time_heatmap(dwell_times, grid_width, grid_height, min_x, min_y)
+        heatmap_data = self._create_dwell_time_heatmap(cells, cell_dwell, grid_width, grid_height)
         
-        # Анализируем зоны по времени пребывания
-        zones_analysis = self._analyze_dwell_zones(dwell_times, min_x, min_y, self.grid_size)
+        # Анализируем зоны по времени пребывания: уровень теплоты всех ячеек сразу
+        levels_idx = np.searchsorted(self._threshold_arr, cell_dwell, side='right')
+        zones_analysis = self._analyze_dwell_zones(cells, cell_dwell, levels_idx, min_x, min_y, self.grid_size)
         
         return {
             'heatmap_data': heatmap_data,
-            'dwell_times': dict(dwell_times),
+            'dwell_times': dwell_times,
             'zones_analysis': zones_analysis,
+            # Число зон на уровнях light, medium, high, very_high
+            'heat_level_counts': np.bincount(levels_idx, minlength=len(self._level_names))[1:].tolist(),
             'grid_info': {
                 'width': grid_width,
                 'height': grid_height,
@@ -115,61 +192,72 @@ class DwellTimeAnalyzer:
             }
         }
     
-    def _group_points_by_cells(self, trajectory: List[Dict], min_x: float, min_y: float, cell_size: int) -> Dict:
-        """Группирует точки траектории по ячейкам сетки"""
-        cell_groups = defaultdict(list)
-        
-        for point in trajectory:
-            x, y = point['x'], point['y']
-            cell_x = int((x - min_x) / cell_size)
-            cell_y = int((y - min_y) / cell_size)
-            cell_key = (cell_x, cell_y)
-            cell_groups[cell_key].append(point)
-        
-        return cell_groups
+    def _accumulate_dwell_times(self, arrays: List[Trajectory], min_x: float, min_y: float,
+                                grid_width: int, grid_height: int,
+                                video_fps: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Суммирует время пребывания по ячейкам сетки для всех траекторий
+        
+        Returns:
+            (ячейки (K, 2) как (cell_x, cell_y) в порядке первого появления, время в секундах (K,))
+        """
+        arrays = [soa for soa in arrays if len(soa.frame) >= 2]
+        if not arrays:
+            return np.empty((0, 2), dtype=np.int64), np.empty(0)
+        
+        # Все точки одним массивом со смещениями траекторий, ячейки - плоские индексы сетки
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum([len(soa.frame) for soa in arrays], out=offsets[1:])
+        cell_x = ((np.concatenate([soa.x for soa in arrays]) - min_x) / self.grid_size).astype(np.int64)
+        cell_y = ((np.concatenate([soa.y for soa in arrays]) - min_y) / self.grid_size).astype(np.int64)
+        frames = np.concatenate([soa.frame for soa in arrays])
+        
+        accumulate = _accumulate_dwell if NUMBA_AVAILABLE else _accumulate_dwell_numpy
+        cells, dwell = accumulate(frames, cell_y * grid_width + cell_x, offsets,
+                                  grid_width * grid_height, float(video_fps))
+        
+        return np.column_stack((cells % grid_width, cells // grid_width)), dwell
     
-    def _create_dwell_time_heatmap(self, dwell_times: Dict, grid_width: int, grid_height: int, 
-                                  min_x: float, min_y: float) -> np.ndarray:
+    def _create_dwell_time_heatmap(self, cells: np.ndarray, cell_dwell: np.ndarray,
+                                  grid_width: int, grid_height: int) -> np.ndarray:
         """Создает тепловую карту на основе времени пребывания"""
         heatmap = np.zeros((grid_height, grid_width), dtype=np.float32)
         
-        # Заполняем тепловую карту
-        for (cell_x, cell_y), dwell_time in dwell_times.items():
-            if 0 <= cell_x < grid_width and 0 <= cell_y < grid_height:
-                # Нормализуем время пребывания относительно максимального порога
-                normalized_time = min(dwell_time / self.time_thresholds['very_high'], 1.0)
-                heatmap[cell_y, cell_x] = normalized_time
+        cell_x, cell_y = cells[:, 0], cells[:, 1]
+        inside = (cell_x >= 0) & (cell_x < grid_width) & (cell_y >= 0) & (cell_y < grid_height)
+        
+        # Нормализуем время пребывания относительно максимального порога и заполняем карту одной записью
+        normalized_time = np.minimum(cell_dwell[inside] / self.time_thresholds['very_high'], 1.0)
+        heatmap[cell_y[inside], cell_x[inside]] = normalized_time
         
         return heatmap
     
-    def _analyze_dwell_zones(self, dwell_times: Dict, min_x: float, min_y: float, cell_size: int) -> List[Dict]:
-        """Анализирует зоны по времени пребывания"""
+    def _analyze_dwell_zones(self, cells: np.ndarray, cell_dwell: np.ndarray, levels_idx: np.ndarray,
+                             min_x: float, min_y: float, cell_size: int) -> List[Dict]:
+        """Анализирует зоны по времени пребывания (levels_idx - индекс уровня в self._level_names)"""
         zones = []
         
-        for (cell_x, cell_y), dwell_time in dwell_times.items():
-            # Определяем уровень теплоты
-            heat_level = self._get_heat_level(dwell_time)
-            
-            # Пропускаем зоны с минимальной активностью
-            if heat_level == 'none':
-                continue
-            
-            # Вычисляем координаты центра ячейки
-            center_x = min_x + (cell_x + 0.5) * cell_size
-            center_y = min_y + (cell_y + 0.5) * cell_size
-            
+        # Пропускаем зоны с минимальной активностью и сортируем по времени пребывания
+        # (от большего к меньшему, равные - в исходном порядке)
+        active = np.flatnonzero(levels_idx > 0)
+        active = active[np.argsort(-cell_dwell[active], kind='stable')]
+        
+        # Вычисляем координаты центров ячеек
+        center_x = min_x + (cells[active, 0] + 0.5) * cell_size
+        center_y = min_y + (cells[active, 1] + 0.5) * cell_size
+        
+        for x, y, dwell_time, level_idx in zip(center_x.tolist(), center_y.tolist(),
+                                               cell_dwell[active].tolist(), levels_idx[active].tolist()):
+            heat_level = self._level_names[level_idx]
             zones.append({
-                'x': center_x,
-                'y': center_y,
+                'x': x,
+                'y': y,
                 'dwell_time': dwell_time,
                 'heat_level': heat_level,
                 'color': self.heat_colors[heat_level],
                 'description': self._get_heat_description(heat_level, dwell_time)
             })
         
-        # Сортируем по времени пребывания (от большего к меньшему)
-        zones.sort(key=lambda z: z['dwell_time'], reverse=True)
-        
         return zones
     
     def _get_heat_level(self, dwell_time: float) -> str:
@@ -200,10 +288,23 @@ class DwellTimeAnalyzer:
                            analysis_result: Dict, analysis_id: str) -> str:
         """Создает визуализацию тепловой карты с учетом времени пребывания"""
         
+        output_path = f"static/images/heatmap_dwell_time_{analysis_id}.png"
+        output_url = f"/static/images/heatmap_dwell_time_{analysis_id}.png"
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        
+        # Без активности строить matplotlib фигуру незачем - копируем готовую заглушку
+        if heatmap_data.size == 0 or heatmap_data.max() == 0:
+            shutil.copyfile(self._get_placeholder_png(), output_path)
+            return output_url
+        
         height, width = background.shape[:2]
         
-        # Создаем matplotlib фигуру
-        fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(20, 8))
+        # Очищаем общую matplotlib фигуру вместо создания новой
+        if self._fig is None:
+            self._fig = Figure(figsize=(20, 8))
+        fig = self._fig
+        fig.clf()
+        ax1, ax2, ax3 = fig.subplots(1, 3)
         
         # Левая панель - оригинальный кадр
         background_rgb = cv2.cvtColor(background, cv2.COLOR_BGR2RGB)
@@ -212,18 +313,12 @@ class DwellTimeAnalyzer:
         ax1.axis('off')
         
         # Средняя панель - тепловая карта времени пребывания
-        if heatmap_data.max() > 0:
-            # Нормализуем данные для лучшего отображения
-            normalized_heatmap = heatmap_data / heatmap_data.max()
-            
-            # Создаем цветовую карту с учетом порогов
-            heatmap = ax2.imshow(normalized_heatmap, cmap='hot', alpha=0.8, 
-                               extent=[0, width, height, 0])
-            plt.colorbar(heatmap, ax=ax2, shrink=0.8, label='Время пребывания (нормализованное)')
-        else:
-            ax2.imshow(background_rgb, alpha=0.3)
-            ax2.text(width/2, height/2, 'Нет данных активности', 
-                    ha='center', va='center', fontsize=16, weight='bold')
+        # Раскраска и наложение на кадр делаются в OpenCV, matplotlib только показывает готовый растр
+        # Панель на фигуре ~900 пикселей в ширину: больший растр matplotlib все равно уменьшит
+        overlay = self._render_heatmap_overlay(heatmap_data, background, max_width=900)
+        ax2.imshow(cv2.cvtColor(overlay, cv2.COLOR_BGR2RGB), extent=[0, width, height, 0])
+        fig.colorbar(ScalarMappable(cmap='hot'), ax=ax2, shrink=0.8,
+                     label='Время пребывания (нормализованное)')
         
         ax2.set_title('Тепловая карта времени пребывания', fontsize=14, weight='bold')
         ax2.axis('off')
@@ -231,15 +326,15 @@ class DwellTimeAnalyzer:
         # Правая панель - статистика по зонам
         zones_analysis = analysis_result.get('zones_analysis', [])
         if zones_analysis:
-            # Группируем зоны по уровням теплоты
-            heat_levels = defaultdict(list)
-            for zone in zones_analysis:
-                heat_levels[zone['heat_level']].append(zone)
+            # Число зон по уровням теплоты (light, medium, high, very_high)
+            zone_counts = analysis_result.get('heat_level_counts')
+            if zone_counts is None:
+                level_index = {level: i for i, level in enumerate(self._level_names)}
+                levels_idx = [level_index[zone['heat_level']] for zone in zones_analysis]
+                zone_counts = np.bincount(levels_idx, minlength=len(self._level_names))[1:].tolist()
             
             # Создаем график
-            heat_level_names = ['light', 'medium', 'high', 'very_high']
             heat_level_labels = ['Легкая', 'Средняя', 'Высокая', 'Очень высокая']
-            zone_counts = [len(heat_levels.get(level, [])) for level in heat_level_names]
             
             bars = ax3.bar(heat_level_labels, zone_counts, 
                           color=['orange', 'yellow', 'red', 'darkred'])
@@ -259,16 +354,49 @@ class DwellTimeAnalyzer:
         
         ax3.grid(True, alpha=0.3)
         
-        plt.suptitle('Анализ времени пребывания людей в зонах', fontsize=18, weight='bold')
-        plt.tight_layout()
+        fig.suptitle('Анализ времени пребывания людей в зонах', fontsize=18, weight='bold')
+        fig.tight_layout()
         
-        # Сохраняем изображение
-        output_path = f"static/images/heatmap_dwell_time_{analysis_id}.png"
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        plt.savefig(output_path, dpi=150, bbox_inches='tight')
-        plt.close()
+        # Сохраняем изображение (tight_layout вместо двойной отрисовки bbox_inches='tight')
+        with matplotlib.rc_context({'path.simplify': True, 'path.simplify_threshold': 1.0}):
+            fig.savefig(output_path, dpi=150)
         
-        return f"/static/images/heatmap_dwell_time_{analysis_id}.png"
+        return output_url
+    
+    def _get_placeholder_png(self) -> str:
+        """Возвращает путь к заглушке "нет данных активности", при первом вызове рисует ее"""
+        if self._placeholder_png is None or not os.path.exists(self._placeholder_png):
+            placeholder_path = "static/images/heatmap_dwell_time_empty.png"
+            fig = Figure(figsize=(8, 4))
+            fig.text(0.5, 0.6, 'Анализ времени пребывания людей в зонах',
+                     ha='center', va='center', fontsize=16, weight='bold')
+            fig.text(0.5, 0.4, 'Нет данных активности', ha='center', va='center', fontsize=14)
+            fig.savefig(placeholder_path, dpi=100)
+            self._placeholder_png = placeholder_path
+        return self._placeholder_png
+    
+    def _render_heatmap_overlay(self, heatmap_data: np.ndarray, background: np.ndarray,
+                                max_width: int = None) -> np.ndarray:
+        """Раскрашивает тепловую карту (COLORMAP_HOT) в размер кадра и накладывает на кадр (BGR).
+        Если задан max_width, более широкий кадр сначала уменьшается"""
+        height, width = background.shape[:2]
+        if max_width and width > max_width:
+            height, width = height * max_width // width, max_width
+            background = cv2.resize(background, (width, height), interpolation=cv2.INTER_AREA)
+        heatmap_max = float(heatmap_data.max())
+        heatmap_u8 = cv2.convertScaleAbs(heatmap_data, alpha=255.0 / heatmap_max if heatmap_max > 0 else 0.0)
+        heatmap_u8 = cv2.resize(heatmap_u8, (width, height), interpolation=cv2.INTER_LINEAR)
+        heatmap_color = cv2.applyColorMap(heatmap_u8, cv2.COLORMAP_HOT)
+        return cv2.addWeighted(background, 0.3, heatmap_color, 0.7, 0)
+    
+    def save_heatmap_overlay(self, heatmap_data: np.ndarray, background: np.ndarray, analysis_id: str) -> str:
+        """Сохраняет только наложение тепловой карты на кадр, без matplotlib"""
+        output_path = f"static/images/heatmap_dwell_overlay_{analysis_id}.png"
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        # Уровень сжатия 3 заметно быстрее уровня по умолчанию при почти том же размере
+        cv2.imwrite(output_path, self._render_heatmap_overlay(heatmap_data, background),
+                    [cv2.IMWRITE_PNG_COMPRESSION, 3])
+        return f"/static/images/heatmap_dwell_overlay_{analysis_id}.png"
     
     def get_heat_level_color(self, dwell_time: float) -> Tuple[int, int, int]:
         """Возвращает цвет для определенного времени пребывания (BGR формат)"""
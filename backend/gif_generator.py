@@ -1,21 +1,77 @@
 import cv2
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 import os
+import hashlib
 from PIL import Image
-import imageio
+
+from .trajectory_soa import Trajectory
+
+
+class _PalettedGifWriter:
+    """
+    Пишет GIF с одной общей палитрой: кадры сразу переводятся в палитровый режим
+    (1 байт на пиксель) ближайшим цветом, без построения палитры на каждом кадре.
+    
+    Кадры копятся в памяти до закрытия (save_all в Pillow все равно собирает их целиком)
+    и записываются в файл одним вызовом; палитровый кадр втрое меньше RGB-кадра.
+    GIF пишется во временный файл и подменяет прежний через os.replace: недописанный
+    файл никогда не лежит по пути GIF
+    """
+    
+    def __init__(self, path: str, duration: float):
+        self.path = path
+        self.duration = duration
+        self.palette = None
+        self.frames = []
+    
+    def set_palette(self, frame_rgb: np.ndarray):
+        """Строит общую палитру по характерному кадру"""
+        self.palette = Image.fromarray(frame_rgb).quantize(colors=256)
+    
+    def append_data(self, frame_rgb: np.ndarray):
+        """Добавляет кадр; данные кадра копируются, буфер можно переиспользовать"""
+        if self.palette is None:
+            self.set_palette(frame_rgb)
+        self.frames.append(Image.fromarray(frame_rgb).quantize(palette=self.palette, dither=Image.Dither.NONE))
+    
+    def __len__(self) -> int:
+        return len(self.frames)
+    
+    def close(self):
+        if self.frames:
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                self.frames[0].save(tmp_path, format="GIF", save_all=True, append_images=self.frames[1:],
+                                    duration=self.duration)
+                os.replace(tmp_path, self.path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        self.frames = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
 
 class TrajectoryGifGenerator:
     """Генератор GIF анимаций для оценки траекторий"""
     
+    # Число цветов градиента траектории (от синего к красному)
+    PROGRESS_COLOR_BUCKETS = 16
+    
     def __init__(self, output_dir: str = "static/trajectory_gifs"):
         self.output_dir = output_dir
+        self._comparison_legend = None  # легенда GIF сравнения, рисуется при первом использовании
         os.makedirs(output_dir, exist_ok=True)
         print("🎬 TrajectoryGifGenerator инициализирован")
     
     def create_trajectory_gif(self, video_path: str, trajectory: List[Dict], 
                              trajectory_id: int, smoothness_factor: float = 0.1,
-                             duration_per_frame: float = 0.2) -> str:
+                             duration_per_frame: float = 0.2, max_width: int = 960) -> str:
         """
         Создает GIF с одной траекторией для оценки
         
@@ -25,6 +81,7 @@ class TrajectoryGifGenerator:
             trajectory_id: ID траектории
             smoothness_factor: Коэффициент плавности
             duration_per_frame: Длительность каждого кадра в секундах
+            max_width: Кадры шире уменьшаются до этой ширины перед кодированием GIF
             
         Returns:
             Путь к созданному GIF файлу
@@ -40,88 +97,218 @@ class TrajectoryGifGenerator:
             width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
             height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
             
-            # Создаем список кадров для GIF
-            frames = []
+            # Траектория в виде массивов, отсортированных по кадру
+            frames_np, points = self._prepare_trajectory(trajectory)
             
             # Находим диапазон кадров для траектории
-            start_frame = min(point['frame'] for point in trajectory)
-            end_frame = max(point['frame'] for point in trajectory)
+            start_frame = int(frames_np[0])
+            end_frame = int(frames_np[-1])
             
             print(f"🎬 Создаем GIF для траектории {trajectory_id}: кадры {start_frame}-{end_frame}")
             
-            # Обрабатываем каждый кадр в диапазоне траектории
-            for frame_num in range(start_frame, end_frame + 1):
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
-                ret, frame = cap.read()
-                
-                if not ret:
-                    continue
-                
-                # Рисуем траекторию до текущего кадра
-                self._draw_trajectory_progress(frame, trajectory, frame_num, smoothness_factor)
-                
-                # Добавляем информацию о траектории
-                self._add_trajectory_info(frame, trajectory_id, frame_num, len(trajectory))
-                
-                # Конвертируем BGR в RGB для PIL
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                pil_frame = Image.fromarray(frame_rgb)
-                
-                frames.append(pil_frame)
+            # Неизменная часть подписи рисуется один раз на весь GIF
+            static_label = self._create_trajectory_label(trajectory_id, len(trajectory))
+            label = np.empty_like(static_label)
             
-            cap.release()
-            
-            if not frames:
-                raise Exception("Не удалось создать кадры для GIF")
+            # Цвета градиента зависят только от номера отрезка - считаем их один раз на всю траекторию
+            color_runs = self._progress_color_runs(len(points))
+            thickness = self._line_thickness(smoothness_factor)
             
             # Создаем имя файла
             video_name = os.path.splitext(os.path.basename(video_path))[0]
             gif_filename = f"{video_name}_trajectory_{trajectory_id}.gif"
             gif_path = os.path.join(self.output_dir, gif_filename)
+            web_path = f"/static/trajectory_gifs/{gif_filename}"
+            
+            # Тот же GIF уже создан для этой траектории и этого видео - повторно не кодируем
+            cache_key = self._gif_cache_key(video_path, frames_np, points, trajectory_id,
+                                            smoothness_factor, duration_per_frame, max_width)
+            if self._is_cached(gif_path, cache_key):
+                cap.release()
+                print(f"♻️ GIF из кэша: {gif_path}")
+                return web_path
+            
+            # Прежний .meta удаляем до кодирования: если оно прервется, старый ключ не подтвердит GIF
+            self._remove_cache_meta(gif_path)
+            
+            # Обрабатываем каждый кадр в диапазоне траектории
+            # Перематываем один раз, дальше читаем последовательно: seek на каждом кадре
+            # заставляет декодер заново проходить от ближайшего ключевого кадра
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
             
-            # Сохраняем GIF
-            imageio.mimsave(gif_path, frames, duration=duration_per_frame)
+            # Кадры сразу переводятся в палитру писателя GIF и копятся в нем до записи файла
+            rgb = None  # буфер RGB-кадра, переиспользуется (писатель GIF копирует данные)
+            with _PalettedGifWriter(gif_path, duration=duration_per_frame) as writer:
+                for frame_num in range(start_frame, end_frame + 1):
+                    if not cap.grab():
+                        break  # Видео закончилось
+                    
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        continue
+                    
+                    if writer.palette is None:
+                        # Палитра GIF - по первому кадру со всей траекторией, чтобы в ней были все цвета линии
+                        preview = frame.copy()
+                        self._draw_trajectory_progress(preview, points, len(points), color_runs, smoothness_factor)
+                        preview = self._downscale(preview, max_width)
+                        self._add_trajectory_info(preview, static_label, label, frame_num)
+                        writer.set_palette(cv2.cvtColor(preview, cv2.COLOR_BGR2RGB))
+                        
+                        # Траектория копится на отдельном холсте: на каждом кадре дорисовываются
+                        # только новые отрезки, а на кадр холст переносится по маске одним копированием
+                        overlay = np.zeros_like(frame)
+                        overlay_mask = np.zeros(frame.shape[:2], dtype=np.uint8)
+                        drawn = 1  # точек траектории уже на холсте
+                    
+                    # Рисуем траекторию до текущего кадра
+                    visible = int(np.searchsorted(frames_np, frame_num, side='right'))
+                    if visible > drawn:
+                        self._draw_trajectory_segments(overlay, overlay_mask, points, drawn - 1, visible - 1,
+                                                       color_runs, thickness)
+                        drawn = visible
+                    if visible >= 2:
+                        cv2.copyTo(overlay, overlay_mask, frame)
+                        self._draw_current_point(frame, points[visible - 1])
+                    
+                    # Уменьшаем кадр; подпись добавляем после, чтобы она оставалась читаемой
+                    frame = self._downscale(frame, max_width)
+                    
+                    # Добавляем информацию о траектории
+                    self._add_trajectory_info(frame, static_label, label, frame_num)
+                    
+                    # Конвертируем BGR в RGB
+                    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)
+                    writer.append_data(rgb)
+                frames_written = len(writer)
             
-            print(f"✅ GIF создан: {gif_path} ({len(frames)} кадров)")
+            cap.release()
+            
+            if not frames_written:
+                raise Exception("Не удалось создать кадры для GIF")
+            
+            self._write_cache_meta(gif_path, cache_key)
+            
+            print(f"✅ GIF создан: {gif_path} ({frames_written} кадров)")
             
             # Возвращаем URL для веб-страницы
-            web_path = f"/static/trajectory_gifs/{gif_filename}"
             return web_path
             
         except Exception as e:
             print(f"❌ Ошибка создания GIF: {e}")
             return ""
     
-    def _draw_trajectory_progress(self, frame: np.ndarray, trajectory: List[Dict], 
-                                 current_frame: int, smoothness_factor: float):
-        """Рисует прогресс траектории до текущего кадра"""
-        if len(trajectory) < 2:
-            return
+    @staticmethod
+    def _hash_trajectory(frames: np.ndarray, points: np.ndarray) -> str:
+        """Хэш траектории по байтам ее массивов"""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(np.ascontiguousarray(frames).tobytes())
+        h.update(np.ascontiguousarray(points).tobytes())
+        return h.hexdigest()
+    
+    def _gif_cache_key(self, video_path: str, frames: np.ndarray, points: np.ndarray,
+                       *params) -> str:
+        """Ключ кэша GIF: хэш траектории, время изменения видео и параметры отрисовки"""
+        return f"{self._hash_trajectory(frames, points)}|{os.path.getmtime(video_path)}|{params!r}"
+    
+    def _is_cached(self, gif_path: str, cache_key: str) -> bool:
+        """GIF существует и его .meta совпадает с ключом"""
+        meta_path = gif_path + '.meta'
+        if not (os.path.exists(gif_path) and os.path.exists(meta_path)):
+            return False
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return f.read() == cache_key
+    
+    def _remove_cache_meta(self, gif_path: str):
+        """Удаляет .meta рядом с GIF, если он есть"""
+        try:
+            os.remove(gif_path + '.meta')
+        except FileNotFoundError:
+            pass
+    
+    def _write_cache_meta(self, gif_path: str, cache_key: str):
+        """Записывает .meta рядом с GIF атомарно (через временный файл и os.replace)"""
+        meta_path = gif_path + '.meta'
+        tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(cache_key)
+        os.replace(tmp_path, meta_path)
+    
+    def _downscale(self, frame: np.ndarray, max_width: int) -> np.ndarray:
+        """Уменьшает кадр до ширины max_width с сохранением пропорций (GIF все равно теряет качество)"""
+        height, width = frame.shape[:2]
+        if width <= max_width:
+            return frame
+        return cv2.resize(frame, (max_width, height * max_width // width), interpolation=cv2.INTER_AREA)
+    
+    def _prepare_trajectory(self, trajectory: List[Dict]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Переводит траекторию в массивы один раз перед циклом по кадрам
+        
+        Returns:
+            (номера кадров int32, точки (N, 2) int32), отсортированные по кадру
+        """
+        soa = Trajectory.from_points(trajectory)
+        points = np.column_stack((soa.x, soa.y)).astype(np.int32)
+        
+        order = np.argsort(soa.frame, kind='stable')
+        return soa.frame[order], points[order]
+    
+    def _progress_color_runs(self, total_points: int) -> List[Tuple[int, int, Tuple[int, int, int]]]:
+        """
+        Разбивает отрезки траектории на участки одного цвета
         
-        # Фильтруем точки до текущего кадра
-        current_points = [p for p in trajectory if p['frame'] <= current_frame]
+        Градиент квантуется до PROGRESS_COLOR_BUCKETS цветов, и так как прогресс растет вдоль
+        траектории монотонно, каждый цвет занимает один непрерывный участок отрезков
         
-        if len(current_points) < 2:
+        Returns:
+            Список (первый отрезок, отрезок после последнего, цвет BGR)
+        """
+        segments = total_points - 1
+        if segments < 1:
+            return []
+        
+        buckets = self.PROGRESS_COLOR_BUCKETS - 1
+        levels = np.rint(np.arange(segments) / segments * buckets).astype(np.int32)
+        starts = np.flatnonzero(np.diff(levels, prepend=-1)).tolist()
+        ends = starts[1:] + [segments]
+        return [(start, end, self._get_progress_color(level / buckets))
+                for start, end, level in zip(starts, ends, levels[starts].tolist())]
+    
+    def _line_thickness(self, smoothness_factor: float) -> int:
+        """Толщина линии траектории зависит от плавности"""
+        return max(2, int(5 * (1 - smoothness_factor)))
+    
+    def _draw_trajectory_progress(self, frame: np.ndarray, points: np.ndarray, visible: int,
+                                 color_runs: List[Tuple[int, int, Tuple[int, int, int]]],
+                                 smoothness_factor: float):
+        """Рисует прогресс траектории: первые visible точек (те, что не позже текущего кадра)"""
+        if visible < 2:
             return
         
-        # Рисуем траекторию
-        for i in range(len(current_points) - 1):
-            pt1 = (current_points[i]['x'], current_points[i]['y'])
-            pt2 = (current_points[i + 1]['x'], current_points[i + 1]['y'])
-            
-            # Цвет зависит от прогресса
-            progress = i / (len(current_points) - 1)
-            color = self._get_progress_color(progress)
-            
-            # Толщина линии зависит от плавности
-            thickness = max(2, int(5 * (1 - smoothness_factor)))
-            
-            cv2.line(frame, pt1, pt2, color, thickness)
-            
-            # Рисуем точку в текущей позиции
-            if i == len(current_points) - 2:  # Последняя точка
-                cv2.circle(frame, pt2, 8, (0, 255, 0), -1)  # Зеленая точка
-                cv2.circle(frame, pt2, 8, (0, 0, 0), 2)     # Черная обводка
+        self._draw_trajectory_segments(frame, None, points, 0, visible - 1, color_runs,
+                                       self._line_thickness(smoothness_factor))
+        self._draw_current_point(frame, points[visible - 1])
+    
+    def _draw_trajectory_segments(self, canvas: np.ndarray, mask: Optional[np.ndarray], points: np.ndarray,
+                                 first: int, last: int,
+                                 color_runs: List[Tuple[int, int, Tuple[int, int, int]]], thickness: int):
+        """Рисует отрезки first..last-1 траектории (одна ломаная на участок одного цвета), mask отмечает закрашенное"""
+        for start, end, color in color_runs:
+            if start >= last:
+                break
+            if end <= first:
+                continue
+            run = [points[max(start, first):min(end, last) + 1]]
+            cv2.polylines(canvas, run, False, color, thickness)
+            if mask is not None:
+                cv2.polylines(mask, run, False, 255, thickness)
+    
+    def _draw_current_point(self, frame: np.ndarray, point: np.ndarray):
+        """Рисует точку в текущей позиции"""
+        pt = tuple(point.tolist())
+        cv2.circle(frame, pt, 8, (0, 255, 0), -1)  # Зеленая точка
+        cv2.circle(frame, pt, 8, (0, 0, 0), 2)     # Черная обводка
     
     def _get_progress_color(self, progress: float) -> Tuple[int, int, int]:
         """Возвращает цвет в зависимости от прогресса траектории"""
@@ -132,27 +319,33 @@ class TrajectoryGifGenerator:
         
         return (blue, green, red)  # BGR для OpenCV
     
-    def _add_trajectory_info(self, frame: np.ndarray, trajectory_id: int, 
-                            current_frame: int, total_points: int):
-        """Добавляет информацию о траектории на кадр"""
+    def _create_trajectory_label(self, trajectory_id: int, total_points: int) -> np.ndarray:
+        """Создает подпись траектории без номера кадра (одинакова для всех кадров GIF)"""
         # Создаем фон для текста
-        text_bg = np.zeros((80, 300, 3), dtype=np.uint8)
-        text_bg[:] = (0, 0, 0)  # Черный фон
+        text_bg = np.zeros((80, 300, 3), dtype=np.uint8)  # Черный фон
         
         # Добавляем текст
         cv2.putText(text_bg, f"Траектория {trajectory_id}", (10, 25), 
                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-        cv2.putText(text_bg, f"Кадр: {current_frame}", (10, 50), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1)
         cv2.putText(text_bg, f"Точек: {total_points}", (10, 75), 
                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1)
         
+        return text_bg
+    
+    def _add_trajectory_info(self, frame: np.ndarray, static_label: np.ndarray,
+                            label: np.ndarray, current_frame: int):
+        """Добавляет информацию о траектории на кадр: копия готовой подписи + номер кадра (label - буфер)"""
+        np.copyto(label, static_label)
+        cv2.putText(label, f"Кадр: {current_frame}", (10, 50), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1)
+        
         # Размещаем в левом верхнем углу
-        h, w = text_bg.shape[:2]
-        frame[10:10+h, 10:10+w] = text_bg
+        h, w = label.shape[:2]
+        frame[10:10+h, 10:10+w] = label
     
     def create_comparison_gif(self, video_path: str, original_trajectory: List[Dict], 
-                             smoothed_trajectory: List[Dict], trajectory_id: int) -> str:
+                             smoothed_trajectory: List[Dict], trajectory_id: int,
+                             max_width: int = 960) -> str:
         """
         Создает GIF для сравнения оригинальной и сглаженной траектории
         
@@ -161,6 +354,7 @@ class TrajectoryGifGenerator:
             original_trajectory: Оригинальная траектория
             smoothed_trajectory: Сглаженная траектория
             trajectory_id: ID траектории
+            max_width: Кадры шире уменьшаются до этой ширины перед кодированием GIF
             
         Returns:
             Путь к GIF файлу сравнения
@@ -170,45 +364,65 @@ class TrajectoryGifGenerator:
             if not cap.isOpened():
                 raise Exception("Не удалось открыть видео")
             
-            frames = []
-            start_frame = min(point['frame'] for point in original_trajectory)
-            end_frame = max(point['frame'] for point in original_trajectory)
+            original_frames, original_points = self._prepare_trajectory(original_trajectory)
+            smoothed_frames, smoothed_points = self._prepare_trajectory(smoothed_trajectory)
+            start_frame = int(original_frames[0])
+            end_frame = int(original_frames[-1])
             
             print(f"🔄 Создаем GIF сравнения для траектории {trajectory_id}")
             
-            for frame_num in range(start_frame, end_frame + 1):
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
-                ret, frame = cap.read()
-                
-                if not ret:
-                    continue
-                
-                # Рисуем оригинальную траекторию (красная, пунктирная)
-                self._draw_trajectory_comparison(frame, original_trajectory, frame_num, 
-                                               color=(0, 0, 255), is_dashed=True)
-                
-                # Рисуем сглаженную траекторию (зеленая, сплошная)
-                self._draw_trajectory_comparison(frame, smoothed_trajectory, frame_num, 
-                                               color=(0, 255, 0), is_dashed=False)
-                
-                # Добавляем легенду
-                self._add_comparison_legend(frame)
-                
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                pil_frame = Image.fromarray(frame_rgb)
-                frames.append(pil_frame)
-            
-            cap.release()
-            
-            if not frames:
-                raise Exception("Не удалось создать кадры для сравнения")
-            
-            # Сохраняем GIF сравнения
             video_name = os.path.splitext(os.path.basename(video_path))[0]
             gif_filename = f"{video_name}_comparison_{trajectory_id}.gif"
             gif_path = os.path.join(self.output_dir, gif_filename)
             
-            imageio.mimsave(gif_path, frames, duration=0.3)
+            # Перематываем один раз, дальше читаем последовательно: seek на каждом кадре
+            # заставляет декодер заново проходить от ближайшего ключевого кадра
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            
+            # Кадры сразу переводятся в палитру писателя GIF и копятся в нем до записи файла
+            rgb = None  # буфер RGB-кадра, переиспользуется (писатель GIF копирует данные)
+            with _PalettedGifWriter(gif_path, duration=0.3) as writer:
+                for frame_num in range(start_frame, end_frame + 1):
+                    if not cap.grab():
+                        break  # Видео закончилось
+                    
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        continue
+                    
+                    if writer.palette is None:
+                        # Палитра GIF - по первому кадру с обеими траекториями целиком
+                        preview = frame.copy()
+                        self._draw_trajectory_comparison(preview, original_points, len(original_points),
+                                                       color=(0, 0, 255), is_dashed=True)
+                        self._draw_trajectory_comparison(preview, smoothed_points, len(smoothed_points),
+                                                       color=(0, 255, 0), is_dashed=False)
+                        preview = self._downscale(preview, max_width)
+                        self._add_comparison_legend(preview)
+                        writer.set_palette(cv2.cvtColor(preview, cv2.COLOR_BGR2RGB))
+                    
+                    # Рисуем оригинальную траекторию (красная, пунктирная)
+                    visible = np.searchsorted(original_frames, frame_num, side='right')
+                    self._draw_trajectory_comparison(frame, original_points, visible, 
+                                                   color=(0, 0, 255), is_dashed=True)
+                    
+                    # Рисуем сглаженную траекторию (зеленая, сплошная)
+                    visible = np.searchsorted(smoothed_frames, frame_num, side='right')
+                    self._draw_trajectory_comparison(frame, smoothed_points, visible, 
+                                                   color=(0, 255, 0), is_dashed=False)
+                    
+                    # Уменьшаем кадр и добавляем легенду
+                    frame = self._downscale(frame, max_width)
+                    self._add_comparison_legend(frame)
+                    
+                    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)
+                    writer.append_data(rgb)
+                frames_written = len(writer)
+            
+            cap.release()
+            
+            if not frames_written:
+                raise Exception("Не удалось создать кадры для сравнения")
             
             print(f"✅ GIF сравнения создан: {gif_path}")
             return gif_path
@@ -217,30 +431,43 @@ class TrajectoryGifGenerator:
             print(f"❌ Ошибка создания GIF сравнения: {e}")
             return ""
     
-    def _draw_trajectory_comparison(self, frame: np.ndarray, trajectory: List[Dict], 
-                                   current_frame: int, color: Tuple[int, int, int], 
+    def _draw_trajectory_comparison(self, frame: np.ndarray, points: np.ndarray, 
+                                   visible: int, color: Tuple[int, int, int], 
                                    is_dashed: bool):
-        """Рисует траекторию для сравнения"""
-        current_points = [p for p in trajectory if p['frame'] <= current_frame]
-        
-        if len(current_points) < 2:
+        """Рисует первые visible точек траектории для сравнения одним вызовом cv2.polylines"""
+        if visible < 2:
             return
         
-        for i in range(len(current_points) - 1):
-            pt1 = (current_points[i]['x'], current_points[i]['y'])
-            pt2 = (current_points[i + 1]['x'], current_points[i + 1]['y'])
-            
-            if is_dashed and i % 2 == 0:  # Пунктирная линия
-                continue
+        if is_dashed:
+            # Пунктирная линия: только нечетные отрезки (1-2, 3-4, ...)
+            dashes = (visible - 1) // 2
+            if dashes == 0:
+                return
+            cv2.polylines(frame, list(points[1:1 + 2 * dashes].reshape(dashes, 2, 2)), False, color, 3)
             
-            cv2.line(frame, pt1, pt2, color, 3)
-            
-            # Точка в текущей позиции
-            if i == len(current_points) - 2:
-                cv2.circle(frame, pt2, 6, color, -1)
+            # Последний отрезок четный - его и точку в текущей позиции не рисуем
+            if (visible - 2) % 2 == 0:
+                return
+        else:
+            cv2.polylines(frame, [points[:visible]], False, color, 3)
+        
+        # Точка в текущей позиции
+        cv2.circle(frame, points[visible - 1].tolist(), 6, color, -1)
     
     def _add_comparison_legend(self, frame: np.ndarray):
         """Добавляет легенду для сравнения траекторий"""
+        # Легенда не меняется - рисуем ее один раз
+        if self._comparison_legend is None:
+            self._comparison_legend = self._create_comparison_legend()
+        
+        # Размещаем в правом верхнем углу
+        legend_bg = self._comparison_legend
+        h, w = legend_bg.shape[:2]
+        frame_h, frame_w = frame.shape[:2]
+        frame[10:10+h, frame_w-w-10:frame_w-10] = legend_bg
+    
+    def _create_comparison_legend(self) -> np.ndarray:
+        """Рисует легенду для сравнения траекторий"""
         legend_bg = np.zeros((60, 250, 3), dtype=np.uint8)
         legend_bg[:] = (0, 0, 0)
         
@@ -252,7 +479,4 @@ class TrajectoryGifGenerator:
         cv2.putText(legend_bg, "___ Сглаженная", (10, 40), 
                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
         
-        # Размещаем в правом верхнем углу
-        h, w = legend_bg.shape[:2]
-        frame_h, frame_w = frame.shape[:2]
-        frame[10:10+h, frame_w-w-10:frame_w-10] = legend_bg
+        return legend_bg
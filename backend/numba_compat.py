@@ -0,0 +1,21 @@
+"""
+Необязательная поддержка Numba.
+Если Numba не установлена, декораторы превращаются в заглушки
+и код выполняется как обычный Python/NumPy.
+"""
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+    
+    def njit(*args, **kwargs):
+        """Заглушка для numba.njit: возвращает функцию без изменений"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        
+        def decorator(func):
+            return func
+        return decorator
@@ -2,29 +2,57 @@
 Модуль для отслеживания прогресса обработки видео
 """
 
+import logging
+
+# Дочерний логгер журнала сервера "aura": записи идут через его QueueHandler,
+# вывод в консоль делает QueueListener сервера в фоновом потоке
+logger = logging.getLogger("aura.progress")
+
+
 class ProgressTracker:
+    __slots__ = ('_state', '_last_logged')
+    
+    # Минимальный шаг прогресса (в процентах) между сообщениями в консоль
+    LOG_STEP = 1.0
+    
     def __init__(self):
-        self.current_progress = 0
-        self.current_message = ""
+        # (прогресс, сообщение) одним кортежем: запись и чтение - одна операция со ссылкой,
+        # поэтому читатель всегда видит согласованную пару без блокировок
+        self._state = (0, "")
+        self._last_logged = None
+    
+    @property
+    def progress(self):
+        return self._state[0]
+    
+    @property
+    def message(self) -> str:
+        return self._state[1]
     
     def update_progress(self, progress: float, message: str = ""):
         """Обновляет текущий прогресс"""
-        self.current_progress = progress
-        if message:
-            self.current_message = message
-        print(f"⏳ Прогресс: {progress:.1f}% - {message}")
+        current_message = self._state[1]
+        message_changed = bool(message) and message != current_message
+        self._state = (progress, message or current_message)
+    
+        # Запись в журнал - самая дорогая часть обновления, поэтому только при заметном изменении
+        if (self._last_logged is None or message_changed
+                or abs(progress - self._last_logged) >= self.LOG_STEP):
+            self._last_logged = progress
+            logger.info("⏳ Прогресс: %.1f%% - %s", progress, message)
     
     def get_progress(self):
         """Возвращает текущий прогресс"""
+        progress, message = self._state
         return {
-            "progress": self.current_progress,
-            "message": self.current_message
+            "progress": progress,
+            "message": message
         }
     
     def reset(self):
         """Сбрасывает прогресс"""
-        self.current_progress = 0
-        self.current_message = ""
+        self._state = (0, "")
+        self._last_logged = None
 
 # Глобальный экземпляр трекера прогресса
 progress_tracker = ProgressTracker()
@@ -6,29 +6,98 @@
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib import font_manager
+from PIL import Image, ImageDraw, ImageFont
+from functools import lru_cache
 from typing import List, Dict, Tuple, Optional
 import os
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import uuid
 from backend.trajectory_smoother import TrajectorySmoother
 from backend.advanced_tracker import AdvancedPersonTracker
 from backend.dwell_time_analyzer import DwellTimeAnalyzer
 from backend.progress_tracker import progress_tracker
+from backend.trajectory_soa import Trajectory, as_trajectory
+
+try:
+    import orjson
+except ImportError:  # без orjson конвертируем рекурсивным обходом
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Пятно точки траектории на карте плотности: диск радиуса 30, растеризованный так же, как cv2.circle
+POINT_DISC = cv2.circle(np.zeros((61, 61), dtype=np.uint8), (30, 30), 30, 1, -1)
+
+@lru_cache(maxsize=None)
+def heatmap_font(size: int, bold: bool = False) -> ImageFont.FreeTypeFont:
+    """Шрифт подписей тепловых карт: DejaVu Sans из matplotlib (есть кириллица, шрифты OpenCV - только латиница)"""
+    properties = font_manager.FontProperties(family="DejaVu Sans", weight="bold" if bold else "normal")
+    return ImageFont.truetype(font_manager.findfont(properties), size)
+
+def load_yolo_detector():
+    """Загружает детектор YOLO: кастомную модель, если она есть, иначе стандартную; None - если не удалось"""
+    try:
+        from backend.yolo_person_detector import YOLOPersonDetector
+        
+        # Сначала пробуем загрузить вашу кастомную модель
+        custom_model_path = "your_custom_model.pt"
+        if os.path.exists(custom_model_path):
+            print("🎯 Загружаем ВАШУ кастомную модель YOLO!")
+            detector = YOLOPersonDetector(model_path=custom_model_path)
+        else:
+            print("🎯 Загружаем стандартную модель YOLO")
+            detector = YOLOPersonDetector()
+        
+        print("✅ YOLO детектор инициализирован")
+        return detector
+    except Exception as e:
+        print(f"⚠️ Ошибка инициализации YOLO детектора: {e}")
+        return None
 
 class RealVideoAnalyzer:
-    def __init__(self):
-        """Инициализация анализатора"""
+    def __init__(self, frame_stride: int = 1, yolo_detector=None):
+        """
+        Инициализация анализатора
+        
+        Args:
+            frame_stride: YOLO обрабатывает каждый frame_stride-й кадр, остальные траектории
+                          достраиваются трекером по постоянной скорости
+            yolo_detector: Уже загруженный детектор YOLO (сервер загружает модель один раз);
+                           если не передан, детектор загружается при первом анализе
+        """
+        self.frame_stride = max(1, int(frame_stride))
+        
         # Параметры трекинга
         self.max_tracking_distance = 100  # Максимальное расстояние для связывания траекторий
         self.min_trajectory_length = 3    # Минимальная длина траектории для учета
         
-        # Инициализируем YOLO детектор позже, когда он понадобится
-        self.yolo_detector = None
+        self.yolo_detector = yolo_detector
+        
+        # Сколько кадров отдаем YOLO за один проход модели
+        self.detection_batch_size = 16
+        
+        # Первый кадр последнего проанализированного видео (фон для визуализаций)
+        self._first_frame = None
+        
+        # Буфер карты плотности тепловых карт, переиспользуется между вызовами
+        self._density_buf = None
+        
+        # PNG визуализаций пишутся в фоне, пока строятся остальные изображения и аналитика
+        self._io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-write")
+        self._pending_writes = []
         
         # Инициализируем продвинутый трекер с параметрами для YOLO
         self.advanced_tracker = AdvancedPersonTracker(
-            max_disappeared=120,  # Увеличиваем - люди могут исчезать на 4 секунды (YOLO может пропускать кадры)
-            min_trajectory_length=1  # Уменьшаем - учитываем даже одиночные детекции
+            # Увеличиваем - люди могут исчезать на 4 секунды (YOLO может пропускать кадры);
+            # счетчик идет по обработанным кадрам, поэтому делим на шаг
+            max_disappeared=max(1, 120 // self.frame_stride),
+            min_trajectory_length=1,  # Уменьшаем - учитываем даже одиночные детекции
+            frame_step=self.frame_stride
         )
         
         # Инициализируем сглаживатель траекторий
@@ -54,9 +123,9 @@ class RealVideoAnalyzer:
         self.current_video_path = video_path  # Сохраняем путь для использования в аналитике
         print(f"🎬 Открываем видео: {video_path}")
         
-        cap = cv2.VideoCapture(video_path)
+        cap = self._open_video(video_path)
         if not cap.isOpened():
-            raise Exception(f"Не удалось открыть видео: {video_path}")
+            raise OSError(f"Не удалось открыть видео: {video_path}")
         
         # Получаем информацию о видео
         fps = cap.get(cv2.CAP_PROP_FPS)
@@ -82,81 +151,37 @@ class RealVideoAnalyzer:
         progress_tracker.update_progress(5, "Начало анализа")
         print("🔍 Начинаем детекцию людей...")
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            frame_count += 1
-            
-            # Обрабатываем каждый кадр для лучшей синхронизации YOLO и трекинга
-            if frame_count % 1 != 0:  # Обрабатываем каждый кадр для максимальной точности
-                continue
-            
-            timestamp = frame_count / fps if fps > 0 else frame_count
-            
-            # Ленивая инициализация YOLO детектора
-            if self.yolo_detector is None:
-                try:
-                    from backend.yolo_person_detector import YOLOPersonDetector
-                    
-                    # Сначала пробуем загрузить вашу кастомную модель
-                    custom_model_path = "your_custom_model.pt"
-                    if os.path.exists(custom_model_path):
-                        print("🎯 Загружаем ВАШУ кастомную модель YOLO!")
-                        self.yolo_detector = YOLOPersonDetector(model_path=custom_model_path)
-                    else:
-                        print("🎯 Загружаем стандартную модель YOLO")
-                        self.yolo_detector = YOLOPersonDetector()
-                    
-                    print("✅ YOLO детектор инициализирован")
-                except Exception as e:
-                    print(f"⚠️ Ошибка инициализации YOLO детектора: {e}")
-                    # Fallback на простую детекцию
-                    self.yolo_detector = None
-            
-            # Детекция людей с помощью YOLO
-            if self.yolo_detector:
-                try:
-                    detected_people = self.yolo_detector.detect_multiple_people(frame)
-                    people_count = len(detected_people)
-                    
-                    # Преобразуем детекции в формат для трекинга
-                    detections = [(p[0], p[1], p[2], p[3]) for p in detected_people]
-                    
-                    # Если YOLO не нашел людей, продолжаем без fallback
-                    if people_count == 0:
-                        print("🔄 YOLO не нашел людей в этом кадре")
-                    
-                except Exception as e:
-                    print(f"⚠️ Ошибка YOLO детекции: {e}")
-                    detected_people = []
-                    people_count = 0
-                    detections = []
-            else:
-                # YOLO детектор не инициализирован
-                print("⚠️ YOLO детектор не доступен")
-                detected_people = []
-                people_count = 0
-                detections = []
-            
-            # people_per_frame теперь собирается автоматически в трекере
-            
-            # Используем продвинутый трекер
-            current_centroids = self.advanced_tracker.update(detections, frame_count)
-            
-            # Логируем состояние трекинга
-            if frame_count % 30 == 0:  # Каждые 30 кадров
-                active_trackers = len(self.advanced_tracker.trackers)
-                total_detections = len(detections)
-                print(f"📊 Кадр {frame_count}: детекций={total_detections}, активных трекеров={active_trackers}")
-            
-            # Траектории теперь собираются автоматически в трекере
+        # Ленивая инициализация YOLO детектора - один раз до цикла по кадрам
+        if self.yolo_detector is None:
+            self.yolo_detector = load_yolo_detector()
+        
+        if self.yolo_detector is None:
+            # Сообщаем один раз, а не на каждом кадре
+            print("⚠️ YOLO детектор не доступен, кадры обрабатываются без детекций")
+        
+        # Кадры копятся и отдаются детектору пачкой: (номер кадра, кадр)
+        frame_batch = []
+        
+        # Первый кадр служит фоном визуализаций - сохраняем его, чтобы не открывать видео повторно
+        self._first_frame = None
+        
+        # Декодирование идет в отдельном потоке и перекрывается с детекцией
+        # Кадры между обрабатываемыми (шаг frame_stride) пропускаются еще при декодировании
+        for frame_count, frame in self._decode_frames_async(cap, self.frame_stride):
+            if self._first_frame is None:
+                # retrieve каждый раз отдает новый буфер, а кадры нигде не изменяются - копия не нужна
+                self._first_frame = frame
             
-            # Прогресс
-            if frame_count % 30 == 0:
-                progress = (frame_count / total_frames) * 100
-                progress_tracker.update_progress(progress, "Обработка кадров")
+            frame_batch.append((frame_count, frame))
+            # Кадр остается только в пачке и освобождается вместе с ней после детекции
+            del frame
+            if len(frame_batch) >= self.detection_batch_size:
+                self._process_frame_batch(frame_batch, total_frames)
+                frame_batch = []
+        
+        # Досчитываем последнюю неполную пачку
+        if frame_batch:
+            self._process_frame_batch(frame_batch, total_frames)
         
         cap.release()
         
@@ -166,6 +191,9 @@ class RealVideoAnalyzer:
         
         # Получаем траектории из продвинутого трекера
         filtered_trajectories = self.advanced_tracker.get_trajectories()
+        # Те же траектории массивами - для визуализаций и статистики без обхода словарей точек;
+        # словари остаются только в результате анализа (JSON, GIF, система оценки)
+        trajectory_arrays = self.advanced_tracker.get_trajectory_arrays()
         people_per_frame = self.advanced_tracker.get_people_per_frame()
         
         print(f"✅ Обработка завершена. Найдено {len(filtered_trajectories)} траекторий")
@@ -173,29 +201,142 @@ class RealVideoAnalyzer:
         # Создаем визуализации
         progress_tracker.update_progress(85, "Создание визуализаций")
         visualizations = self._create_visualizations(
-            filtered_trajectories, people_per_frame, 
+            trajectory_arrays, people_per_frame, 
             width, height, analysis_id, video_path, fps
         )
         
+        # Фон больше не нужен - не держим кадр в памяти до следующего анализа
+        self._first_frame = None
+        
         # Генерируем аналитику
         progress_tracker.update_progress(95, "Генерация аналитики")
         analytics = self._generate_analytics(
-            filtered_trajectories, people_per_frame, 
-            duration, visualizations
+            filtered_trajectories, trajectory_arrays, people_per_frame, 
+            duration, visualizations, fps
         )
         
         # Конвертируем NumPy типы в Python типы для JSON сериализации
         progress_tracker.update_progress(100, "Завершение анализа")
         analytics = self._convert_numpy_types(analytics)
         
+        # Ссылки на изображения отдаем только после того, как файлы записаны
+        self._wait_image_writes()
+        
         return analytics
     
+    def _open_video(self, video_path: str) -> cv2.VideoCapture:
+        """
+        Открывает видео с аппаратным декодированием, если оно доступно
+        
+        OpenCV сам выбирает ускоритель (NVDEC, VAAPI, D3D11, ...) и без него
+        декодирует на CPU как обычно
+        """
+        cap = cv2.VideoCapture(video_path, cv2.CAP_ANY,
+                               [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if cap.isOpened():
+            hw_enabled = int(cap.get(cv2.CAP_PROP_HW_ACCELERATION)) != cv2.VIDEO_ACCELERATION_NONE
+            print(f"🖥️ Аппаратное декодирование: {'включено' if hw_enabled else 'недоступно, декодируем на CPU'}")
+            return cap
+        
+        # Бэкенд не принял параметры ускорения - открываем без них
+        cap.release()
+        return cv2.VideoCapture(video_path)
+    
+    def _decode_frames_async(self, cap: cv2.VideoCapture, stride: int = 1, queue_size: int = 32):
+        """
+        Генератор (номер кадра, кадр) для каждого stride-го кадра видео (нумерация с 1): поток
+        декодирования читает кадры заранее в ограниченную очередь, пока основной поток занят
+        детекцией и трекингом. Пропускаемые кадры только захватываются (grab) без декодирования в BGR
+        """
+        frames = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+        
+        def decode():
+            try:
+                frame_number = 0
+                while not stop.is_set():
+                    # grab только захватывает кадр; в BGR декодируем (retrieve) лишь обрабатываемые
+                    if not cap.grab():
+                        break
+                    frame_number += 1
+                    if frame_number % stride != 0:
+                        continue
+                    
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    frames.put((frame_number, frame))
+            finally:
+                frames.put(None)  # конец видео
+        
+        decoder = threading.Thread(target=decode, name="video-decode", daemon=True)
+        decoder.start()
+        try:
+            while True:
+                item = frames.get()
+                if item is None:
+                    break
+                yield item
+        finally:
+            # Если обработка прервалась раньше конца видео, освобождаем очередь, чтобы поток завершился
+            stop.set()
+            while decoder.is_alive():
+                try:
+                    frames.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            decoder.join()
+    
+    def _process_frame_batch(self, frame_batch: List[Tuple[int, np.ndarray]], total_frames: int):
+        """Детектирует людей в пачке кадров одним проходом YOLO и по порядку передает детекции трекеру"""
+        
+        # Детекция людей с помощью YOLO
+        if self.yolo_detector:
+            try:
+                batch_detections = self.yolo_detector.detect_multiple_people_batch(
+                    [frame for _, frame in frame_batch]
+                )
+            except Exception as e:
+                print(f"⚠️ Ошибка YOLO детекции: {e}")
+                batch_detections = [[] for _ in frame_batch]
+        else:
+            # YOLO детектор не инициализирован (предупреждение выведено до цикла)
+            batch_detections = [[] for _ in frame_batch]
+        
+        for (frame_count, _), detected_people in zip(frame_batch, batch_detections):
+            # Преобразуем детекции в формат для трекинга
+            detections = [(p[0], p[1], p[2], p[3]) for p in detected_people]
+            
+            # Если YOLO не нашел людей, продолжаем без fallback
+            if self.yolo_detector and not detections:
+                logger.debug("🔄 YOLO не нашел людей в кадре %d", frame_count)
+            
+            # Используем продвинутый трекер (траектории и people_per_frame собираются в нем)
+            self.advanced_tracker.update(detections, frame_count)
+            
+            # Логируем состояние трекинга
+            if frame_count % 30 == 0:  # Каждые 30 кадров
+                logger.debug("📊 Кадр %d: детекций=%d, активных трекеров=%d",
+                             frame_count, len(detections), len(self.advanced_tracker.trackers))
+            
+            # Прогресс
+            if frame_count % 30 == 0:
+                progress = (frame_count / total_frames) * 100
+                progress_tracker.update_progress(progress, "Обработка кадров")
+    
     def _convert_numpy_types(self, obj):
         """Конвертирует NumPy типы в Python типы для JSON сериализации"""
+        if orjson is not None:
+            # orjson сериализует NumPy сам и обходит дерево на C - это быстрее обхода на Python
+            return orjson.loads(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS))
+        return self._convert_numpy_types_recursive(obj)
+    
+    def _convert_numpy_types_recursive(self, obj):
+        """Конвертирует NumPy типы в Python типы рекурсивным обходом (без orjson)"""
         if isinstance(obj, dict):
-            return {key: self._convert_numpy_types(value) for key, value in obj.items()}
+            return {key: self._convert_numpy_types_recursive(value) for key, value in obj.items()}
         elif isinstance(obj, list):
-            return [self._convert_numpy_types(item) for item in obj]
+            return [self._convert_numpy_types_recursive(item) for item in obj]
         elif isinstance(obj, np.integer):
             return int(obj)
         elif isinstance(obj, np.floating):
@@ -214,12 +355,10 @@ class RealVideoAnalyzer:
                               video_path: str, fps: float) -> Dict:
         """Создает визуализации на основе реального видео"""
         
-        # Создаем кадр-фон из видео (первый кадр)
-        cap = cv2.VideoCapture(video_path)
-        ret, background_frame = cap.read()
-        cap.release()
+        # Кадр-фон - первый кадр, сохраненный при анализе видео
+        background_frame = self._first_frame
         
-        if not ret:
+        if background_frame is None:
             # Если не удалось получить кадр, создаем простой фон
             background_frame = np.full((height, width, 3), (240, 240, 240), dtype=np.uint8)
         
@@ -315,13 +454,14 @@ class RealVideoAnalyzer:
                 print(f"❌ Некорректный dwell_analysis: {type(dwell_analysis)}")
                 return self._create_simple_heatmap(trajectories, background, width, height, analysis_id)
                 
-            print(f"✅ Параметры проверены: width={width}, height={height}, background_shape={background.shape}")
+            logger.debug("✅ Параметры проверены: width=%d, height=%d, background_shape=%s",
+                         width, height, background.shape)
         except Exception as e:
             print(f"❌ Ошибка проверки параметров: {e}")
             return self._create_simple_heatmap(trajectories, background, width, height, analysis_id)
         
         # Создаем карту плотности на основе времени пребывания
-        density_map = np.zeros((height, width), dtype=np.float32)
+        density_map = self._get_density_buf(height, width)
         
         # Получаем данные о времени пребывания
         dwell_times = dwell_analysis.get('dwell_times', {})
@@ -330,161 +470,211 @@ class RealVideoAnalyzer:
         
         if dwell_times and grid_info:
             # Заполняем карту на основе времени пребывания в ячейках
-            min_x = grid_info['bounds']['min_x']
-            min_y = grid_info['bounds']['min_y']
-            cell_size = grid_info['cell_size']
-            
-            for (cell_x, cell_y), dwell_time in dwell_times.items():
-                # Вычисляем координаты ячейки на изображении
-                start_x = int(min_x + cell_x * cell_size)
-                end_x = int(min_x + (cell_x + 1) * cell_size)
-                start_y = int(min_y + cell_y * cell_size)
-                end_y = int(min_y + (cell_y + 1) * cell_size)
-                
-                # Ограничиваем координаты размерами изображения
-                start_x = max(0, min(start_x, width - 1))
-                end_x = max(0, min(end_x, width))
-                start_y = max(0, min(start_y, height - 1))
-                end_y = max(0, min(end_y, height))
-                
-                # Нормализуем время пребывания относительно максимального порога
-                max_threshold = self.dwell_time_analyzer.time_thresholds['very_high']
-                normalized_intensity = min(dwell_time / max_threshold, 1.0)
-                
-                # Заполняем ячейку
-                if start_y < end_y and start_x < end_x:
-                    density_map[start_y:end_y, start_x:end_x] = normalized_intensity
+            self._fill_dwell_density(density_map, dwell_times, grid_info)
         
         # Если нет данных о времени пребывания, используем стандартный подход
         if density_map.max() == 0:
             print("⚠️ Нет данных о времени пребывания, используем стандартную карту плотности")
-            for trajectory in trajectories.values():
-                for point in trajectory:
-                    x, y = int(point['x']), int(point['y'])
-                    if 0 <= x < width and 0 <= y < height:
-                        # Добавляем гауссово пятно
-                        cv2.circle(density_map, (x, y), 30, 1.0, -1)
+            self._add_trajectory_points(density_map, trajectories)
         
         # Размытие для плавности
         if density_map.max() > 0:
-            density_map = cv2.GaussianBlur(density_map, (61, 61), 0)
+            density_map = self._blur_density(density_map)
             density_map = density_map / density_map.max()
         
-        # Создаем matplotlib фигуру в прошлом стиле
-        try:
-            fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 8))
-            print(f"✅ Matplotlib фигура создана: {type(fig)}, {type(ax1)}, {type(ax2)}")
-        except Exception as e:
-            print(f"❌ Ошибка создания matplotlib фигуры: {e}")
-            return self._create_simple_heatmap(trajectories, background, width, height, analysis_id)
-        
-        # Левая панель - оригинальный кадр
+        # Изображение собирается без matplotlib: раскраска и наложение в OpenCV, подписи - в Pillow
         try:
-            background_rgb = cv2.cvtColor(background, cv2.COLOR_BGR2RGB)
-            ax1.imshow(background_rgb)
-            ax1.set_title('Оригинальный кадр из видео', fontsize=14, weight='bold')
-            ax1.axis('off')
-            print("✅ Левая панель настроена")
-        except Exception as e:
-            print(f"❌ Ошибка настройки левой панели: {e}")
-            return self._create_simple_heatmap(trajectories, background, width, height, analysis_id)
-        
-        # Правая панель - тепловая карта времени пребывания
-        try:
-            ax2.imshow(background_rgb, alpha=0.7)
+            captions = []
             if density_map.max() > 0:
-                # Используем красивую цветовую карту
-                heatmap = ax2.imshow(density_map, cmap='hot', alpha=0.6, 
-                                   extent=[0, width, height, 0])
-                plt.colorbar(heatmap, ax=ax2, shrink=0.8, label='Время пребывания (нормализованное)')
-                
-                # Добавляем информацию о порогах времени
+                # Информация о порогах времени
                 time_thresholds = self.dwell_time_analyzer.time_thresholds
-                ax2.text(10, 30, f"Пороги: 1с={time_thresholds['light']}с, 3с={time_thresholds['medium']}с, 5с={time_thresholds['high']}с, 10с={time_thresholds['very_high']}с", 
-                        fontsize=10, bbox=dict(boxstyle="round,pad=0.3", facecolor="white", alpha=0.8))
-            else:
-                ax2.text(width/2, height/2, 'Нет данных активности', 
-                        ha='center', va='center', fontsize=16, weight='bold', color='red')
-            
-            ax2.set_title('Тепловая карта времени пребывания', fontsize=14, weight='bold')
-            ax2.axis('off')
-            print("✅ Правая панель настроена")
-        except Exception as e:
-            print(f"❌ Ошибка настройки правой панели: {e}")
-            return self._create_simple_heatmap(trajectories, background, width, height, analysis_id)
-        
-        # Добавляем информацию о зонах
-        try:
+                captions.append((
+                    f"Пороги: 1с={time_thresholds['light']}с, 3с={time_thresholds['medium']}с, "
+                    f"5с={time_thresholds['high']}с, 10с={time_thresholds['very_high']}с",
+                    "white"
+                ))
+            # Информация о зонах
             if zones_analysis:
-                active_zones_text = f"Активных зон: {len(zones_analysis)}"
-                ax2.text(10, height - 30, active_zones_text, 
-                        fontsize=10, bbox=dict(boxstyle="round,pad=0.3", facecolor="yellow", alpha=0.8))
+                captions.append((f"Активных зон: {len(zones_analysis)}", "yellow"))
             
-            plt.suptitle('Анализ времени пребывания людей в зонах', fontsize=16, weight='bold')
-            plt.tight_layout()
-            print("✅ Заголовок и layout настроены")
+            image = self._render_heatmap_image(
+                background, density_map,
+                title="Анализ времени пребывания людей в зонах",
+                heatmap_title="Тепловая карта времени пребывания",
+                legend_label="Время пребывания (нормализованное)",
+                captions=captions
+            )
         except Exception as e:
-            print(f"❌ Ошибка настройки заголовка: {e}")
+            print(f"❌ Ошибка построения тепловой карты: {e}")
             return self._create_simple_heatmap(trajectories, background, width, height, analysis_id)
         
         # Сохраняем
         try:
             output_path = f"static/images/heatmap_dwell_time_{analysis_id}.png"
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            plt.savefig(output_path, dpi=150, bbox_inches='tight')
-            plt.close()
+            self._save_image_async(output_path, image)
             print(f"🎨 Красивая тепловая карта сохранена: {output_path}")
             return f"/static/images/heatmap_dwell_time_{analysis_id}.png"
         except Exception as e:
             print(f"❌ Ошибка сохранения тепловой карты: {e}")
-            plt.close()  # Закрываем фигуру в любом случае
             return self._create_simple_heatmap(trajectories, background, width, height, analysis_id)
     
+    def _render_heatmap_image(self, background: np.ndarray, density_map: np.ndarray, title: str,
+                              heatmap_title: str, legend_label: str,
+                              captions: Optional[List[Tuple[str, str]]] = None) -> np.ndarray:
+        """
+        Собирает изображение тепловой карты (BGR) в прежней компоновке: общий заголовок,
+        слева исходный кадр, справа кадр с наложенной картой (COLORMAP_HOT) и подписями,
+        под ней - шкала цветов
+        
+        Args:
+            density_map: Карта плотности, нормализованная в [0, 1]
+            captions: Подписи на плашках (текст, цвет плашки): первая - сверху слева, вторая - снизу слева
+        """
+        height, width = background.shape[:2]
+        has_data = density_map.max() > 0
+        heat_u8 = cv2.convertScaleAbs(density_map, alpha=255.0)
+        if heat_u8.shape != (height, width):
+            heat_u8 = cv2.resize(heat_u8, (width, height), interpolation=cv2.INTER_LINEAR)
+        heat_color = cv2.applyColorMap(heat_u8, cv2.COLORMAP_HOT)
+        blended = cv2.addWeighted(background, 0.4, heat_color, 0.6, 0)
+        
+        # Растр собирается в OpenCV: заголовок, подписи панелей, панели и полоса шкалы цветов
+        title_h, panel_title_h, legend_h = 50, 36, 70
+        image = np.full((title_h + panel_title_h + height + legend_h, 2 * width, 3), 255, dtype=np.uint8)
+        panels_y = title_h + panel_title_h
+        image[panels_y:panels_y + height, :width] = background
+        image[panels_y:panels_y + height, width:] = blended
+        
+        bar_x0, bar_x1 = width + width // 10, 2 * width - width // 10
+        bar_y0 = panels_y + height + 10
+        if has_data:
+            ramp = np.linspace(0, 255, bar_x1 - bar_x0).astype(np.uint8)
+            bar = cv2.applyColorMap(np.tile(ramp, (16, 1)), cv2.COLORMAP_HOT)
+            image[bar_y0:bar_y0 + 16, bar_x0:bar_x1] = bar
+            cv2.rectangle(image, (bar_x0 - 1, bar_y0 - 1), (bar_x1, bar_y0 + 16), (0, 0, 0), 1)
+        
+        # Текст (кириллица) рисуется в Pillow одним проходом по готовому растру
+        canvas = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        draw = ImageDraw.Draw(canvas)
+        draw.text((width, title_h // 2), title, font=heatmap_font(24, bold=True), fill="black", anchor="mm")
+        panel_title_y = title_h + panel_title_h // 2
+        draw.text((width // 2, panel_title_y), "Оригинальный кадр из видео",
+                  font=heatmap_font(18, bold=True), fill="black", anchor="mm")
+        draw.text((width + width // 2, panel_title_y), heatmap_title,
+                  font=heatmap_font(18, bold=True), fill="black", anchor="mm")
+        
+        caption_font = heatmap_font(14)
+        for (caption, fill), anchor_y in zip(captions or [], (panels_y + 30, panels_y + height - 30)):
+            left, top, right, bottom = draw.textbbox((width + 10, anchor_y), caption, font=caption_font, anchor="lm")
+            draw.rounded_rectangle((left - 5, top - 5, right + 5, bottom + 5), radius=5, fill=fill, outline="gray")
+            draw.text((width + 10, anchor_y), caption, font=caption_font, fill="black", anchor="lm")
+        
+        if has_data:
+            tick_font = heatmap_font(12)
+            for value in (0.0, 0.5, 1.0):
+                tick_x = bar_x0 + round(value * (bar_x1 - bar_x0 - 1))
+                draw.text((tick_x, bar_y0 + 20), f"{value:.1f}", font=tick_font, fill="black", anchor="mt")
+            draw.text(((bar_x0 + bar_x1) // 2, bar_y0 + 44), legend_label, font=tick_font, fill="black", anchor="mt")
+        else:
+            draw.text((width + width // 2, panels_y + height // 2), "Нет данных активности",
+                      font=heatmap_font(24, bold=True), fill="red", anchor="mm")
+        
+        return cv2.cvtColor(np.asarray(canvas), cv2.COLOR_RGB2BGR)
+    
+    def _blur_density(self, density_map: np.ndarray) -> np.ndarray:
+        """
+        Размывает карту плотности: три прохода box-фильтра 19x19 приближают гауссово
+        размытие 61x61 (та же сигма ~9.5), но стоят O(1) на пиксель при любом размере окна
+        """
+        for _ in range(3):
+            density_map = cv2.boxFilter(density_map, -1, (19, 19))
+        return density_map
+    
+    def _get_density_buf(self, height: int, width: int) -> np.ndarray:
+        """Возвращает обнуленный буфер карты плотности (height, width), выделяя память только при смене размера"""
+        if self._density_buf is None or self._density_buf.shape != (height, width):
+            self._density_buf = np.zeros((height, width), dtype=np.float32)
+        else:
+            self._density_buf.fill(0)
+        return self._density_buf
+    
+    def _fill_dwell_density(self, density_map: np.ndarray, dwell_times: Dict, grid_info: Dict):
+        """
+        Заполняет карту плотности нормализованным временем пребывания по ячейкам сетки
+        
+        Сетка заполняется одной записью, растягивается до пикселей одним cv2.resize
+        и вклеивается в карту со сдвигом на левый верхний угол сетки
+        """
+        height, width = density_map.shape
+        cell_size = grid_info['cell_size']
+        grid_width, grid_height = grid_info['width'], grid_info['height']
+        origin_x = int(grid_info['bounds']['min_x'])
+        origin_y = int(grid_info['bounds']['min_y'])
+        
+        # Нормализуем время пребывания относительно максимального порога
+        max_threshold = self.dwell_time_analyzer.time_thresholds['very_high']
+        cells = np.array(list(dwell_times.keys()), dtype=np.int64).reshape(-1, 2)
+        times = np.fromiter(dwell_times.values(), dtype=np.float64, count=len(dwell_times))
+        grid = np.zeros((grid_height, grid_width), dtype=np.float32)
+        grid[cells[:, 1], cells[:, 0]] = np.minimum(times / max_threshold, 1.0)
+        
+        # Каждая ячейка становится квадратом cell_size x cell_size пикселей
+        cell_map = cv2.resize(grid, (grid_width * cell_size, grid_height * cell_size),
+                              interpolation=cv2.INTER_NEAREST)
+        
+        # Часть сетки, попадающая в кадр
+        x0, x1 = max(origin_x, 0), min(origin_x + cell_map.shape[1], width)
+        y0, y1 = max(origin_y, 0), min(origin_y + cell_map.shape[0], height)
+        if x0 < x1 and y0 < y1:
+            density_map[y0:y1, x0:x1] = cell_map[y0 - origin_y:y1 - origin_y, x0 - origin_x:x1 - origin_x]
+    
+    def _add_trajectory_points(self, density_map: np.ndarray, trajectories: Dict):
+        """
+        Ставит на карту плотности насыщенные диски радиуса 30 вокруг точек траекторий
+        
+        Результат тот же, что у cv2.circle(density_map, (x, y), 30, 1.0, -1) для каждой точки:
+        точки отмечаются в маске, а объединение дисков дает одна дилатация маски диском -
+        ее стоимость не зависит от числа точек
+        """
+        arrays = [soa for soa in map(as_trajectory, trajectories.values()) if len(soa.x)]
+        if not arrays:
+            return
+        
+        height, width = density_map.shape
+        xs = np.concatenate([soa.x for soa in arrays]).astype(np.int64)
+        ys = np.concatenate([soa.y for soa in arrays]).astype(np.int64)
+        inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        
+        points_mask = np.zeros((height, width), dtype=np.uint8)
+        points_mask[ys[inside], xs[inside]] = 1
+        density_map[cv2.dilate(points_mask, POINT_DISC) > 0] = 1.0
+    
     def _create_simple_heatmap(self, trajectories: Dict, background: np.ndarray,
                               width: int, height: int, analysis_id: str) -> str:
         """Создает простую тепловую карту как fallback"""
         
         # Создаем карту плотности
-        density_map = np.zeros((height, width), dtype=np.float32)
-        
-        for trajectory in trajectories.values():
-            for point in trajectory:
-                x, y = int(point['x']), int(point['y'])
-                if 0 <= x < width and 0 <= y < height:
-                    # Добавляем гауссово пятно
-                    cv2.circle(density_map, (x, y), 30, 1.0, -1)
+        density_map = self._get_density_buf(height, width)
+        self._add_trajectory_points(density_map, trajectories)
         
         # Размытие для плавности
         if density_map.max() > 0:
-            density_map = cv2.GaussianBlur(density_map, (61, 61), 0)
+            density_map = self._blur_density(density_map)
             density_map = density_map / density_map.max()
         
-        # Создаем matplotlib фигуру
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 8))
-        
-        # Левая панель - оригинальный кадр
-        background_rgb = cv2.cvtColor(background, cv2.COLOR_BGR2RGB)
-        ax1.imshow(background_rgb)
-        ax1.set_title('Оригинальный кадр из видео', fontsize=14)
-        ax1.axis('off')
-        
-        # Правая панель - тепловая карта
-        ax2.imshow(background_rgb, alpha=0.7)
-        if density_map.max() > 0:
-            heatmap = ax2.imshow(density_map, cmap='hot', alpha=0.6, 
-                               extent=[0, width, height, 0])
-            plt.colorbar(heatmap, ax=ax2, shrink=0.8, label='Интенсивность активности')
-        
-        ax2.set_title('Тепловая карта активности', fontsize=14)
-        ax2.axis('off')
-        
-        plt.suptitle('Анализ зон активности (fallback)', fontsize=16, weight='bold')
-        plt.tight_layout()
+        # Изображение собирается без matplotlib
+        image = self._render_heatmap_image(
+            background, density_map,
+            title="Анализ зон активности (fallback)",
+            heatmap_title="Тепловая карта активности",
+            legend_label="Интенсивность активности"
+        )
         
         # Сохраняем
         output_path = f"static/images/heatmap_{analysis_id}.png"
-        plt.savefig(output_path, dpi=150, bbox_inches='tight')
-        plt.close()
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        self._save_image_async(output_path, image)
         
         return f"/static/images/heatmap_{analysis_id}.png"
     
@@ -501,35 +691,28 @@ class RealVideoAnalyzer:
             (255, 0, 255), (0, 255, 255), (255, 128, 0), (128, 0, 255)
         ]
         
+        # Сглаживаем все траектории один раз до отрисовки
+        smoothed_paths = self.trajectory_smoother.smooth_batch(trajectories)
+        
         # Рисуем каждую траекторию
-        for i, (person_id, trajectory) in enumerate(trajectories.items()):
-            if len(trajectory) < 2:
+        for i, person_id in enumerate(trajectories):
+            # Траектории короче 2 точек smooth_batch пропускает
+            if person_id not in smoothed_paths:
                 continue
             
             color = colors[i % len(colors)]
             
-            # Сглаживаем траекторию
-            smoothed_trajectory = self.trajectory_smoother.smooth_trajectory(trajectory)
-            
-            # Рисуем сглаженный путь
-            if len(smoothed_trajectory) >= 2:
-                points = [(int(p['x']), int(p['y'])) for p in smoothed_trajectory]
-                
-                # Рисуем плавные линии
-                for j in range(1, len(points)):
-                    cv2.line(result_frame, points[j-1], points[j], color, 3)
-            else:
-                # Fallback на оригинальные точки
-                points = [(int(p['x']), int(p['y'])) for p in trajectory]
-                for j in range(1, len(points)):
-                    cv2.line(result_frame, points[j-1], points[j], color, 3)
+            # Рисуем сглаженный путь плавными линиями - одной ломаной
+            path = smoothed_paths[person_id]
+            cv2.polylines(result_frame, [path], False, color, 3)
             
             # Начальная точка (зеленый круг)
-            cv2.circle(result_frame, points[0], 8, (0, 255, 0), -1)
-            cv2.circle(result_frame, points[0], 10, (255, 255, 255), 2)
+            start_point = tuple(path[0].tolist())
+            cv2.circle(result_frame, start_point, 8, (0, 255, 0), -1)
+            cv2.circle(result_frame, start_point, 10, (255, 255, 255), 2)
             
             # Конечная точка (красный квадрат)
-            end_point = points[-1]
+            end_point = path[-1].tolist()
             cv2.rectangle(result_frame, 
                          (end_point[0]-8, end_point[1]-8),
                          (end_point[0]+8, end_point[1]+8),
@@ -559,10 +742,33 @@ class RealVideoAnalyzer:
         
         # Сохраняем
         output_path = f"static/images/paths_{analysis_id}.png"
-        cv2.imwrite(output_path, result_frame)
+        self._save_image_async(output_path, result_frame)
         
         return f"/static/images/paths_{analysis_id}.png"
     
+    def _save_image_async(self, output_path: str, image: np.ndarray):
+        """
+        Ставит запись PNG в фоновый пул
+        
+        Изображение после передачи не изменяется, поэтому копия не нужна
+        """
+        self._pending_writes.append(self._io_pool.submit(self._write_png, output_path, image))
+    
+    @staticmethod
+    def _write_png(output_path: str, image: np.ndarray):
+        """Пишет PNG с быстрой компрессией: файл чуть больше, кодирование в разы быстрее"""
+        if not cv2.imwrite(output_path, image, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+            raise Exception(f"cv2.imwrite не записал {output_path}")
+    
+    def _wait_image_writes(self):
+        """Дожидается фоновой записи всех изображений текущего анализа"""
+        pending, self._pending_writes = self._pending_writes, []
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"❌ Ошибка сохранения изображения: {e}")
+    
     def _create_queue_visualization(self, people_per_frame: List, analysis_id: str) -> str:
         """Создает график загруженности"""
         
@@ -601,36 +807,46 @@ class RealVideoAnalyzer:
         
         return f"/static/images/queue_{analysis_id}.png"
     
-    def _generate_analytics(self, trajectories: Dict, people_per_frame: List,
-                          duration: float, visualizations: Dict) -> Dict:
-        """Генерирует аналитику на основе реальных данных"""
+    def _generate_analytics(self, trajectories: Dict, trajectory_arrays: Dict, people_per_frame: List,
+                          duration: float, visualizations: Dict, fps: float = 30.0) -> Dict:
+        """
+        Генерирует аналитику на основе реальных данных
+        
+        Статистика считается по trajectory_arrays (массивы), в результат попадают trajectories (словари);
+        время переводится из номеров кадров по реальному fps видео
+        """
+        if fps <= 0:
+            fps = 30.0
         
         # Базовая статистика
         total_people = len(trajectories)
-        people_counts = people_per_frame  # Теперь это список чисел
-        
-        max_concurrent = max(people_counts) if people_counts else 0
-        avg_concurrent = np.mean(people_counts) if people_counts else 0
-        
-        # Анализ траекторий
-        durations = []
-        for trajectory in trajectories.values():
-            if len(trajectory) > 1:
-                traj_duration = trajectory[-1]['timestamp'] - trajectory[0]['timestamp']
-                durations.append(traj_duration)
-        
-        avg_duration = np.mean(durations) if durations else 0
+        # Число людей в каждом кадре: максимум, среднее и кадр пика за одну передачу в NumPy
+        people_counts = np.asarray(people_per_frame, dtype=np.int32)
+        
+        max_concurrent = 0
+        avg_concurrent = 0
+        peak_frame_idx = None
+        if people_counts.size:
+            peak_frame_idx = int(people_counts.argmax())
+            max_concurrent = int(people_counts[peak_frame_idx])
+            avg_concurrent = float(people_counts.mean())
+        
+        # Анализ траекторий: длительность - от первого до последнего кадра траектории
+        frames = [soa.frame for soa in trajectory_arrays.values() if len(soa.frame) > 1]
+        avg_duration = 0
+        if frames:
+            first = np.fromiter((f[0] for f in frames), dtype=np.int64, count=len(frames))
+            last = np.fromiter((f[-1] for f in frames), dtype=np.int64, count=len(frames))
+            avg_duration = float(((last - first) / fps).mean())
         
         # Время пика
         peak_time = "N/A"
-        if people_counts:
-            peak_frame_idx = people_counts.index(max_concurrent)
-            # Предполагаем 30 FPS для расчета времени
-            peak_timestamp = peak_frame_idx / 30.0
+        if peak_frame_idx is not None:
+            peak_timestamp = peak_frame_idx / fps
             peak_time = f"{int(peak_timestamp // 60):02d}:{int(peak_timestamp % 60):02d}"
         
         # Найдем горячие точки
-        hot_spots = self._find_hot_spots(trajectories)
+        hot_spots = self._find_hot_spots(trajectory_arrays)
         
         return {
             "timestamp": datetime.now().isoformat(),
@@ -673,40 +889,43 @@ class RealVideoAnalyzer:
         if not trajectories:
             return []
         
+        return self._compute_hot_spots([as_trajectory(trajectory) for trajectory in trajectories.values()])
+    
+    def _compute_hot_spots(self, arrays: List[Trajectory]) -> List[Dict]:
+        """Считает топ-3 ячейки сетки 10x10 по числу точек траекторий"""
         # Собираем все точки
-        all_points = []
-        for trajectory in trajectories.values():
-            for point in trajectory:
-                all_points.append((point['x'], point['y']))
+        xs = np.concatenate([soa.x for soa in arrays]).astype(np.float64)
+        ys = np.concatenate([soa.y for soa in arrays]).astype(np.float64)
+        total_points = xs.size
         
-        if not all_points:
+        if not total_points:
             return []
         
         # Простой анализ плотности
         # Делим пространство на сетку и считаем точки в каждой ячейке
-        min_x = min(p[0] for p in all_points)
-        max_x = max(p[0] for p in all_points)
-        min_y = min(p[1] for p in all_points)
-        max_y = max(p[1] for p in all_points)
+        min_x, max_x = xs.min(), xs.max()
+        min_y, max_y = ys.min(), ys.max()
         
         grid_size = 10
         x_step = (max_x - min_x) / grid_size
         y_step = (max_y - min_y) / grid_size
         
-        grid_counts = {}
-        
-        for x, y in all_points:
-            grid_x = int((x - min_x) // x_step) if x_step > 0 else 0
-            grid_y = int((y - min_y) // y_step) if y_step > 0 else 0
-            key = (grid_x, grid_y)
-            grid_counts[key] = grid_counts.get(key, 0) + 1
+        # Номер ячейки - целочисленное деление смещения на шаг; точки на максимальной границе,
+        # как и прежде, попадают в отдельную (grid_size + 1)-ю ячейку
+        grid_x = np.floor_divide(xs - min_x, x_step).astype(np.int64) if x_step > 0 else np.zeros(total_points, dtype=np.int64)
+        grid_y = np.floor_divide(ys - min_y, y_step).astype(np.int64) if y_step > 0 else np.zeros(total_points, dtype=np.int64)
+        grid_counts = np.bincount(grid_x * (grid_size + 1) + grid_y)
         
-        # Находим топ-3 зоны
-        sorted_zones = sorted(grid_counts.items(), key=lambda x: x[1], reverse=True)
+        # Находим топ-3 зоны (в результат попадает только число точек, поэтому порядок равных зон не важен)
+        # Частичная сортировка за O(N): отбираем 3 наибольших значения, полностью сортируем только их
+        counts = grid_counts[grid_counts > 0]
+        if counts.size > 3:
+            counts = np.partition(counts, counts.size - 3)[-3:]
+        top_counts = np.sort(counts)[::-1].tolist()
         
         hot_spots = []
-        for i, ((grid_x, grid_y), count) in enumerate(sorted_zones[:3]):
-            intensity = count / len(all_points)
+        for i, count in enumerate(top_counts):
+            intensity = count / total_points
             hot_spots.append({
                 "rank": i + 1,
                 "intensity": round(intensity, 2),
@@ -1,12 +1,51 @@
 import json
 import os
+import re
 from datetime import datetime
+from functools import lru_cache
 from typing import List, Dict, Optional
 import sqlite3
+import threading
+
+
+# Типы значений, для которых параметры детекции кэшируются
+_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+@lru_cache(maxsize=128)
+def _encode_params_items(items: tuple) -> str:
+    """JSON параметров детекции по кортежу (ключ, тип, значение) - одинаковые параметры кодируются один раз"""
+    return json.dumps({key: value for key, _, value in items})
+
+
+def _encode_detection_params(detection_params: Optional[Dict]) -> Optional[str]:
+    """Сериализует параметры детекции для БД; повторяющиеся параметры берутся из кэша"""
+    if not detection_params:
+        return None
+    if not all(type(value) in _SCALAR_TYPES for value in detection_params.values()):
+        # Вложенные списки/словари не хешируются - кодируем без кэша
+        return json.dumps(detection_params)
+    # Тип в ключе кэша: 1, 1.0 и True равны, но кодируются по-разному.
+    # Порядок пар сохраняется, поэтому JSON совпадает с json.dumps(detection_params)
+    return _encode_params_items(tuple((key, type(value), value) for key, value in detection_params.items()))
+
 
 class TrajectoryEvaluator:
     """Система оценки качества траекторий для обучения"""
     
+    # Ключевые слова комментариев и соответствующие им типы ошибок
+    ERROR_TYPES = {
+        'короткая': 'Слишком короткая траектория',
+        'прерывается': 'Траектория прерывается',
+        'неправильное направление': 'Неправильное направление движения',
+        'ложное срабатывание': 'Ложное срабатывание (не человек)',
+        'пропущен': 'Пропущен человек',
+        'прямая': 'Слишком прямые линии',
+        'неровная': 'Неровная траектория'
+    }
+    # Все ключевые слова одним регулярным выражением - комментарий просматривается за один проход
+    _ERROR_RE = re.compile('|'.join(map(re.escape, ERROR_TYPES)))
+    
     def __init__(self, db_path: str = "trajectory_ratings.db"):
         # Используем абсолютный путь для базы данных
         if not os.path.isabs(db_path):
@@ -15,14 +54,18 @@ class TrajectoryEvaluator:
             self.db_path = db_path
         
         print(f"🗄️ База данных будет создана в: {self.db_path}")
+        
+        # Одно соединение на экземпляр вместо нового на каждый вызов; доступ из потоков - под блокировкой
+        self._lock = threading.Lock()
+        self._conn = None
         self._init_database()
         print("⭐ TrajectoryEvaluator инициализирован")
     
     def _init_database(self):
         """Инициализация базы данных для оценок"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            self._conn = self._connect()
+            cursor = self._conn.cursor()
             
             # Таблица для оценок траекторий
             cursor.execute('''
@@ -49,13 +92,38 @@ class TrajectoryEvaluator:
                 )
             ''')
             
-            conn.commit()
-            conn.close()
+            # Индексы под запросы: статистика по видео читается из индекса без обращения к таблице,
+            # паттерны ошибок ищутся по типу и выдаются по убыванию частоты без сортировки
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS ix_ratings_video_rating
+                ON trajectory_ratings(video_filename, rating)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS ix_error_patterns_type
+                ON error_patterns(error_type)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS ix_error_patterns_frequency
+                ON error_patterns(frequency DESC)
+            ''')
+            
+            self._conn.commit()
+            # Обновляет статистику планировщика, только если она устарела - дешевле полного ANALYZE
+            self._conn.execute("PRAGMA optimize")
             print("✅ База данных оценок инициализирована")
             
         except Exception as e:
             print(f"❌ Ошибка инициализации БД: {e}")
     
+    def _connect(self) -> sqlite3.Connection:
+        """Открывает соединение с БД в режиме WAL"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # WAL: запись не блокирует чтение; synchronous=NORMAL не делает fsync на каждый коммит
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+    
     def rate_trajectory(self, video_filename: str, trajectory_id: int, 
                        rating: int, comment: str = "", 
                        smoothness_factor: float = 0.1,
@@ -81,30 +149,30 @@ class TrajectoryEvaluator:
             return False
         
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Сохраняем оценку
-            cursor.execute('''
-                INSERT OR REPLACE INTO trajectory_ratings 
-                (video_filename, trajectory_id, rating, comment, smoothness_factor, detection_params, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                video_filename, 
-                trajectory_id, 
-                rating, 
-                comment, 
-                smoothness_factor,
-                json.dumps(detection_params) if detection_params else None,
-                datetime.now().isoformat()
-            ))
+            now = datetime.now().isoformat()
             
-            # Анализируем комментарий для выявления паттернов ошибок
-            if comment:
-                self._analyze_error_pattern(comment)
-            
-            conn.commit()
-            conn.close()
+            # Оценка и паттерны ошибок записываются одной транзакцией
+            with self._lock, self._conn:
+                cursor = self._conn.cursor()
+                
+                # Сохраняем оценку
+                cursor.execute('''
+                    INSERT OR REPLACE INTO trajectory_ratings 
+                    (video_filename, trajectory_id, rating, comment, smoothness_factor, detection_params, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    video_filename, 
+                    trajectory_id, 
+                    rating, 
+                    comment, 
+                    smoothness_factor,
+                    _encode_detection_params(detection_params),
+                    now
+                ))
+                
+                # Анализируем комментарий для выявления паттернов ошибок
+                if comment:
+                    self._analyze_error_pattern(cursor, comment, now)
             
             print(f"⭐ Оценка сохранена: {rating}/5 для траектории {trajectory_id}")
             return True
@@ -116,59 +184,99 @@ class TrajectoryEvaluator:
             print(f"📋 Stack trace: {traceback.format_exc()}")
             return False
     
-    def _analyze_error_pattern(self, comment: str):
-        """Анализирует комментарий для выявления типов ошибок"""
-        error_types = {
-            'короткая': 'Слишком короткая траектория',
-            'прерывается': 'Траектория прерывается',
-            'неправильное направление': 'Неправильное направление движения',
-            'ложное срабатывание': 'Ложное срабатывание (не человек)',
-            'пропущен': 'Пропущен человек',
-            'прямая': 'Слишком прямые линии',
-            'неровная': 'Неровная траектория'
-        }
+    def rate_trajectories_bulk(self, rows: List[Dict]) -> int:
+        """
+        Сохраняет пачку оценок одной транзакцией (например, за сессию разметки)
         
-        comment_lower = comment.lower()
-        detected_errors = []
+        Args:
+            rows: Оценки - словари с ключами video_filename, trajectory_id, rating
+                  и необязательными comment, smoothness_factor, detection_params
         
-        for keyword, error_type in error_types.items():
-            if keyword in comment_lower:
-                detected_errors.append(error_type)
+        Returns:
+            Количество сохраненных оценок
+        """
+        now = datetime.now().isoformat()
+        ratings = []
+        error_rows = []
+        for row in rows:
+            rating = row['rating']
+            if not (1 <= rating <= 5):
+                print(f"❌ Оценка должна быть от 1 до 5, получено: {rating} (траектория {row['trajectory_id']})")
+                continue
+            comment = row.get('comment', '')
+            ratings.append((
+                row['video_filename'],
+                row['trajectory_id'],
+                rating,
+                comment,
+                row.get('smoothness_factor', 0.1),
+                _encode_detection_params(row.get('detection_params')),
+                now
+            ))
+            if comment:
+                error_rows.extend((error_type, error_type, now) for error_type in self._detect_errors(comment))
+        
+        if not ratings:
+            return 0
+        
+        try:
+            # Все оценки и паттерны ошибок - по одному executemany в одной транзакции
+            with self._lock, self._conn:
+                cursor = self._conn.cursor()
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO trajectory_ratings
+                    (video_filename, trajectory_id, rating, comment, smoothness_factor, detection_params, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', ratings)
+                if error_rows:
+                    self._save_error_patterns(cursor, error_rows)
+            
+            print(f"⭐ Сохранено оценок: {len(ratings)}")
+            return len(ratings)
+        
+        except Exception as e:
+            print(f"❌ Ошибка пакетного сохранения оценок: {e}")
+            return 0
+    
+    def _detect_errors(self, comment: str) -> List[str]:
+        """Типы ошибок из комментария - в порядке ERROR_TYPES, каждый не более одного раза"""
+        found = set(self._ERROR_RE.findall(comment.lower()))
+        return [error_type for keyword, error_type in self.ERROR_TYPES.items() if keyword in found]
+    
+    def _analyze_error_pattern(self, cursor: sqlite3.Cursor, comment: str, now: str):
+        """Анализирует комментарий для выявления типов ошибок (запись - в транзакции оценки через cursor)"""
+        detected_errors = self._detect_errors(comment)
         
         # Сохраняем паттерны ошибок
         if detected_errors:
             try:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                for error_type in detected_errors:
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO error_patterns (error_type, frequency, last_seen)
-                        VALUES (?, 
-                                COALESCE((SELECT frequency + 1 FROM error_patterns WHERE error_type = ?), 1),
-                                ?)
-                    ''', (error_type, error_type, datetime.now().isoformat()))
-                
-                conn.commit()
-                conn.close()
-                
+                self._save_error_patterns(cursor, [(error_type, error_type, now) for error_type in detected_errors])
             except Exception as e:
                 print(f"⚠️ Ошибка анализа паттернов: {e}")
     
+    @staticmethod
+    def _save_error_patterns(cursor: sqlite3.Cursor, rows: List[tuple]):
+        """Увеличивает частоту паттернов ошибок; rows - кортежи (тип, тип, время)"""
+        # Строки выполняются по порядку, поэтому повторы одного типа в пачке накапливают частоту
+        cursor.executemany('''
+            INSERT OR REPLACE INTO error_patterns (error_type, frequency, last_seen)
+            VALUES (?,
+                    COALESCE((SELECT frequency + 1 FROM error_patterns WHERE error_type = ?), 1),
+                    ?)
+        ''', rows)
+    
     def get_trajectory_rating(self, video_filename: str, trajectory_id: int) -> Optional[Dict]:
         """Получает оценку конкретной траектории"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT rating, comment, smoothness_factor, detection_params, timestamp
-                FROM trajectory_ratings
-                WHERE video_filename = ? AND trajectory_id = ?
-            ''', (video_filename, trajectory_id))
-            
-            result = cursor.fetchone()
-            conn.close()
+            with self._lock:
+                cursor = self._conn.cursor()
+                cursor.execute('''
+                    SELECT rating, comment, smoothness_factor, detection_params, timestamp
+                    FROM trajectory_ratings
+                    WHERE video_filename = ? AND trajectory_id = ?
+                ''', (video_filename, trajectory_id))
+                
+                result = cursor.fetchone()
             
             if result:
                 return {
@@ -187,34 +295,32 @@ class TrajectoryEvaluator:
     def get_video_statistics(self, video_filename: str) -> Dict:
         """Получает статистику оценок для видео"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Общая статистика
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total_rated,
-                    AVG(rating) as avg_rating,
-                    MIN(rating) as min_rating,
-                    MAX(rating) as max_rating
-                FROM trajectory_ratings
-                WHERE video_filename = ?
-            ''', (video_filename,))
-            
-            stats = cursor.fetchone()
-            
-            # Распределение оценок
-            cursor.execute('''
-                SELECT rating, COUNT(*) as count
-                FROM trajectory_ratings
-                WHERE video_filename = ?
-                GROUP BY rating
-                ORDER BY rating
-            ''', (video_filename,))
-            
-            rating_distribution = {row[0]: row[1] for row in cursor.fetchall()}
-            
-            conn.close()
+            with self._lock:
+                cursor = self._conn.cursor()
+                
+                # Общая статистика
+                cursor.execute('''
+                    SELECT 
+                        COUNT(*) as total_rated,
+                        AVG(rating) as avg_rating,
+                        MIN(rating) as min_rating,
+                        MAX(rating) as max_rating
+                    FROM trajectory_ratings
+                    WHERE video_filename = ?
+                ''', (video_filename,))
+                
+                stats = cursor.fetchone()
+                
+                # Распределение оценок
+                cursor.execute('''
+                    SELECT rating, COUNT(*) as count
+                    FROM trajectory_ratings
+                    WHERE video_filename = ?
+                    GROUP BY rating
+                    ORDER BY rating
+                ''', (video_filename,))
+                
+                rating_distribution = {row[0]: row[1] for row in cursor.fetchall()}
             
             return {
                 'total_rated': stats[0],
@@ -231,24 +337,23 @@ class TrajectoryEvaluator:
     def get_error_patterns(self) -> List[Dict]:
         """Получает статистику типов ошибок"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT error_type, frequency, last_seen
-                FROM error_patterns
-                ORDER BY frequency DESC
-            ''')
+            with self._lock:
+                cursor = self._conn.cursor()
+                cursor.execute('''
+                    SELECT error_type, frequency, last_seen
+                    FROM error_patterns
+                    ORDER BY frequency DESC
+                ''')
+                rows = cursor.fetchall()
             
             patterns = []
-            for row in cursor.fetchall():
+            for row in rows:
                 patterns.append({
                     'error_type': row[0],
                     'frequency': row[1],
                     'last_seen': row[2]
                 })
             
-            conn.close()
             return patterns
             
         except Exception as e:
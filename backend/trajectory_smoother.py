@@ -2,6 +2,54 @@ import numpy as np
 from scipy.interpolate import splprep, splev
 from typing import List, Dict, Tuple
 import cv2
+from .trajectory_soa import as_trajectory
+from .numba_compat import njit, NUMBA_AVAILABLE
+
+# До такого числа точек сплайн вычисляется скомпилированным de Boor: на коротких траекториях
+# накладные расходы обертки splev больше самого вычисления
+SHORT_SPLINE_POINTS = 20
+
+
+@njit(cache=True, fastmath=True)
+def _eval_bspline(t, cx, cy, k, u):
+    """
+    Вычисляет параметрический B-сплайн (узлы t, коэффициенты cx, cy, степень k) в точках u
+    алгоритмом de Boor - то же, что splev для tck из splprep. Возвращает (len(u), 2)
+    """
+    n = cx.shape[0]
+    out = np.empty((u.shape[0], 2))
+    dx = np.empty(k + 1)
+    dy = np.empty(k + 1)
+    span = k
+    for i in range(u.shape[0]):
+        x = u[i]
+        # u возрастает, поэтому интервал узлов ищем, продолжая с прошлого
+        while span < n - 1 and x >= t[span + 1]:
+            span += 1
+        for j in range(k + 1):
+            dx[j] = cx[j + span - k]
+            dy[j] = cy[j + span - k]
+        for r in range(1, k + 1):
+            for j in range(k, r - 1, -1):
+                left = t[j + span - k]
+                alpha = (x - left) / (t[j + 1 + span - r] - left)
+                dx[j] = (1.0 - alpha) * dx[j - 1] + alpha * dx[j]
+                dy[j] = (1.0 - alpha) * dy[j - 1] + alpha * dy[j]
+        out[i, 0] = dx[k]
+        out[i, 1] = dy[k]
+    return out
+
+
+def _evaluate_spline(tck, u: np.ndarray, n_points: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Значения сплайна splprep в точках u: для коротких траекторий - скомпилированным de Boor"""
+    if NUMBA_AVAILABLE and n_points <= SHORT_SPLINE_POINTS:
+        t, (cx, cy), k = tck
+        values = _eval_bspline(np.asarray(t, dtype=np.float64), np.asarray(cx, dtype=np.float64),
+                               np.asarray(cy, dtype=np.float64), k, u)
+        return values[:, 0], values[:, 1]
+    x_smooth, y_smooth = splev(u, tck)
+    return x_smooth, y_smooth
+
 
 class TrajectorySmoother:
     """Сглаживание траекторий движения людей"""
@@ -28,37 +76,21 @@ class TrajectorySmoother:
             return trajectory  # Нечего сглаживать
         
         try:
-            # Проверяем и фильтруем валидные точки
-            valid_points = []
-            for point in trajectory:
-                if isinstance(point, dict) and 'x' in point and 'y' in point:
-                    try:
-                        x = float(point['x'])
-                        y = float(point['y'])
-                        if not (np.isnan(x) or np.isnan(y) or np.isinf(x) or np.isinf(y)):
-                            valid_points.append(point)
-                    except (ValueError, TypeError):
-                        continue
+            # Координаты валидных точек одним массивом
+            coords, valid_points = self._valid_coords(trajectory)
             
             if len(valid_points) < 3:
                 print(f"⚠️ Недостаточно валидных точек для сглаживания: {len(valid_points)}")
                 return trajectory
             
-            # Извлекаем координаты
-            x_coords = [float(point['x']) for point in valid_points]
-            y_coords = [float(point['y']) for point in valid_points]
-            
             # Проверяем, что координаты не все одинаковые
-            if len(set(x_coords)) < 2 or len(set(y_coords)) < 2:
+            if np.ptp(coords[:, 0]) == 0 or np.ptp(coords[:, 1]) == 0:
                 print(f"⚠️ Все точки имеют одинаковые координаты")
                 return trajectory
             
-            # Создаем параметр t для интерполяции
-            t = np.linspace(0, 1, len(valid_points))
-            
             # B-spline интерполяция
             try:
-                tck, u = splprep([x_coords, y_coords], 
+                tck, u = splprep([coords[:, 0], coords[:, 1]], 
                                 s=self.smoothness_factor * len(valid_points),  # Параметр сглаживания
                                 k=min(3, len(valid_points)-1),  # Степень сплайна
                                 per=False,  # Не периодическая
@@ -69,31 +101,26 @@ class TrajectorySmoother:
                 u_new = np.linspace(0, 1, num_points)
                 
                 # Вычисляем сглаженные координаты
-                smoothed_coords = splev(u_new, tck)
-                x_smooth, y_smooth = smoothed_coords
+                x_smooth, y_smooth = _evaluate_spline(tck, u_new, len(valid_points))
+                
+                # frame и timestamp линейно интерполируются между первой и последней точкой сразу для всех
+                # точек; крайние точки сохраняют исходные значения
+                first, last = valid_points[0], valid_points[-1]
+                frame0, frame1 = first.get('frame', 0), last.get('frame', 0)
+                time0, time1 = first.get('timestamp', 0), last.get('timestamp', 0)
+                progress = np.arange(num_points) / (num_points - 1)
+                frames = (frame0 + progress * (frame1 - frame0)).astype(np.int64).tolist()
+                timestamps = (time0 + progress * (time1 - time0)).tolist()
+                frames[0], frames[-1] = frame0, frame1
+                timestamps[0], timestamps[-1] = time0, time1
                 
                 # Создаем сглаженную траекторию
-                smoothed_trajectory = []
-                for i in range(len(x_smooth)):
-                    # Интерполируем frame и timestamp
-                    if i == 0:
-                        frame = valid_points[0].get('frame', 0)
-                        timestamp = valid_points[0].get('timestamp', 0)
-                    elif i == len(x_smooth) - 1:
-                        frame = valid_points[-1].get('frame', 0)
-                        timestamp = valid_points[-1].get('timestamp', 0)
-                    else:
-                        # Линейная интерполяция frame и timestamp
-                        progress = i / (len(x_smooth) - 1)
-                        frame = int(valid_points[0].get('frame', 0) + progress * (valid_points[-1].get('frame', 0) - valid_points[0].get('frame', 0)))
-                        timestamp = valid_points[0].get('timestamp', 0) + progress * (valid_points[-1].get('timestamp', 0) - valid_points[0].get('timestamp', 0))
-                    
-                    smoothed_trajectory.append({
-                        'x': int(x_smooth[i]),
-                        'y': int(y_smooth[i]),
-                        'frame': frame,
-                        'timestamp': timestamp
-                    })
+                smoothed_trajectory = [
+                    {'x': x, 'y': y, 'frame': frame, 'timestamp': timestamp}
+                    for x, y, frame, timestamp in zip(np.asarray(x_smooth).astype(np.int64).tolist(),
+                                                      np.asarray(y_smooth).astype(np.int64).tolist(),
+                                                      frames, timestamps)
+                ]
                 
                 print(f"✨ Траектория сглажена: {len(trajectory)} → {len(smoothed_trajectory)} точек")
                 return smoothed_trajectory
@@ -107,36 +134,123 @@ class TrajectorySmoother:
             print(f"⚠️ Ошибка сглаживания: {e}, возвращаем исходную траекторию")
             return trajectory
     
+    def _valid_coords(self, trajectory: List[Dict]) -> Tuple[np.ndarray, List[Dict]]:
+        """
+        Возвращает координаты (N, 2) float64 и сами точки, у которых есть конечные числовые x и y
+        
+        Обычно все точки корректны и массив строится одним вызовом; поштучная проверка -
+        только если в траектории встретились точки неверного формата
+        """
+        try:
+            coords = np.array([(point['x'], point['y']) for point in trajectory], dtype=np.float64).reshape(-1, 2)
+        except (TypeError, ValueError, KeyError, IndexError):
+            valid_points = []
+            for point in trajectory:
+                if isinstance(point, dict) and 'x' in point and 'y' in point:
+                    try:
+                        float(point['x'])
+                        float(point['y'])
+                        valid_points.append(point)
+                    except (ValueError, TypeError):
+                        continue
+            coords = np.array([(point['x'], point['y']) for point in valid_points], dtype=np.float64).reshape(-1, 2)
+            trajectory = valid_points
+        
+        finite = np.isfinite(coords).all(axis=1)
+        if finite.all():
+            return coords, list(trajectory)
+        return coords[finite], [point for point, ok in zip(trajectory, finite.tolist()) if ok]
+    
+    def smooth_batch(self, trajectories: Dict) -> Dict[str, np.ndarray]:
+        """
+        Сглаживает сразу все траектории для отрисовки путей
+        
+        Args:
+            trajectories: Словарь траекторий {id: [{'x': x, 'y': y, ...}, ...]} или {id: Trajectory}
+            
+        Returns:
+            {id: точки сглаженного пути (M, 2) int32}; траектории короче 2 точек пропускаются
+        """
+        paths = {}
+        for key, trajectory in trajectories.items():
+            soa = as_trajectory(trajectory)
+            if len(soa.x) < 2:
+                continue
+            paths[key] = self.smooth_points(soa.x, soa.y)
+        
+        print(f"✨ Сглажено траекторий: {len(paths)}")
+        return paths
+    
+    def smooth_points(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        Сглаживает путь по массивам координат - то же, что smooth_trajectory,
+        но без построения словарей точек (кадры и время не интерполируются)
+        
+        Returns:
+            Точки сглаженного пути (M, 2) int32
+        """
+        points = np.column_stack((x, y))
+        if len(points) < 3:
+            return points.astype(np.int32)  # Нечего сглаживать
+        
+        # Проверяем и фильтруем валидные точки
+        coords = points.astype(np.float64)
+        valid = np.isfinite(coords).all(axis=1)
+        if np.count_nonzero(valid) < 3:
+            return points.astype(np.int32)
+        
+        x_coords, y_coords = coords[valid, 0], coords[valid, 1]
+        
+        # Проверяем, что координаты не все одинаковые
+        if x_coords.min() == x_coords.max() or y_coords.min() == y_coords.max():
+            return points.astype(np.int32)
+        
+        n = len(x_coords)
+        try:
+            tck, u = splprep([x_coords, y_coords],
+                            s=self.smoothness_factor * n,
+                            k=min(3, n - 1),
+                            per=False,
+                            quiet=True)
+            
+            # Генерируем больше точек для плавности
+            x_smooth, y_smooth = _evaluate_spline(tck, np.linspace(0, 1, max(n * 3, 50)), n)
+            return np.column_stack((x_smooth, y_smooth)).astype(np.int32)
+            
+        except Exception as spline_error:
+            print(f"⚠️ Ошибка B-spline интерполяции: {spline_error}")
+            # Fallback: простое сглаживание - середины отрезков между точками
+            valid_points = points[valid]
+            smoothed = np.empty((2 * len(valid_points) - 1, 2), dtype=valid_points.dtype)
+            smoothed[0::2] = valid_points
+            smoothed[1::2] = (valid_points[:-1] + valid_points[1:]) // 2
+            return smoothed.astype(np.int32)
+    
     def _simple_smoothing(self, points: List[Dict]) -> List[Dict]:
         """Простое сглаживание как fallback"""
         try:
             if len(points) < 2:
                 return points
             
-            # Простое сглаживание: добавляем промежуточные точки
-            smoothed = []
-            for i in range(len(points) - 1):
-                current = points[i]
-                next_point = points[i + 1]
-                
-                # Добавляем текущую точку
-                smoothed.append(current)
-                
-                # Добавляем промежуточную точку
-                mid_x = (current['x'] + next_point['x']) // 2
-                mid_y = (current['y'] + next_point['y']) // 2
-                mid_frame = (current.get('frame', 0) + next_point.get('frame', 0)) // 2
-                mid_timestamp = (current.get('timestamp', 0) + next_point.get('timestamp', 0)) / 2
-                
-                smoothed.append({
-                    'x': mid_x,
-                    'y': mid_y,
-                    'frame': mid_frame,
-                    'timestamp': mid_timestamp
-                })
+            # Простое сглаживание: добавляем промежуточные точки - середины соседних пар,
+            # сразу для всех пар массивами
+            xs = np.array([point['x'] for point in points])
+            ys = np.array([point['y'] for point in points])
+            frames = np.array([point.get('frame', 0) for point in points])
+            timestamps = np.array([point.get('timestamp', 0) for point in points])
+            
+            midpoints = [
+                {'x': x, 'y': y, 'frame': frame, 'timestamp': timestamp}
+                for x, y, frame, timestamp in zip(((xs[:-1] + xs[1:]) // 2).tolist(),
+                                                  ((ys[:-1] + ys[1:]) // 2).tolist(),
+                                                  ((frames[:-1] + frames[1:]) // 2).tolist(),
+                                                  ((timestamps[:-1] + timestamps[1:]) / 2).tolist())
+            ]
             
-            # Добавляем последнюю точку
-            smoothed.append(points[-1])
+            # Исходные точки чередуются с промежуточными
+            smoothed = [None] * (2 * len(points) - 1)
+            smoothed[0::2] = points
+            smoothed[1::2] = midpoints
             
             print(f"🔄 Простое сглаживание: {len(points)} → {len(smoothed)} точек")
             return smoothed
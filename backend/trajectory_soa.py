@@ -0,0 +1,85 @@
+"""
+Представление траектории в виде параллельных массивов (SoA) вместо списка словарей
+"""
+
+import numpy as np
+from typing import Dict, List, NamedTuple
+
+
+class Trajectory(NamedTuple):
+    """Траектория одного человека: номера кадров и координаты точек в параллельных массивах"""
+    frame: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    
+    @classmethod
+    def from_points(cls, points: List[Dict]) -> 'Trajectory':
+        """
+        Переводит список точек {'x', 'y', 'frame', ...} в массивы один раз на входе
+        
+        Координаты сохраняют исходный тип (целые остаются целыми), кадры - int32
+        """
+        n = len(points)
+        frame = np.fromiter((p.get('frame', 0) for p in points), dtype=np.int32, count=n)
+        x = np.array([p['x'] for p in points])
+        y = np.array([p['y'] for p in points])
+        return cls(frame, x, y)
+    
+    def to_points(self, fps: float) -> List[Dict]:
+        """
+        Переводит траекторию обратно в список точек {'frame', 'timestamp', 'x', 'y'}
+        
+        Нужен только на границе API (JSON), timestamp вычисляется из кадра
+        """
+        n = len(self.frame)
+        timestamps = (self.frame / fps).tolist() if fps > 0 else [0] * n
+        return [
+            {'frame': frame, 'timestamp': timestamp, 'x': x, 'y': y}
+            for frame, timestamp, x, y in zip(self.frame.tolist(), timestamps, self.x.tolist(), self.y.tolist())
+        ]
+
+
+def as_trajectory(trajectory) -> Trajectory:
+    """Возвращает траекторию массивами: Trajectory - как есть, список точек - через from_points"""
+    if isinstance(trajectory, Trajectory):
+        return trajectory
+    return Trajectory.from_points(trajectory)
+
+
+# Упакованная точка растущей траектории: 8 байт вместо словаря с отдельными int-объектами.
+# Координаты в пикселях помещаются в int16; timestamp не храним - он вычисляется из кадра
+POINT_DTYPE = np.dtype([('x', '<i2'), ('y', '<i2'), ('frame', '<i4')])
+
+
+class TrajectoryBuffer:
+    """
+    Траектория, которая растет по ходу обработки видео: точки дописываются
+    в заранее выделенный массив записей POINT_DTYPE, при переполнении емкость удваивается
+    """
+    __slots__ = ('_points', '_n')
+    
+    def __init__(self, capacity: int = 64):
+        self._points = np.empty(capacity, dtype=POINT_DTYPE)
+        self._n = 0
+    
+    def __len__(self) -> int:
+        return self._n
+    
+    def append(self, frame: int, x: int, y: int):
+        """Добавляет точку в конец траектории"""
+        n = self._n
+        if n == len(self._points):
+            self._grow()
+        self._points[n] = (x, y, frame)
+        self._n = n + 1
+    
+    def _grow(self):
+        """Удваивает емкость буфера, сохраняя записанные точки"""
+        points = np.empty(2 * len(self._points), dtype=POINT_DTYPE)
+        points[:self._n] = self._points[:self._n]
+        self._points = points
+    
+    def to_trajectory(self) -> Trajectory:
+        """Возвращает записанные точки как Trajectory (int64-координаты, как у from_points)"""
+        points = self._points[:self._n]
+        return Trajectory(points['frame'].copy(), points['x'].astype(np.int64), points['y'].astype(np.int64))
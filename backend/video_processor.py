@@ -5,9 +5,101 @@
 
 import cv2
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
+from scipy.spatial import cKDTree
+from .numba_compat import njit, NUMBA_AVAILABLE
+from .trajectory_soa import TrajectoryBuffer
+
+try:
+    import orjson
+except ImportError:  # без orjson пишем стандартным json
+    orjson = None
+
+# Порог сопоставления центров между кадрами, пикселей
+MATCH_DISTANCE = 100
+# С этого числа прошлых центров ближайший ищется по KD-дереву, а не перебором
+KDTREE_MIN_POINTS = 16
+# Сколько кадров отдаем YOLO за один проход сети
+DETECTION_BATCH_SIZE = 16
+# Размер входа сети YOLO и пороги постобработки
+YOLO_INPUT_SIZE = (416, 416)
+YOLO_CONFIDENCE = 0.5
+YOLO_NMS_THRESHOLD = 0.4
+
+
+@njit(cache=True, fastmath=True)
+def _match_nearest(cur, prev, max_dist2):
+    """
+    Для каждого текущего центра находит ближайший центр прошлого кадра с квадратом
+    расстояния меньше max_dist2. Возвращает индекс в prev для каждого центра (-1 - нет пары)
+    """
+    n = cur.shape[0]
+    m = prev.shape[0]
+    out = np.full(n, -1, dtype=np.int64)
+    for i in range(n):
+        best_d = max_dist2  # порог сразу служит начальным значением минимума
+        best_j = -1
+        for j in range(m):
+            dx = cur[i, 0] - prev[j, 0]
+            dy = cur[i, 1] - prev[j, 1]
+            d = dx * dx + dy * dy
+            if d < best_d:
+                best_d = d
+                best_j = j
+        out[i] = best_j
+    return out
+
+
+def _match_nearest_numpy(cur, prev, max_dist2):
+    """То же сопоставление матрицей расстояний NumPy - без Numba цикл на Python медленнее"""
+    out = np.full(cur.shape[0], -1, dtype=np.int64)
+    if cur.shape[0] == 0 or prev.shape[0] == 0:
+        return out
+    diff = cur[:, None, :] - prev[None, :, :]
+    dist2 = (diff * diff).sum(axis=2)
+    # argmin берет первый из равных минимумов - как строгое сравнение в цикле
+    nearest = dist2.argmin(axis=1)
+    found = dist2[np.arange(cur.shape[0]), nearest] < max_dist2
+    out[found] = nearest[found]
+    return out
+
+
+def _match_centroids(cur: np.ndarray, prev: np.ndarray) -> List[int]:
+    """
+    Сопоставляет текущие центры прошлым: индекс ближайшего прошлого центра в пределах
+    MATCH_DISTANCE для каждого текущего (-1 - новый человек). Прошлый центр достается
+    только одной, ближайшей к нему детекции
+    """
+    if len(cur) == 0 or len(prev) == 0:
+        return [-1] * len(cur)
+    
+    if len(prev) >= KDTREE_MIN_POINTS:
+        # O(N log M): без пары query возвращает расстояние inf и индекс len(prev)
+        dist, nearest = cKDTree(prev).query(cur, distance_upper_bound=MATCH_DISTANCE)
+        nearest = np.where(np.isfinite(dist), nearest, -1)
+    else:
+        match = _match_nearest if NUMBA_AVAILABLE else _match_nearest_numpy
+        nearest = match(cur, prev, MATCH_DISTANCE * MATCH_DISTANCE)
+    
+    diff = cur - prev[nearest]
+    dist2 = (diff * diff).sum(axis=1)
+    
+    # Разрешаем конфликты: детекции по возрастанию расстояния забирают свои центры
+    nearest = nearest.tolist()
+    claimed = set()
+    for i in np.argsort(dist2, kind='stable').tolist():
+        j = nearest[i]
+        if j == -1:
+            continue
+        if j in claimed:
+            nearest[i] = -1
+        else:
+            claimed.add(j)
+    return nearest
+
 
 class VideoProcessor:
     def __init__(self):
@@ -18,21 +110,56 @@ class VideoProcessor:
             'static/models/yolo.weights'
         ) if self._check_models_exist() else None
         
+        if self.net is not None:
+            self._configure_dnn_backend()
+        
         # Если YOLO недоступна, используем HOG детектор
         self.hog = cv2.HOGDescriptor()
         self.hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
         
+        # С OpenCL кадр для HOG передается как UMat, и OpenCV (T-API) считает пирамиду на GPU;
+        # без OpenCL UMat только добавил бы копирование
+        self._hog_use_umat = cv2.ocl.haveOpenCL()
+        if self._hog_use_umat:
+            cv2.ocl.setUseOpenCL(True)
+        
         # Трекеры для отслеживания людей
         self.trackers = []
         self.person_trajectories = {}
         self.person_id_counter = 0
         
+        # Компилируем сопоставление заранее, чтобы не платить за это на первом кадре
+        if NUMBA_AVAILABLE:
+            _match_nearest(np.zeros((1, 2), dtype=np.int64), np.zeros((1, 2), dtype=np.int64), 1)
+        
     def _check_models_exist(self) -> bool:
         """Проверяем наличие файлов модели YOLO"""
         import os
         return (os.path.exists('static/models/yolo.cfg') and 
                 os.path.exists('static/models/yolo.weights'))
     
+    def _configure_dnn_backend(self):
+        """Переносит сеть на GPU (CUDA, FP16), если OpenCV собран с CUDA и видит устройство"""
+        try:
+            if cv2.cuda.getCudaEnabledDeviceCount() > 0:
+                self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
+                self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA_FP16)
+                print("🚀 YOLO работает на GPU (CUDA FP16)")
+                return
+        except (cv2.error, AttributeError):
+            pass
+        print("💻 YOLO работает на CPU")
+    
+    def detect_people_batch(self, frames: List[np.ndarray]) -> List[List[Tuple[int, int, int, int]]]:
+        """
+        Детекция людей сразу в пачке кадров
+        Для каждого кадра возвращает список bbox в формате (x, y, w, h)
+        """
+        if self.net is not None:
+            return self._detect_with_yolo_batch(frames)
+        else:
+            return [self._detect_with_hog(frame) for frame in frames]
+    
     def detect_people(self, frame: np.ndarray) -> List[Tuple[int, int, int, int]]:
         """
         Детекция людей на кадре
@@ -45,8 +172,8 @@ class VideoProcessor:
     
     def _detect_with_hog(self, frame: np.ndarray) -> List[Tuple[int, int, int, int]]:
         """Детекция с помощью HOG дескриптора"""
-        # Изменяем размер для ускорения
-        small_frame = cv2.resize(frame, (640, 480))
+        # Изменяем размер для ускорения (на GPU, если кадр загружен в UMat)
+        small_frame = cv2.resize(cv2.UMat(frame) if self._hog_use_umat else frame, (640, 480))
         
         # Детекция людей
         boxes, weights = self.hog.detectMultiScale(
@@ -73,9 +200,38 @@ class VideoProcessor:
     
     def _detect_with_yolo(self, frame: np.ndarray) -> List[Tuple[int, int, int, int]]:
         """Детекция с помощью YOLO (если доступна)"""
-        # Реализация YOLO детекции
-        # Пока возвращаем пустой список, будет доработано
-        return []
+        return self._detect_with_yolo_batch([frame])[0]
+    
+    def _detect_with_yolo_batch(self, frames: List[np.ndarray]) -> List[List[Tuple[int, int, int, int]]]:
+        """Детекция YOLO в пачке кадров одним прямым проходом сети"""
+        blob = cv2.dnn.blobFromImages(frames, 1 / 255.0, YOLO_INPUT_SIZE, swapRB=True, crop=False)
+        self.net.setInput(blob)
+        outs = self.net.forward(self.net.getUnconnectedOutLayersNames())
+        
+        # Выход слоя - (кадры, строки, 5 + классы) или строки всех кадров подряд
+        outs = [out.reshape(len(frames), -1, out.shape[-1]) for out in outs]
+        
+        return [
+            self._yolo_people_boxes([out[i] for out in outs], frame.shape[1], frame.shape[0])
+            for i, frame in enumerate(frames)
+        ]
+    
+    def _yolo_people_boxes(self, outs: List[np.ndarray], width: int, height: int) -> List[Tuple[int, int, int, int]]:
+        """Отбирает из выходов YOLO для одного кадра людей (класс 0) и применяет NMS"""
+        rows = np.concatenate(outs)
+        # Строка: cx, cy, w, h (доли кадра), objectness, вероятности классов
+        people = rows[rows[:, 5] > YOLO_CONFIDENCE]
+        if not len(people):
+            return []
+        
+        scale = np.array([width, height, width, height], dtype=np.float32)
+        cxcywh = people[:, :4] * scale
+        xywh = np.column_stack((cxcywh[:, 0] - cxcywh[:, 2] / 2, cxcywh[:, 1] - cxcywh[:, 3] / 2,
+                                cxcywh[:, 2], cxcywh[:, 3])).astype(np.int32)
+        confidences = people[:, 5].astype(np.float32)
+        
+        keep = cv2.dnn.NMSBoxes(xywh.tolist(), confidences.tolist(), YOLO_CONFIDENCE, YOLO_NMS_THRESHOLD)
+        return [tuple(xywh[i].tolist()) for i in np.asarray(keep).reshape(-1)]
     
     def track_people(self, frame: np.ndarray, detections: List[Tuple[int, int, int, int]]) -> Dict:
         """
@@ -94,22 +250,15 @@ class VideoProcessor:
         matched_trajectories = {}
         
         if hasattr(self, 'previous_centroids'):
-            for i, current_centroid in enumerate(current_centroids):
-                min_distance = float('inf')
-                matched_id = None
-                
-                for person_id, prev_centroid in self.previous_centroids.items():
-                    distance = np.sqrt(
-                        (current_centroid[0] - prev_centroid[0])**2 + 
-                        (current_centroid[1] - prev_centroid[1])**2
-                    )
-                    
-                    if distance < min_distance and distance < 100:  # Порог сопоставления
-                        min_distance = distance
-                        matched_id = person_id
-                
-                if matched_id is not None:
-                    matched_trajectories[matched_id] = current_centroid
+            # Ближайший прошлый центр в пределах порога
+            prev_ids = list(self.previous_centroids.keys())
+            cur = np.array(current_centroids, dtype=np.int64).reshape(-1, 2)
+            prev = np.array(list(self.previous_centroids.values()), dtype=np.int64).reshape(-1, 2)
+            nearest = _match_centroids(cur, prev)
+            
+            for current_centroid, j in zip(current_centroids, nearest):
+                if j != -1:
+                    matched_trajectories[prev_ids[j]] = current_centroid
                 else:
                     # Новый человек
                     self.person_id_counter += 1
@@ -120,9 +269,65 @@ class VideoProcessor:
                 self.person_id_counter += 1
                 matched_trajectories[self.person_id_counter] = centroid
         
-        self.previous_centroids = matched_trajectories.copy()
+        # Словарь создается заново на каждом кадре и после возврата не изменяется - копия не нужна
+        self.previous_centroids = matched_trajectories
         return matched_trajectories
     
+    def _submit_frame_batch(self, detector: ThreadPoolExecutor, frame_batch: List[Tuple[int, np.ndarray]],
+                            pending: Optional[Tuple], tracking_data: Dict, fps: float, total_frames: int) -> Tuple:
+        """
+        Отдает пачку кадров детектору и, пока она обрабатывается, ведет трекинг по предыдущей пачке
+        
+        Returns:
+            (пачка, future детекций) - новая пачка в обработке
+        """
+        future = detector.submit(self.detect_people_batch, [frame for _, frame in frame_batch])
+        if pending is not None:
+            self._track_frame_batch(pending[0], pending[1].result(), tracking_data, fps, total_frames)
+        return frame_batch, future
+    
+    def _track_frame_batch(self, frame_batch: List[Tuple[int, np.ndarray]],
+                           batch_detections: List[List[Tuple[int, int, int, int]]],
+                           tracking_data: Dict, fps: float, total_frames: int):
+        """По порядку кадров пачки обновляет трекинг найденными детекциями"""
+        for (frame_count, frame), detections in zip(frame_batch, batch_detections):
+            # Трекинг
+            current_positions = self.track_people(frame, detections)
+            
+            # Сохраняем данные кадра
+            frame_data = {
+                'frame_number': frame_count,
+                'timestamp': frame_count / fps if fps > 0 else 0,
+                'people_count': len(current_positions),
+                'positions': current_positions
+            }
+            tracking_data['frame_data'].append(frame_data)
+            
+            # Обновляем траектории (массивы; timestamp вычисляется из кадра при выгрузке)
+            trajectories = tracking_data['trajectories']
+            for person_id, position in current_positions.items():
+                if person_id not in trajectories:
+                    trajectories[person_id] = TrajectoryBuffer()
+                
+                trajectories[person_id].append(frame_count, position[0], position[1])
+            
+            # Прогресс
+            if frame_count % 30 == 0:
+                progress = (frame_count / total_frames) * 100
+                print(f"Прогресс обработки: {progress:.1f}%")
+    
+    def _save_tracking_data(self, tracking_data: Dict, output_path: str):
+        """Сохраняет данные трекинга в JSON (orjson, если установлен - кодирует на C в разы быстрее)"""
+        if orjson is not None:
+            # Ключи словарей - числовые id людей, поэтому нужен OPT_NON_STR_KEYS
+            with open(output_path, 'wb') as f:
+                f.write(orjson.dumps(tracking_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+                                     | orjson.OPT_SERIALIZE_NUMPY))
+            return
+        
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(tracking_data, f, ensure_ascii=False, indent=2)
+    
     def process_video(self, video_path: str) -> Dict:
         """
         Основная функция обработки видео
@@ -149,51 +354,50 @@ class VideoProcessor:
             }
         }
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            frame_count += 1
-            
-            # Обрабатываем каждый N-й кадр для ускорения
-            if frame_count % 3 != 0:
-                continue
-            
-            # Детекция людей
-            detections = self.detect_people(frame)
-            
-            # Трекинг
-            current_positions = self.track_people(frame, detections)
-            
-            # Сохраняем данные кадра
-            frame_data = {
-                'frame_number': frame_count,
-                'timestamp': frame_count / fps if fps > 0 else 0,
-                'people_count': len(current_positions),
-                'positions': current_positions
-            }
-            tracking_data['frame_data'].append(frame_data)
-            
-            # Обновляем траектории
-            for person_id, position in current_positions.items():
-                if person_id not in tracking_data['trajectories']:
-                    tracking_data['trajectories'][person_id] = []
+        # Обрабатываемые кадры копятся и отдаются детектору пачкой: (номер кадра, кадр)
+        frame_batch = []
+        # Пачка, отданная детектору, и future ее детекций
+        pending = None
+        
+        # Детекция пачки идет в фоновом потоке (OpenCV отпускает GIL), пока основной поток
+        # декодирует следующую пачку и ведет трекинг - он зависит от порядка кадров и остается последовательным
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="detect") as detector:
+            while True:
+                # grab только захватывает кадр; в BGR декодируем (retrieve) лишь обрабатываемые
+                if not cap.grab():
+                    break
                 
-                tracking_data['trajectories'][person_id].append({
-                    'frame': frame_count,
-                    'timestamp': frame_count / fps if fps > 0 else 0,
-                    'x': position[0],
-                    'y': position[1]
-                })
+                frame_count += 1
+                
+                # Обрабатываем каждый N-й кадр для ускорения
+                if frame_count % 3 != 0:
+                    continue
+                
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                
+                frame_batch.append((frame_count, frame))
+                if len(frame_batch) >= DETECTION_BATCH_SIZE:
+                    pending = self._submit_frame_batch(detector, frame_batch, pending,
+                                                       tracking_data, fps, total_frames)
+                    frame_batch = []
             
-            # Прогресс
-            if frame_count % 30 == 0:
-                progress = (frame_count / total_frames) * 100
-                print(f"Прогресс обработки: {progress:.1f}%")
+            # Досчитываем последнюю неполную пачку
+            if frame_batch:
+                pending = self._submit_frame_batch(detector, frame_batch, pending,
+                                                   tracking_data, fps, total_frames)
+            if pending is not None:
+                self._track_frame_batch(pending[0], pending[1].result(), tracking_data, fps, total_frames)
         
         cap.release()
         
+        # Траектории копились в массивах; в список точек переводим только для JSON и результата
+        tracking_data['trajectories'] = {
+            person_id: buffer.to_trajectory().to_points(fps)
+            for person_id, buffer in tracking_data['trajectories'].items()
+        }
+        
         print(f"Обработка завершена. Найдено {len(tracking_data['trajectories'])} уникальных людей")
         
         # Сохраняем результаты
@@ -203,7 +407,6 @@ class VideoProcessor:
         else:
             output_path = output_path.rsplit('.', 1)[0] + '_tracking_data.json'
         
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(tracking_data, f, ensure_ascii=False, indent=2)
+        self._save_tracking_data(tracking_data, output_path)
         
         return tracking_data
@@ -5,12 +5,22 @@
 
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 from typing import List, Dict, Tuple
-import os
-from datetime import datetime
+import queue
+import threading
 
 class VideoVisualizer:
+    # Число ступеней яркости при затухании исторического пути
+    PATH_FADE_STEPS = 4
+    # Во сколько раз уменьшается карта плотности перед размытием
+    HEAT_BLUR_SCALE = 4
+    # Кодеки демо-видео в порядке предпочтения: H.264 кодируется быстрее и открывается в браузере
+    VIDEO_CODECS = ('avc1', 'mp4v')
+    # Кодек, который удалось открыть (общий для всех экземпляров)
+    _video_codec = None
+    # Число буферов кадров, которые одновременно рисуются и ждут записи
+    FRAME_POOL_SIZE = 8
+    
     def __init__(self):
         """Инициализация визуализатора"""
         self.colors = [
@@ -24,6 +34,28 @@ class VideoVisualizer:
             (128, 0, 255),  # Фиолетовый
         ]
         
+        # Карта плотности тепловых зон накапливается между кадрами:
+        # на каждом кадре дорисовываются только новые точки траекторий
+        self._density_accum = None
+        self._density_idx = {}
+        self._density_source = None
+        self._density_frame = -1
+        self._heat_roi = None
+        self._heat_mask = None
+        self._heat_layer = None
+        self._heat_blend = None
+        # Тепловая карта низкочастотная, поэтому размывается в уменьшенном масштабе:
+        # гауссиане 31x31 (sigma 5) полного кадра соответствует ядро 9 с sigma 5 / HEAT_BLUR_SCALE
+        self._heat_blur_kernel = cv2.getGaussianKernel(9, 5.0 / self.HEAT_BLUR_SCALE, cv2.CV_32F)
+        
+        # Статичное содержимое кадра рисуется один раз и затем только копируется
+        self._background = None
+        self._info_panel = None
+        
+        # Цвета людей и затухающие стили их путей
+        self._person_colors = {}
+        self._faded_styles = {}
+        
     def create_demo_video_with_paths(self, output_path: str = "static/images/demo_video_analysis.mp4") -> str:
         """Создает демо-видео с наложенными тропами и зонами задержек"""
         
@@ -34,105 +66,170 @@ class VideoVisualizer:
         total_frames = fps * duration_seconds
         
         # Создаем видео writer
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+        out = self._open_video_writer(output_path, fps, (width, height))
         
         # Генерируем демо-траектории
         trajectories = self._generate_demo_trajectories(total_frames, width, height)
-        
-        # Создаем каждый кадр
-        for frame_idx in range(total_frames):
-            frame = self._create_base_frame(width, height)
-            
-            # Добавляем элементы интерьера
-            frame = self._add_interior_elements(frame, width, height)
-            
-            # Добавляем траектории до текущего кадра
-            frame = self._draw_historical_paths(frame, trajectories, frame_idx)
-            
-            # Добавляем тепловую карту зон задержек
-            frame = self._overlay_heat_zones(frame, trajectories, frame_idx, width, height)
-            
-            # Добавляем текущие позиции людей
-            frame = self._draw_current_people(frame, trajectories, frame_idx)
-            
-            # Добавляем информационную панель
-            frame = self._add_info_panel(frame, frame_idx, total_frames)
-            
-            # Записываем кадр
-            out.write(frame)
-        
-        out.release()
+        self._assign_person_colors(trajectories)
+        self._reset_heat_zones(width, height, trajectories)
+        active_counts = self._count_active_people(trajectories, total_frames)
+        
+        # Кадры кодируются в отдельном потоке, пока рисуются следующие.
+        # Буферы кадров берутся из пула и возвращаются в него после записи - пул же ограничивает очередь
+        free_frames = queue.Queue()
+        for _ in range(self.FRAME_POOL_SIZE):
+            free_frames.put(np.empty((height, width, 3), dtype=np.uint8))
+        ready_frames = queue.Queue()
+        write_errors = []
+        writer = threading.Thread(target=self._write_frames, args=(out, ready_frames, free_frames, write_errors),
+                                  name="demo-video-write", daemon=True)
+        writer.start()
+        
+        try:
+            # Создаем каждый кадр
+            for frame_idx in range(total_frames):
+                # Фон с элементами интерьера
+                frame = self._get_background(width, height, out=free_frames.get())
+                
+                # Добавляем траектории до текущего кадра
+                frame = self._draw_historical_paths(frame, trajectories, frame_idx)
+                
+                # Добавляем тепловую карту зон задержек
+                frame = self._overlay_heat_zones(frame, trajectories, frame_idx, width, height)
+                
+                # Добавляем текущие позиции людей
+                frame = self._draw_current_people(frame, trajectories, frame_idx)
+                
+                # Добавляем информационную панель
+                frame = self._add_info_panel(frame, frame_idx, total_frames, int(active_counts[frame_idx]))
+                
+                # Отдаем кадр на запись
+                ready_frames.put(frame)
+        finally:
+            ready_frames.put(None)
+            writer.join()
+            out.release()
+        
+        if write_errors:
+            raise write_errors[0]
         print(f"✅ Демо-видео создано: {output_path}")
         return output_path
     
+    def _open_video_writer(self, output_path: str, fps: int, size: Tuple[int, int]) -> cv2.VideoWriter:
+        """
+        Открывает VideoWriter: H.264 (avc1) с аппаратным ускорением, если сборка OpenCV/FFmpeg его умеет,
+        иначе прежний mp4v. Удачный кодек запоминается, чтобы не перебирать их на каждом видео
+        """
+        # Аппаратное кодирование, если доступно (параметр поддерживается с OpenCV 4.5.2)
+        params = [cv2.VIDEOWRITER_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY] \
+            if hasattr(cv2, 'VIDEOWRITER_PROP_HW_ACCELERATION') else []
+        
+        codecs = [VideoVisualizer._video_codec] if VideoVisualizer._video_codec else self.VIDEO_CODECS
+        for codec in codecs:
+            fourcc = cv2.VideoWriter_fourcc(*codec)
+            out = cv2.VideoWriter(output_path, fourcc, fps, size, params) if params \
+                else cv2.VideoWriter(output_path, fourcc, fps, size)
+            if out.isOpened():
+                VideoVisualizer._video_codec = codec
+                return out
+            out.release()
+        
+        # Ни один кодек не открылся - поведение как раньше (mp4v без параметров)
+        print(f"⚠️ Не удалось открыть VideoWriter с кодеками {', '.join(codecs)}")
+        return cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    
     def _generate_demo_trajectories(self, total_frames: int, width: int, height: int) -> Dict:
-        """Генерирует реалистичные траектории для демо"""
+        """Генерирует реалистичные траектории для демо (массивы int32 формы (N, 2) - точки x, y)"""
         trajectories = {}
         
         # Человек 1: Вход -> Касса (быстро)
-        person1 = []
         start_x, start_y = 50, 100
         end_x, end_y = 550, 350
-        for i in range(total_frames):
-            if i < total_frames * 0.6:  # Появляется в первой половине
-                progress = (i / (total_frames * 0.6)) ** 0.8
-                x = int(start_x + (end_x - start_x) * progress)
-                y = int(start_y + (end_y - start_y) * progress)
-                # Добавляем небольшие отклонения
-                x += int(np.sin(i * 0.3) * 15)
-                y += int(np.cos(i * 0.2) * 10)
-                person1.append((max(20, min(width-20, x)), max(20, min(height-20, y))))
-        trajectories['person1'] = person1
+        i = np.arange(total_frames)
+        i = i[i < total_frames * 0.6]  # Появляется в первой половине
+        progress = (i / (total_frames * 0.6)) ** 0.8
+        x = (start_x + (end_x - start_x) * progress).astype(np.int64)
+        y = (start_y + (end_y - start_y) * progress).astype(np.int64)
+        # Добавляем небольшие отклонения
+        x += (np.sin(i * 0.3) * 15).astype(np.int64)
+        y += (np.cos(i * 0.2) * 10).astype(np.int64)
+        trajectories['person1'] = self._stack_points(x, y, width, height)
         
         # Человек 2: Вход -> Витрина -> Долгая задержка -> Касса
-        person2 = []
-        points = [(60, 120), (200, 200), (250, 220), (500, 340)]
+        points = np.array([(60, 120), (200, 200), (250, 220), (500, 340)])
         delays = [0, 30, 80, 20]  # Задержки на каждой точке (в кадрах)
+        move_frames = 15
+        appear_frame = 20  # Появляется позже
         
-        current_frame = 20  # Появляется позже
-        for i, ((x, y), delay) in enumerate(zip(points, delays)):
+        move_progress = (np.arange(move_frames) / move_frames)[:, None]
+        segments = []
+        waiting = []
+        for i, delay in enumerate(delays):
             # Движение к точке
             if i > 0:
-                prev_x, prev_y = points[i-1]
-                move_frames = 15
-                for f in range(move_frames):
-                    if current_frame < total_frames:
-                        progress = f / move_frames
-                        curr_x = int(prev_x + (x - prev_x) * progress)
-                        curr_y = int(prev_y + (y - prev_y) * progress)
-                        person2.append((curr_x, curr_y))
-                        current_frame += 1
-            
+                prev = points[i-1]
+                segments.append((prev + (points[i] - prev) * move_progress).astype(np.int64))
+                waiting.append(np.zeros(move_frames, dtype=bool))
             # Задержка в точке
-            for f in range(delay):
-                if current_frame < total_frames:
-                    # Небольшие колебания во время ожидания
-                    noise_x = int(np.random.normal(0, 3))
-                    noise_y = int(np.random.normal(0, 3))
-                    person2.append((max(20, min(width-20, x + noise_x)), 
-                                  max(20, min(height-20, y + noise_y))))
-                    current_frame += 1
+            segments.append(np.repeat(points[i:i+1], delay, axis=0))
+            waiting.append(np.ones(delay, dtype=bool))
+        
+        # Видео заканчивается раньше, чем маршрут - обрезаем до конца видео
+        limit = max(0, total_frames - appear_frame)
+        person2 = np.concatenate(segments)[:limit]
+        waiting = np.concatenate(waiting)[:limit]
         
-        trajectories['person2'] = person2
+        # Небольшие колебания во время ожидания (по паре значений x, y на кадр - как и раньше)
+        noise = np.random.normal(0, 3, size=(int(waiting.sum()), 2)).astype(np.int64)
+        person2[waiting] = np.clip(person2[waiting] + noise, 20, [width-20, height-20])
+        trajectories['person2'] = person2.astype(np.int32)
         
         # Человек 3: Заходит, делает круг, уходит
-        person3 = []
         center_x, center_y = 300, 250
         radius = 80
         start_frame = 40
         
-        for i in range(total_frames):
-            if i >= start_frame and i < start_frame + 60:
-                angle = (i - start_frame) * 0.15
-                x = int(center_x + radius * np.cos(angle))
-                y = int(center_y + radius * np.sin(angle))
-                person3.append((max(20, min(width-20, x)), max(20, min(height-20, y))))
-        
-        trajectories['person3'] = person3
+        angle = np.arange(max(0, min(60, total_frames - start_frame))) * 0.15
+        x = (center_x + radius * np.cos(angle)).astype(np.int64)
+        y = (center_y + radius * np.sin(angle)).astype(np.int64)
+        trajectories['person3'] = self._stack_points(x, y, width, height)
         
         return trajectories
     
+    @staticmethod
+    def _stack_points(x: np.ndarray, y: np.ndarray, width: int, height: int) -> np.ndarray:
+        """Собирает координаты в массив точек (N, 2), прижимая их к кадру с отступом 20 пикселей"""
+        return np.stack([np.clip(x, 20, width-20), np.clip(y, 20, height-20)], axis=1).astype(np.int32)
+    
+    @staticmethod
+    def _write_frames(out: cv2.VideoWriter, ready_frames: queue.Queue, free_frames: queue.Queue, errors: List):
+        """Записывает кадры из очереди до None и возвращает их буферы в пул"""
+        while True:
+            frame = ready_frames.get()
+            if frame is None:
+                return
+            try:
+                if not errors:
+                    out.write(frame)
+            except Exception as e:
+                # Ошибку отдаем в основной поток, но пул освобождаем, чтобы рисование не зависло
+                errors.append(e)
+            free_frames.put(frame)
+    
+    def _get_background(self, width: int, height: int, out: np.ndarray = None) -> np.ndarray:
+        """
+        Возвращает копию фона помещения с интерьером (фон рисуется один раз на размер кадра)
+        
+        Если передан out, фон копируется в этот буфер
+        """
+        if self._background is None or self._background.shape[:2] != (height, width):
+            background = self._create_base_frame(width, height)
+            self._background = self._add_interior_elements(background, width, height)
+        if out is None:
+            return self._background.copy()
+        np.copyto(out, self._background)
+        return out
+    
     def _create_base_frame(self, width: int, height: int) -> np.ndarray:
         """Создает базовый кадр (фон помещения)"""
         # Создаем кадр с цветом пола
@@ -170,58 +267,120 @@ class VideoVisualizer:
     def _draw_historical_paths(self, frame: np.ndarray, trajectories: Dict, current_frame: int) -> np.ndarray:
         """Рисует исторические тропы движения"""
         for person_id, trajectory in trajectories.items():
-            if len(trajectory) > 1:
-                color_idx = hash(person_id) % len(self.colors)
-                color = self.colors[color_idx]
-                
-                # Рисуем путь до текущего момента
-                points_to_draw = []
-                for i, point in enumerate(trajectory):
-                    if i <= current_frame:
-                        points_to_draw.append(point)
-                
-                if len(points_to_draw) > 1:
-                    # Рисуем линию пути с затуханием
-                    for i in range(1, len(points_to_draw)):
-                        alpha = (i / len(points_to_draw)) * 0.8 + 0.2
-                        thickness = int(3 * alpha)
-                        
-                        # Затухающий цвет
-                        faded_color = tuple(int(c * alpha) for c in color)
-                        
-                        cv2.line(frame, points_to_draw[i-1], points_to_draw[i], 
-                                faded_color, thickness)
+            # Путь до текущего момента - срез массива точек
+            points = trajectory[:current_frame + 1]
+            if len(points) > 1:
+                # Рисуем линию пути с затуханием: вместо отдельной линии на каждый отрезок
+                # путь делится на участки, каждый участок - одна ломаная своей яркости
+                bounds = np.linspace(0, len(points) - 1, self.PATH_FADE_STEPS + 1).astype(int)
+                for step, (faded_color, thickness) in enumerate(self._path_styles(person_id)):
+                    start, end = bounds[step], bounds[step + 1]
+                    if end <= start:
+                        continue
+                    cv2.polylines(frame, [points[start:end + 1].reshape(-1, 1, 2)], False,
+                                  faded_color, thickness)
         
         return frame
     
+    def _assign_person_colors(self, trajectories: Dict):
+        """Назначает цвета людям по порядку и сбрасывает кэш стилей путей"""
+        self._person_colors = {person_id: self.colors[i % len(self.colors)]
+                               for i, person_id in enumerate(trajectories)}
+        self._faded_styles = {}
+    
+    def _person_color(self, person_id: str) -> Tuple[int, int, int]:
+        """
+        Цвет человека: назначается по порядку появления и запоминается
+        
+        hash() строк случаен в каждом процессе, поэтому палитра от него менялась между запусками
+        """
+        color = self._person_colors.get(person_id)
+        if color is None:
+            color = self.colors[len(self._person_colors) % len(self.colors)]
+            self._person_colors[person_id] = color
+        return color
+    
+    def _path_styles(self, person_id: str) -> List[Tuple[Tuple[int, int, int], int]]:
+        """Затухающие цвета и толщины участков пути человека (от старых к новым), считаются один раз"""
+        styles = self._faded_styles.get(person_id)
+        if styles is None:
+            color = self._person_color(person_id)
+            styles = []
+            for step in range(self.PATH_FADE_STEPS):
+                alpha = ((step + 1) / self.PATH_FADE_STEPS) * 0.8 + 0.2
+                # Затухающий цвет
+                styles.append((tuple(int(c * alpha) for c in color), max(1, int(3 * alpha))))
+            self._faded_styles[person_id] = styles
+        return styles
+    
+    def _reset_heat_zones(self, width: int, height: int, trajectories: Dict = None):
+        """Сбрасывает накопленную карту плотности (начало нового видео)"""
+        self._density_accum = np.zeros((height, width), dtype=np.float32)
+        self._density_idx = {}
+        self._density_source = trajectories
+        self._density_frame = -1
+        self._heat_roi = None
+        self._heat_mask = None
+        self._heat_layer = None
+        self._heat_blend = None
+    
     def _overlay_heat_zones(self, frame: np.ndarray, trajectories: Dict, current_frame: int, 
                            width: int, height: int) -> np.ndarray:
         """Накладывает тепловые зоны задержек"""
-        # Создаем карту плотности
-        density_map = np.zeros((height, width), dtype=np.float32)
-        
-        for trajectory in trajectories.values():
-            for i, (x, y) in enumerate(trajectory):
-                if i <= current_frame:
-                    # Увеличиваем плотность в радиусе вокруг точки
-                    cv2.circle(density_map, (x, y), 25, 1.0, -1)
-        
-        # Размытие для плавности
-        density_map = cv2.GaussianBlur(density_map, (31, 31), 0)
-        
-        # Нормализация
-        if density_map.max() > 0:
-            density_map = density_map / density_map.max()
-        
-        # Создаем цветовую карту (красный для горячих зон)
-        heat_overlay = np.zeros_like(frame)
-        heat_mask = density_map > 0.3  # Порог для отображения
-        
-        heat_overlay[heat_mask] = [0, 0, int(255 * density_map[heat_mask].max())]
+        # Карта строится заново только для других траекторий, размера или при перемотке назад
+        if (self._density_accum is None or self._density_accum.shape != (height, width)
+                or current_frame < self._density_frame
+                or (self._density_source is not None and self._density_source is not trajectories)):
+            self._reset_heat_zones(width, height, trajectories)
+        self._density_source = trajectories
+        self._density_frame = current_frame
+        
+        # Дорисовываем точки, появившиеся с прошлого кадра: круги только заливают карту,
+        # поэтому результат совпадает с перерисовкой всей истории
+        changed = False
+        for person_id, trajectory in trajectories.items():
+            start = self._density_idx.get(person_id, 0)
+            new_points = trajectory[start:current_frame + 1]
+            for x, y in new_points:
+                # Увеличиваем плотность в радиусе вокруг точки
+                cv2.circle(self._density_accum, (x, y), 25, 1.0, -1)
+            if len(new_points):
+                changed = True
+                self._density_idx[person_id] = start + len(new_points)
         
-        # Накладываем с прозрачностью
         alpha = 0.3
-        frame = cv2.addWeighted(frame, 1-alpha, heat_overlay, alpha, 0)
+        
+        # Размытие и раскраска - только когда карта изменилась
+        if changed or self._heat_roi is None:
+            # Размытие для плавности: уменьшаем, размываем двумя одномерными проходами, увеличиваем обратно
+            small = cv2.resize(self._density_accum, (width // self.HEAT_BLUR_SCALE, height // self.HEAT_BLUR_SCALE),
+                               interpolation=cv2.INTER_AREA)
+            small = cv2.sepFilter2D(small, -1, self._heat_blur_kernel, self._heat_blur_kernel)
+            density_map = cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+            
+            # Нормализация
+            peak = density_map.max()
+            if peak > 0:
+                density_map /= peak
+            
+            # Запоминаем только прямоугольник вокруг горячих зон: маску и красный слой,
+            # яркость которого растет с плотностью
+            heat_mask = (density_map > 0.3).astype(np.uint8)  # Порог для отображения
+            x, y, w, h = cv2.boundingRect(heat_mask)
+            self._heat_roi = (slice(y, y + h), slice(x, x + w))
+            self._heat_mask = heat_mask[self._heat_roi]
+            heat_layer = np.zeros((h, w, 3), dtype=np.uint8)
+            heat_layer[..., 2] = density_map[self._heat_roi] * 255
+            self._heat_layer = heat_layer
+            # Буфер смешивания того же размера - переиспользуется, пока зоны не изменятся
+            self._heat_blend = np.empty_like(heat_layer)
+        
+        # Накладываем с прозрачностью только на горячие зоны - остальной кадр не трогаем
+        if self._heat_mask.size:
+            roi = frame[self._heat_roi]
+            cv2.addWeighted(roi, 1-alpha, self._heat_layer, alpha, 0, dst=self._heat_blend)
+            # roi - представление кадра, поэтому copyTo пишет прямо в кадр
+            cv2.copyTo(self._heat_blend, self._heat_mask, roi)
         
         return frame
     
@@ -230,8 +389,7 @@ class VideoVisualizer:
         for person_id, trajectory in trajectories.items():
             if current_frame < len(trajectory):
                 x, y = trajectory[current_frame]
-                color_idx = hash(person_id) % len(self.colors)
-                color = self.colors[color_idx]
+                color = self._person_color(person_id)
                 
                 # Рисуем человека как круг
                 cv2.circle(frame, (x, y), 8, color, -1)
@@ -243,20 +401,33 @@ class VideoVisualizer:
         
         return frame
     
-    def _add_info_panel(self, frame: np.ndarray, current_frame: int, total_frames: int) -> np.ndarray:
+    @staticmethod
+    def _count_active_people(trajectories: Dict, total_frames: int) -> np.ndarray:
+        """Число людей на каждом кадре: траектория человека занимает кадры с 0 по len(trajectory) - 1"""
+        active_counts = np.zeros(total_frames, dtype=np.int32)
+        for trajectory in trajectories.values():
+            active_counts[:len(trajectory)] += 1
+        return active_counts
+    
+    def _add_info_panel(self, frame: np.ndarray, current_frame: int, total_frames: int,
+                        active_people: int) -> np.ndarray:
         """Добавляет информационную панель"""
         height, width = frame.shape[:2]
         
-        # Фон панели
-        cv2.rectangle(frame, (10, 10), (300, 80), (0, 0, 0), -1)
-        cv2.rectangle(frame, (10, 10), (300, 80), (255, 255, 255), 2)
+        # Фон панели - заранее нарисованный фрагмент
+        if self._info_panel is None:
+            self._info_panel = self._render_info_panel()
+        roi, panel, mask = self._info_panel
+        if height >= roi[0].stop and width >= roi[1].stop:
+            frame[roi] = cv2.copyTo(panel, mask, frame[roi])
+        else:
+            self._draw_info_panel_box(frame)
         
         # Время
         time_text = f"Время: {current_frame // 10:02d}:{(current_frame % 10) * 6:02d}"
         cv2.putText(frame, time_text, (20, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
         
         # Количество людей
-        active_people = sum(1 for traj in trajectories.values() if current_frame < len(traj))
         people_text = f"Посетителей: {active_people}"
         cv2.putText(frame, people_text, (20, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
         
@@ -266,6 +437,22 @@ class VideoVisualizer:
         
         return frame
     
+    @staticmethod
+    def _draw_info_panel_box(frame: np.ndarray):
+        """Рисует фон и рамку информационной панели"""
+        cv2.rectangle(frame, (10, 10), (300, 80), (0, 0, 0), -1)
+        cv2.rectangle(frame, (10, 10), (300, 80), (255, 255, 255), 2)
+    
+    def _render_info_panel(self) -> Tuple[Tuple[slice, slice], np.ndarray, np.ndarray]:
+        """Рисует фон панели один раз: возвращает область кадра, ее изображение и маску закрашенных пикселей"""
+        # Холст с метками: пиксели, которые рисование не тронуло, остаются равны 1
+        canvas = np.ones((100, 320, 3), dtype=np.uint8)
+        self._draw_info_panel_box(canvas)
+        mask = np.any(canvas != 1, axis=2).astype(np.uint8)
+        x, y, w, h = cv2.boundingRect(mask)
+        roi = (slice(y, y + h), slice(x, x + w))
+        return roi, canvas[roi].copy(), mask[roi].copy()
+    
     def create_static_visualization(self, output_path: str = "static/images/demo_paths_overlay.png") -> str:
         """Создает статичную визуализацию с наложенными тропами"""
         width, height = 640, 480
@@ -276,19 +463,18 @@ class VideoVisualizer:
         
         # Генерируем полные траектории
         trajectories = self._generate_demo_trajectories(200, width, height)
+        self._assign_person_colors(trajectories)
         
         # Рисуем все траектории
         for person_id, trajectory in trajectories.items():
             if len(trajectory) > 1:
-                color_idx = hash(person_id) % len(self.colors)
-                color = self.colors[color_idx]
+                color = self._person_color(person_id)
                 
-                # Рисуем полный путь
-                for i in range(1, len(trajectory)):
-                    cv2.line(frame, trajectory[i-1], trajectory[i], color, 3)
+                # Рисуем полный путь одной ломаной
+                cv2.polylines(frame, [trajectory.reshape(-1, 1, 2)], False, color, 3)
                 
                 # Отмечаем начало и конец
-                if trajectory:
+                if len(trajectory):
                     cv2.circle(frame, trajectory[0], 12, (0, 255, 0), -1)  # Зеленый - вход
                     cv2.circle(frame, trajectory[-1], 12, (0, 0, 255), -1)  # Красный - выход
         
@@ -308,6 +494,3 @@ class VideoVisualizer:
         cv2.imwrite(output_path, frame)
         print(f"✅ Статичная визуализация создана: {output_path}")
         return output_path
-
-# Глобальная переменная для создания демо-данных
-trajectories = {}
@@ -5,61 +5,379 @@
 from fastapi import FastAPI, Request, File, UploadFile, Form
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, Response
 import uvicorn
+import io
 import os
+import sys
+import atexit
+import time
 import json
+import orjson
+import hashlib
+import asyncio
+import aiofiles
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 from backend.trajectory_smoother import TrajectorySmoother
 from backend.trajectory_evaluator import TrajectoryEvaluator
 from backend.gif_generator import TrajectoryGifGenerator
+from backend.real_video_analyzer import RealVideoAnalyzer, load_yolo_detector
+
+# Журнал запросов: обработчики только кладут записи в очередь, вывод в консоль - в фоновом потоке.
+# Уровень задается переменной окружения AURA_LOG (DEBUG - подробности каждого запроса)
+logger = logging.getLogger("aura")
+logger.setLevel(os.environ.get("AURA_LOG", "INFO").upper())
+logger.propagate = False
+log_queue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(log_queue))
+log_listener = QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+log_listener.start()
+atexit.register(log_listener.stop)
+
+# Параметры orjson для ответов и файлов анализа: массивы и числа NumPy, нестроковые ключи словарей
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+class ORJSONResponse(JSONResponse):
+    """JSON-ответ через orjson: сериализация сразу в байты, без json.dumps и перекодирования строки"""
+    
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=str, option=ORJSON_OPTIONS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Запуск процесса сервера: модель YOLO загружается и прогревается первым заданием analysis_pool
+    
+    Хук выполняется только в процессах, которые обслуживают запросы: с AURA_WORKERS > 1
+    управляющий процесс uvicorn модель не загружает
+    """
+    global yolo_detector_future
+    yolo_detector_future = analysis_pool.submit(load_warm_detector)
+    yield
 
 # Создаем экземпляр FastAPI
-app = FastAPI(title="Aura - AI Analytics", version="1.0.0")
+app = FastAPI(title="Aura - AI Analytics", version="1.0.0", default_response_class=ORJSONResponse,
+              lifespan=lifespan)
+
+# Создаем необходимые папки при импорте модуля: uvicorn с несколькими процессами импортирует
+# "simple_server:app" и не выполняет блок __main__; exist_ok делает создание безопасным для гонок
+for required_dir in ("uploads", "static/heatmaps", "static/images", "static/trajectory_gifs"):
+    os.makedirs(required_dir, exist_ok=True)
 
 # Импортируем трекер прогресса
 from backend.progress_tracker import progress_tracker
 
+# Оценщик траекторий и генератор GIF создаются один раз на сервер: оценщик держит открытое
+# соединение с БД (доступ под блокировкой), генератор кэширует легенду GIF сравнения
+trajectory_evaluator = TrajectoryEvaluator()
+gif_generator = TrajectoryGifGenerator()
+
+# Ключевые статические файлы: проверяются при старте и показываются в /debug-static
+KEY_STATIC_FILES = [
+    "static/js/script.js",
+    "static/css/style.css",
+    "static/js/analytics.js",
+    "static/js/trajectory_rating.js"
+]
+
+# Сколько секунд /debug-static отдает собранный отчет, не обращаясь к диску
+STATIC_REPORT_TTL = 10
+
+def build_static_report() -> Dict:
+    """Собирает отчет о ключевых статических файлах: наличие, размер и доступность на чтение"""
+    static_info = {}
+    for file_path in KEY_STATIC_FILES:
+        try:
+            file_size = os.stat(file_path).st_size
+        except OSError:
+            static_info[file_path] = {
+                "exists": False,
+                "size": 0,
+                "readable": False
+            }
+        else:
+            static_info[file_path] = {
+                "exists": True,
+                "size": file_size,
+                "readable": os.access(file_path, os.R_OK)
+            }
+    
+    return {
+        "static_files": static_info,
+        "static_dir_exists": os.path.exists("static"),
+        "current_working_dir": os.getcwd()
+    }
+
+static_report = build_static_report()
+static_report_time = time.monotonic()
+
 # Проверяем и подключаем статические файлы
 if os.path.exists("static"):
     app.mount("/static", StaticFiles(directory="static"), name="static")
     print("✅ Статические файлы подключены")
     
     # Проверяем наличие ключевых файлов
-    static_files = [
-        "static/js/script.js",
-        "static/css/style.css",
-        "static/js/analytics.js",
-        "static/js/trajectory_rating.js"
-    ]
-    
-    for file_path in static_files:
-        if os.path.exists(file_path):
-            file_size = os.path.getsize(file_path)
-            print(f"📁 {file_path}: {file_size} байт")
+    for file_path, info in static_report["static_files"].items():
+        if info["exists"]:
+            print(f"📁 {file_path}: {info['size']} байт")
         else:
             print(f"❌ {file_path}: НЕ НАЙДЕН")
 else:
     print("❌ Папка static не найдена")
 
+# Статика с версией в URL не меняется: кэшируем на год без перепроверок
+STATIC_IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+# Версии скриптов и стилей для URL в шаблонах: считаются один раз при старте по пути и времени изменения
+static_versions: Dict[str, str] = {}
+for static_dir in ("static/js", "static/css"):
+    if os.path.isdir(static_dir):
+        for name in os.listdir(static_dir):
+            rel_path = f"{static_dir[len('static/'):]}/{name}"
+            mtime = os.path.getmtime(os.path.join(static_dir, name))
+            static_versions[rel_path] = hashlib.md5(f"{rel_path}:{mtime}".encode()).hexdigest()[:8]
+
+def static_url(path: str) -> str:
+    """URL статического файла с версией: меняется при изменении файла и сбрасывает кэш браузера"""
+    version = static_versions.get(path)
+    return f"/static/{path}?v={version}" if version else f"/static/{path}"
+
 # Добавляем отладочный middleware для проверки запросов
 @app.middleware("http")
 async def debug_requests(request: Request, call_next):
-    print(f"🔍 Запрос: {request.method} {request.url.path}")
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("🔍 Запрос: %s %s", request.method, request.url.path)
     response = await call_next(request)
-    print(f"📤 Ответ: {response.status_code}")
+    if debug:
+        logger.debug("📤 Ответ: %d", response.status_code)
     
-    # Отключаем кэш для статических файлов
+    # Версионированную статику (?v= из static_url или кэш-бастер ?t=) браузер хранит год без
+    # перепроверок: новая версия файла приходит по новому URL. Остальное перепроверяется по ETag (304)
     if request.url.path.startswith("/static/"):
-        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-        response.headers["Pragma"] = "no-cache"
-        response.headers["Expires"] = "0"
+        if "v" in request.query_params or "t" in request.query_params:
+            response.headers["Cache-Control"] = STATIC_IMMUTABLE_CACHE
+        else:
+            response.headers["Cache-Control"] = "no-cache"
     
     return response
 
+# Ответ на непредвиденную ошибку всегда один и тот же - сериализуем его один раз
+INTERNAL_ERROR_BODY = orjson.dumps({
+    "status": "error",
+    "message": "Внутренняя ошибка сервера"
+})
+
+@app.exception_handler(Exception)
+async def unexpected_error(request: Request, exc: Exception):
+    """
+    Непредвиденная ошибка в обработчике: клиенту - заготовленный ответ 500 без текста исключения
+    
+    Трассировку пишет uvicorn: Starlette после этого ответа передает исключение серверу
+    """
+    return Response(INTERNAL_ERROR_BODY, status_code=500, media_type="application/json")
+
+async def read_json_body(request: Request) -> Optional[Dict]:
+    """Тело запроса как JSON-объект; None - если тело не разбирается или это не объект"""
+    try:
+        data = await request.json()
+    except ValueError:
+        # JSONDecodeError и UnicodeDecodeError (тело не в UTF-8) - оба ValueError
+        return None
+    return data if isinstance(data, dict) else None
+
+def invalid_json_response() -> ORJSONResponse:
+    """Ответ на запрос с неразбираемым телом"""
+    return ORJSONResponse({
+        "status": "error",
+        "message": "Некорректный JSON в запросе"
+    }, status_code=400)
+
+def is_int(value) -> bool:
+    """Целое число из JSON (bool - тоже int в Python, но не принимается)"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def invalid_field_response(field: str) -> ORJSONResponse:
+    """Ответ на запрос, в котором поле имеет неверный тип"""
+    return ORJSONResponse({
+        "status": "error",
+        "message": f"Поле {field} должно быть целым числом"
+    }, status_code=400)
+
+# Анализ видео - долгая работа на CPU. Выполняем ее в отдельном потоке, чтобы event loop продолжал
+# отвечать на опрос прогресса и отдавать статику. Поток один: прогресс анализа в сервере общий
+analysis_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="video-analysis")
+
+def load_warm_detector():
+    """Загружает детектор YOLO и прогоняет его на пустом кадре; None - если не удалось"""
+    try:
+        detector = load_yolo_detector()
+        if detector is not None:
+            detector.warmup()
+        return detector
+    except Exception as e:
+        # Ошибку не оставляем в yolo_detector_future: иначе каждый анализ падал бы с ней до перезапуска
+        logger.error("❌ Ошибка загрузки YOLO детектора: %s", e)
+        return None
+
+# Модель загружается при старте процесса (см. lifespan): сервер начинает отвечать сразу,
+# а первый анализ (следующее задание того же потока) получает готовый детектор
+yolo_detector_future = None
+
+def analyze_video_file(video_path: str) -> Dict:
+    """Анализирует видео реальным анализатором (вызывается в потоке analysis_pool)"""
+    # Анализатор на каждое видео свой (трекер хранит траектории), детектор - общий.
+    # Если модель не загрузилась, анализатор пробует загрузить ее сам, как и без сервера
+    detector = yolo_detector_future.result() if yolo_detector_future is not None else None
+    analyzer = RealVideoAnalyzer(yolo_detector=detector)
+    return analyzer.analyze_video(video_path)
+
+async def run_video_analysis(video_path: str) -> Dict:
+    """Запускает анализ видео в analysis_pool и ждет результат, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(analysis_pool, analyze_video_file, video_path)
+
+# GIF траекторий создаются по одному в отдельном потоке. Ползунок плавности шлет запрос за запросом,
+# поэтому еще не начатые задания одной траектории сливаются в одно с последними параметрами:
+# GIF пишется в тот же файл, и все ожидающие запросы получают один результат
+gif_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gif-generation")
+gif_queue = None
+pending_gifs: Dict[Tuple[str, int], Dict] = {}
+gif_worker_task = None
+
+async def gif_worker():
+    """Берет траектории из gif_queue и создает для них GIF в gif_pool"""
+    loop = asyncio.get_running_loop()
+    while True:
+        key = await gif_queue.get()
+        job = pending_gifs.pop(key)
+        try:
+            gif_path = await loop.run_in_executor(gif_pool, gif_generator.create_trajectory_gif, *job['args'])
+        except Exception as e:
+            for future in job['futures']:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future in job['futures']:
+                if not future.done():
+                    future.set_result(gif_path)
+
+async def create_trajectory_gif(video_path: str, trajectory: List[Dict], trajectory_id: int,
+                                smoothness_factor: float = 0.1) -> str:
+    """Ставит создание GIF траектории в очередь и ждет его; ожидающее задание той же траектории обновляется"""
+    global gif_queue, gif_worker_task
+    if gif_worker_task is None:
+        # Очередь и обработчик создаются в работающем event loop сервера
+        gif_queue = asyncio.Queue()
+        gif_worker_task = asyncio.create_task(gif_worker())
+    
+    future = asyncio.get_running_loop().create_future()
+    key = (video_path, trajectory_id)
+    job = pending_gifs.get(key)
+    if job is None:
+        pending_gifs[key] = {'args': (video_path, trajectory, trajectory_id, smoothness_factor), 'futures': [future]}
+        gif_queue.put_nowait(key)
+    else:
+        job['args'] = (video_path, trajectory, trajectory_id, smoothness_factor)
+        job['futures'].append(future)
+    return await future
+
+# Загруженное видео пишем на диск кусками по 1 МБ: в памяти не держим файл целиком
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Загрузку Starlette держит во временном файле на диске (небольшую - в памяти, см. upload_fileno).
+# В Linux sendfile копирует файл в файл внутри ядра - байты видео не проходят через Python
+KERNEL_FILE_COPY = sys.platform.startswith("linux") and hasattr(os, "sendfile")
+
+def upload_fileno(upload: UploadFile) -> Optional[int]:
+    """
+    Дескриптор файла загрузки; None - если у загрузки нет настоящего файла
+    
+    Небольшую загрузку SpooledTemporaryFile держит в памяти и при запросе дескриптора
+    сам сбрасывает на диск (не больше порога спула, 1 МБ в Starlette)
+    """
+    try:
+        return upload.file.fileno()
+    except (io.UnsupportedOperation, AttributeError):
+        return None
+
+def copy_upload_file(src_fd: int, upload_path: str):
+    """Копирует временный файл загрузки в upload_path через sendfile (вызывается в потоке)"""
+    size = os.fstat(src_fd).st_size
+    with open(upload_path, "wb") as dst:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(dst.fileno(), src_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+
+@lru_cache(maxsize=64)
+def _load_analysis_cached(analysis_file: str, mtime_ns: int, size: int) -> Dict:
+    """Читает и разбирает JSON анализа; ключ кэша включает время изменения и размер файла"""
+    with open(analysis_file, 'rb') as f:
+        raw = f.read()
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        # Файлы, записанные модулем json, могут содержать NaN/Infinity, которых нет в строгом JSON
+        return json.loads(raw)
+
+def load_analysis(analysis_file: str) -> Dict:
+    """
+    Возвращает результаты анализа из JSON файла, разбирая файл только после его изменения
+    
+    Словарь общий для всех запросов - изменять его нельзя
+    """
+    stat = os.stat(analysis_file)
+    return _load_analysis_cached(analysis_file, stat.st_mtime_ns, stat.st_size)
+
+@lru_cache(maxsize=64)
+def _load_trajectories_cached(analysis_file: str, mtime_ns: int, size: int) -> Tuple[Dict, List[str]]:
+    """Траектории из результатов анализа и список их ключей, построенный один раз на версию файла"""
+    analysis_result = _load_analysis_cached(analysis_file, mtime_ns, size).get('analysis_result', {})
+    trajectories = analysis_result.get('trajectories', {})
+    if not trajectories:
+        # Попробуем альтернативный путь
+        trajectories = analysis_result.get('desire_paths', {}).get('trajectories', {})
+    return trajectories, list(trajectories.keys())
+
+def load_trajectories(analysis_file: str) -> Tuple[Dict, List[str]]:
+    """
+    Возвращает траектории анализа и их ключи по порядку: ID траектории - индекс в списке ключей
+    
+    Траектории имеют ключи типа "person_1", "person_2"; список ключей не строится заново на каждый запрос
+    """
+    stat = os.stat(analysis_file)
+    return _load_trajectories_cached(analysis_file, stat.st_mtime_ns, stat.st_size)
+
+async def read_trajectories(analysis_file: str) -> Tuple[Dict, List[str]]:
+    """load_trajectories в потоке: чтение и разбор файла после его изменения не блокируют event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, load_trajectories, analysis_file)
+
+async def save_analysis(analysis_file: str, analysis_data: Dict):
+    """
+    Сохраняет результаты анализа в JSON файл
+    
+    orjson пишет компактный UTF-8 сразу в байты и сам сериализует числа и массивы NumPy;
+    прочие объекты, как и раньше, превращаются в строки
+    """
+    content = orjson.dumps(analysis_data, default=str, option=ORJSON_OPTIONS)
+    async with aiofiles.open(analysis_file, 'wb') as f:
+        await f.write(content)
+
 # Подключаем шаблоны
 if os.path.exists("templates"):
     templates = Jinja2Templates(directory="templates")
+    templates.env.globals["static_url"] = static_url
     print("✅ Шаблоны подключены")
 
 @app.get("/", response_class=HTMLResponse)
@@ -79,23 +397,20 @@ async def upload_video(file: UploadFile = File(...)):
     try:
         # Сохраняем загруженный файл
         upload_path = f"uploads/{file.filename}"
-        with open(upload_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        print(f"📁 Видео сохранено: {upload_path}")
-        
-        # Импортируем модули для обработки
-        from backend.video_processor import VideoProcessor
-        from backend.analytics_generator import AnalyticsGenerator
-        from backend.real_video_analyzer import RealVideoAnalyzer
+        src_fd = upload_fileno(file) if KERNEL_FILE_COPY else None
+        if src_fd is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, copy_upload_file, src_fd, upload_path)
+        else:
+            async with aiofiles.open(upload_path, "wb") as buffer:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    await buffer.write(chunk)
         
-        # Создаем анализатор реального видео
-        analyzer = RealVideoAnalyzer()
+        logger.info("📁 Видео сохранено: %s", upload_path)
         
         # Обрабатываем реальное видео
-        print("🎬 Начинаем анализ видео...")
-        analysis_result = analyzer.analyze_video(upload_path)
+        logger.info("🎬 Начинаем анализ видео...")
+        analysis_result = await run_video_analysis(upload_path)
         
         # Сохраняем результаты анализа для системы оценки
         analysis_data = {
@@ -106,21 +421,21 @@ async def upload_video(file: UploadFile = File(...)):
         
         # Сохраняем в JSON файл для последующего использования
         analysis_file = f"uploads/analysis_{file.filename}.json"
-        with open(analysis_file, 'w', encoding='utf-8') as f:
-            json.dump(analysis_data, f, ensure_ascii=False, indent=2)
+        await save_analysis(analysis_file, analysis_data)
         
-        print(f"💾 Результаты анализа сохранены: {analysis_file}")
+        logger.info("💾 Результаты анализа сохранены: %s", analysis_file)
         
-        return JSONResponse({
+        return ORJSONResponse({
             "status": "success",
             "message": f"Видео {file.filename} успешно проанализировано",
             "analytics": analysis_result,
             "analysis_file": analysis_file
         })
         
-    except Exception as e:
-        print(f"❌ Ошибка обработки видео: {e}")
-        return JSONResponse({
+    except OSError as e:
+        # Файл не записался на диск или видео не открывается
+        logger.error("❌ Ошибка обработки видео: %s", e)
+        return ORJSONResponse({
             "status": "error",
             "message": f"Ошибка обработки: {str(e)}"
         }, status_code=500)
@@ -141,49 +456,23 @@ async def demo_page(request: Request):
 @app.get("/test", response_class=HTMLResponse)
 async def test_page(request: Request):
     """Тестовая страница для отладки"""
-    with open("test_server_debug.html", "r", encoding="utf-8") as f:
-        content = f.read()
-    return HTMLResponse(content=content)
+    return FileResponse("test_server_debug.html", media_type="text/html")
 
 @app.get("/test-progress", response_class=HTMLResponse)
 async def test_progress_page(request: Request):
     """Тестовая страница для проверки прогресс-бара"""
-    with open("test_progress_fix.html", "r", encoding="utf-8") as f:
-        content = f.read()
-    return HTMLResponse(content=content)
+    return FileResponse("test_progress_fix.html", media_type="text/html")
 
 @app.get("/debug-static")
 async def debug_static():
-    """Отладочная информация о статических файлах"""
-    static_info = {}
-    
-    static_files = [
-        "static/js/script.js",
-        "static/css/style.css",
-        "static/js/analytics.js",
-        "static/js/trajectory_rating.js"
-    ]
+    """Отладочная информация о статических файлах (отчет пересобирается не чаще раза в STATIC_REPORT_TTL секунд)"""
+    global static_report, static_report_time
+    now = time.monotonic()
+    if now - static_report_time > STATIC_REPORT_TTL:
+        static_report = build_static_report()
+        static_report_time = now
     
-    for file_path in static_files:
-        if os.path.exists(file_path):
-            file_size = os.path.getsize(file_path)
-            static_info[file_path] = {
-                "exists": True,
-                "size": file_size,
-                "readable": os.access(file_path, os.R_OK)
-            }
-        else:
-            static_info[file_path] = {
-                "exists": False,
-                "size": 0,
-                "readable": False
-            }
-    
-    return JSONResponse({
-        "static_files": static_info,
-        "static_dir_exists": os.path.exists("static"),
-        "current_working_dir": os.getcwd()
-    })
+    return ORJSONResponse(static_report, headers={"Cache-Control": f"max-age={STATIC_REPORT_TTL}"})
 
 # ===== API для системы оценки траекторий =====
 
@@ -191,42 +480,26 @@ async def debug_static():
 async def trajectory_rating_page(request: Request, video_filename: str, trajectory_id: int):
     """Страница для оценки конкретной траектории"""
     try:
-        # Получаем информацию о траектории
-        evaluator = TrajectoryEvaluator()
-        gif_generator = TrajectoryGifGenerator()
-        
-        # Загружаем результаты анализа
+        # Загружаем результаты анализа и получаем реальные траектории
         analysis_file = f"uploads/analysis_{video_filename}.json"
-        if not os.path.exists(analysis_file):
-            return JSONResponse({
-                "status": "error",
-                "message": "Анализ видео не найден. Сначала загрузите и проанализируйте видео."
-            }, status_code=404)
-        
-        with open(analysis_file, 'r', encoding='utf-8') as f:
-            analysis_data = json.load(f)
+        trajectories, trajectory_keys = await read_trajectories(analysis_file)
         
-        # Отладочная информация
-        print(f"🔍 Анализ данных: {analysis_data.keys()}")
-        if 'analysis_result' in analysis_data:
-            print(f"📊 Результат анализа: {analysis_data['analysis_result'].keys()}")
+        # Отладочная информация (файл уже разобран и лежит в кэше)
+        if logger.isEnabledFor(logging.DEBUG):
+            analysis_data = load_analysis(analysis_file)
+            logger.debug("🔍 Анализ данных: %s", analysis_data.keys())
+            if 'analysis_result' in analysis_data:
+                logger.debug("📊 Результат анализа: %s", analysis_data['analysis_result'].keys())
         
-        # Получаем реальные траектории
-        trajectories = analysis_data.get('analysis_result', {}).get('trajectories', {})
         if not trajectories:
-            # Попробуем альтернативный путь
-            trajectories = analysis_data.get('analysis_result', {}).get('desire_paths', {}).get('trajectories', {})
-            if not trajectories:
-                return JSONResponse({
-                    "status": "error",
-                    "message": "Траектории не найдены в анализе. Возможно, видео не содержит движущихся людей."
-                }, status_code=404)
-        
-        # Получаем конкретную траекторию
-        # Траектории имеют ключи типа "person_1", "person_2", поэтому нужно найти по индексу
-        trajectory_keys = list(trajectories.keys())
+            return ORJSONResponse({
+                "status": "error",
+                "message": "Траектории не найдены в анализе. Возможно, видео не содержит движущихся людей."
+            }, status_code=404)
+        
+        # Получаем конкретную траекторию по индексу в списке ключей
         if trajectory_id >= len(trajectory_keys):
-            return JSONResponse({
+            return ORJSONResponse({
                 "status": "error",
                 "message": f"Траектория {trajectory_id} не найдена. Всего траекторий: {len(trajectory_keys)}"
             }, status_code=404)
@@ -234,10 +507,10 @@ async def trajectory_rating_page(request: Request, video_filename: str, trajecto
         trajectory_key = trajectory_keys[trajectory_id]
         trajectory = trajectories[trajectory_key]
         
-        print(f"🎯 Найдена траектория: {trajectory_key} (ID: {trajectory_id})")
+        logger.debug("🎯 Найдена траектория: %s (ID: %s)", trajectory_key, trajectory_id)
         
         # Создаем GIF для траектории
-        gif_path = gif_generator.create_trajectory_gif(
+        gif_path = await create_trajectory_gif(
             f"uploads/{video_filename}", 
             trajectory, 
             trajectory_id
@@ -251,105 +524,95 @@ async def trajectory_rating_page(request: Request, video_filename: str, trajecto
             "gif_path": gif_path
         })
         
-    except Exception as e:
-        print(f"❌ Ошибка загрузки страницы оценки: {e}")
-        return JSONResponse({
+    except FileNotFoundError:
+        return ORJSONResponse({
             "status": "error",
-            "message": f"Ошибка: {str(e)}"
-        }, status_code=500)
+            "message": "Анализ видео не найден. Сначала загрузите и проанализируйте видео."
+        }, status_code=404)
 
 @app.post("/api/rate-trajectory")
 async def rate_trajectory(request: Request):
     """API для оценки траектории"""
-    try:
-        data = await request.json()
-        print(f"📥 Получены данные для оценки: {data}")
-        
-        video_filename = data.get('video_filename')
-        trajectory_id = data.get('trajectory_id')
-        rating = data.get('rating')
-        comment = data.get('comment', '')
-        smoothness_factor = data.get('smoothness_factor', 0.1)
-        
-        print(f"🔍 Извлеченные данные: video_filename={video_filename}, trajectory_id={trajectory_id}, rating={rating}")
-        
-        if not video_filename or trajectory_id is None or not rating:
-            print(f"❌ Недостаточно данных: video_filename={bool(video_filename)}, trajectory_id={trajectory_id} (тип: {type(trajectory_id)}), rating={bool(rating)}")
-            return JSONResponse({
-                "status": "error",
-                "message": "Недостаточно данных"
-            }, status_code=400)
-        
-        evaluator = TrajectoryEvaluator()
-        
-        success = evaluator.rate_trajectory(
-            video_filename=video_filename,
-            trajectory_id=trajectory_id,
-            rating=rating,
-            comment=comment,
-            smoothness_factor=smoothness_factor
-        )
-        
-        if success:
-            return JSONResponse({
-                "status": "success",
-                "message": "Оценка сохранена"
-            })
-        else:
-            return JSONResponse({
-                "status": "error",
-                "message": "Ошибка сохранения оценки"
-            }, status_code=400)
-            
-    except Exception as e:
-        print(f"❌ Ошибка оценки траектории: {e}")
-        return JSONResponse({
+    data = await read_json_body(request)
+    if data is None:
+        return invalid_json_response()
+    
+    logger.debug("📥 Получены данные для оценки: %s", data)
+    
+    video_filename = data.get('video_filename')
+    trajectory_id = data.get('trajectory_id')
+    rating = data.get('rating')
+    comment = data.get('comment', '')
+    smoothness_factor = data.get('smoothness_factor', 0.1)
+    
+    logger.debug("🔍 Извлеченные данные: video_filename=%s, trajectory_id=%s, rating=%s",
+                 video_filename, trajectory_id, rating)
+    
+    if not video_filename or trajectory_id is None or not rating:
+        logger.warning("❌ Недостаточно данных: video_filename=%s, trajectory_id=%s (тип: %s), rating=%s",
+                       bool(video_filename), trajectory_id, type(trajectory_id), bool(rating))
+        return ORJSONResponse({
             "status": "error",
-            "message": f"Ошибка: {str(e)}"
-        }, status_code=500)
+            "message": "Недостаточно данных"
+        }, status_code=400)
+    
+    if not is_int(trajectory_id):
+        return invalid_field_response("trajectory_id")
+    if not is_int(rating):
+        return invalid_field_response("rating")
+    
+    success = trajectory_evaluator.rate_trajectory(
+        video_filename=video_filename,
+        trajectory_id=trajectory_id,
+        rating=rating,
+        comment=comment,
+        smoothness_factor=smoothness_factor
+    )
+    
+    if success:
+        return ORJSONResponse({
+            "status": "success",
+            "message": "Оценка сохранена"
+        })
+    else:
+        return ORJSONResponse({
+            "status": "error",
+            "message": "Ошибка сохранения оценки"
+        }, status_code=400)
 
 @app.post("/api/regenerate-gif")
 async def regenerate_gif(request: Request):
     """API для пересоздания GIF с новыми параметрами плавности"""
+    data = await read_json_body(request)
+    if data is None:
+        return invalid_json_response()
+    
     try:
-        data = await request.json()
         video_filename = data.get('video_filename')
         trajectory_id = data.get('trajectory_id')
         smoothness_factor = data.get('smoothness_factor', 0.1)
         
         if not all([video_filename, trajectory_id]):
-            return JSONResponse({
+            return ORJSONResponse({
                 "status": "error",
                 "message": "Недостаточно данных"
             }, status_code=400)
         
-        gif_generator = TrajectoryGifGenerator()
+        if not is_int(trajectory_id):
+            return invalid_field_response("trajectory_id")
         
         # Загружаем реальную траекторию из анализа
         analysis_file = f"uploads/analysis_{video_filename}.json"
-        if not os.path.exists(analysis_file):
-            return JSONResponse({
+        trajectories, trajectory_keys = await read_trajectories(analysis_file)
+        if not trajectories:
+            return ORJSONResponse({
                 "status": "error",
-                "message": "Анализ видео не найден"
+                "message": "Траектории не найдены в анализе"
             }, status_code=404)
         
-        with open(analysis_file, 'r', encoding='utf-8') as f:
-            analysis_data = json.load(f)
-        
-        trajectories = analysis_data.get('analysis_result', {}).get('trajectories', {})
-        if not trajectories:
-            # Попробуем альтернативный путь
-            trajectories = analysis_data.get('analysis_result', {}).get('desire_paths', {}).get('trajectories', {})
-            if not trajectories:
-                return JSONResponse({
-                    "status": "error",
-                    "message": "Траектории не найдены в анализе"
-                }, status_code=404)
-        
-        # Траектории имеют ключи типа "person_1", "person_2", поэтому нужно найти по индексу
-        trajectory_keys = list(trajectories.keys())
+        # Траектория по индексу в списке ключей
         if trajectory_id >= len(trajectory_keys):
-            return JSONResponse({
+            return ORJSONResponse({
                 "status": "error",
                 "message": f"Траектория {trajectory_id} не найдена. Всего траекторий: {len(trajectory_keys)}"
             }, status_code=404)
@@ -357,91 +620,69 @@ async def regenerate_gif(request: Request):
         trajectory_key = trajectory_keys[trajectory_id]
         trajectory = trajectories[trajectory_key]
         
-        print(f"🎯 Найдена траектория для GIF: {trajectory_key} (ID: {trajectory_id})")
+        logger.debug("🎯 Найдена траектория для GIF: %s (ID: %s)", trajectory_key, trajectory_id)
         
-        gif_path = gif_generator.create_trajectory_gif(
+        gif_path = await create_trajectory_gif(
             f"uploads/{video_filename}",
             trajectory,
             trajectory_id,
             smoothness_factor
         )
         
-        return JSONResponse({
+        return ORJSONResponse({
             "status": "success",
             "gif_path": gif_path
         })
         
-    except Exception as e:
-        print(f"❌ Ошибка создания GIF: {e}")
-        return JSONResponse({
+    except FileNotFoundError:
+        return ORJSONResponse({
             "status": "error",
-            "message": f"Ошибка: {str(e)}"
-        }, status_code=500)
+            "message": "Анализ видео не найден"
+        }, status_code=404)
 
 @app.get("/api/video-statistics/{video_filename}")
 async def get_video_statistics(video_filename: str):
     """API для получения статистики оценок видео"""
-    try:
-        evaluator = TrajectoryEvaluator()
-        stats = evaluator.get_video_statistics(video_filename)
-        
-        return JSONResponse({
-            "status": "success",
-            "statistics": stats
-        })
-        
-    except Exception as e:
-        print(f"❌ Ошибка получения статистики: {e}")
-        return JSONResponse({
-            "status": "error",
-            "message": f"Ошибка: {str(e)}"
-        }, status_code=500)
+    stats = trajectory_evaluator.get_video_statistics(video_filename)
+    
+    return ORJSONResponse({
+        "status": "success",
+        "statistics": stats
+    })
 
 @app.get("/api/learning-recommendations")
 async def get_learning_recommendations():
     """API для получения рекомендаций по обучению"""
-    try:
-        evaluator = TrajectoryEvaluator()
-        recommendations = evaluator.get_learning_recommendations()
-        
-        return JSONResponse({
-            "status": "success",
-            "recommendations": recommendations
-        })
-        
-    except Exception as e:
-        print(f"❌ Ошибка получения рекомендаций: {e}")
-        return JSONResponse({
-            "status": "error",
-            "message": f"Ошибка: {str(e)}"
-        }, status_code=500)
+    recommendations = trajectory_evaluator.get_learning_recommendations()
+    
+    return ORJSONResponse({
+        "status": "success",
+        "recommendations": recommendations
+    })
 
 @app.post("/analyze-demo-video")
 async def analyze_demo_video(request: Request):
     """API для анализа демо-видео"""
+    # Получаем данные из запроса
+    data = await read_json_body(request)
+    if data is None:
+        return invalid_json_response()
+    
     try:
-        # Получаем данные из запроса
-        data = await request.json()
         video_path = data.get('video_path')
         video_name = data.get('video_name')
         
         if not video_path or not os.path.exists(video_path):
-            return JSONResponse({
+            return ORJSONResponse({
                 "status": "error",
                 "message": "Демо-видео не найдено"
             }, status_code=404)
         
-        print(f"🎬 Анализируем демо-видео: {video_name} ({video_path})")
-        
-        # Импортируем модули для обработки
-        from backend.real_video_analyzer import RealVideoAnalyzer
-        
-        # Создаем анализатор реального видео
-        analyzer = RealVideoAnalyzer()
+        logger.info("🎬 Анализируем демо-видео: %s (%s)", video_name, video_path)
         
         # Обрабатываем демо-видео
-        print("🎬 Начинаем анализ демо-видео...")
-        analysis_result = analyzer.analyze_video(video_path)
+        logger.info("🎬 Начинаем анализ демо-видео...")
+        analysis_result = await run_video_analysis(video_path)
         
         # Сохраняем результаты анализа для системы оценки
         analysis_data = {
@@ -452,34 +693,31 @@ async def analyze_demo_video(request: Request):
         
         # Сохраняем в JSON файл для последующего использования
         analysis_file = f"uploads/analysis_{os.path.basename(video_path)}.json"
-        with open(analysis_file, 'w', encoding='utf-8') as f:
-            json.dump(analysis_data, f, ensure_ascii=False, indent=2, default=str)
+        await save_analysis(analysis_file, analysis_data)
         
-        print(f"✅ Результаты анализа демо-видео сохранены: {analysis_file}")
+        logger.info("✅ Результаты анализа демо-видео сохранены: %s", analysis_file)
         
-        return JSONResponse({
+        return ORJSONResponse({
             "status": "success",
             "message": f"Демо-видео '{video_name}' успешно проанализировано",
             "analysis_result": analysis_result
         })
         
-    except Exception as e:
-        print(f"❌ Ошибка анализа демо-видео: {e}")
-        return JSONResponse({
+    except OSError as e:
+        # Видео не открывается или результаты не записались
+        logger.error("❌ Ошибка анализа демо-видео: %s", e)
+        return ORJSONResponse({
             "status": "error",
             "message": f"Ошибка анализа демо-видео: {str(e)}"
         }, status_code=500)
 
 if __name__ == "__main__":
     print("🚀 Запускаем Aura сервер...")
-    
-    # Создаем необходимые папки
-    os.makedirs("uploads", exist_ok=True)
-    os.makedirs("static/heatmaps", exist_ok=True)
-    os.makedirs("static/images", exist_ok=True)
-    os.makedirs("static/trajectory_gifs", exist_ok=True)
-    
     print("📂 Структура проекта готова")
     print("🌐 Сервер будет доступен на: http://127.0.0.1:8000")
     
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    # uvloop и httptools (uvicorn[standard]) uvicorn подхватывает сам, если они установлены.
+    # Процесс по умолчанию один: прогресс анализа и кэши живут в памяти процесса, и с несколькими
+    # процессами опрос /get-progress попадал бы не в тот процесс, который анализирует видео
+    workers = int(os.environ.get("AURA_WORKERS", "1"))
+    uvicorn.run("simple_server:app" if workers > 1 else app, host="127.0.0.1", port=8000, workers=workers)
\ No newline at end of file